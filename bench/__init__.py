@@ -0,0 +1,17 @@
+"""
+Benchmarks for the hot paths of bot/db.py, bot/utils.py and bot/distributor.py
+on synthetic production-size databases (bench/synth.py).
+
+    python -m bench.run --scale small                # run, print results
+    python -m bench.run --scale full --save          # write bench/baselines/full.json
+    python -m bench.run --scale full --check         # compare with the baseline (exit 1 on regression)
+
+Synthetic DBs are built once per scale and cached in BENCH_DATA_DIR
+(default /tmp/bench); every benchmark that writes restores a fresh copy.
+
+Join run simulation (bench/simulate.py) on the fake Telegram backend
+(bot/fake_telegram.py) with a virtual clock:
+
+    python -m bench.simulate --sessions 300 --hours 24 --save base.json
+    python -m bench.simulate --sessions 300 --hours 24 --compare base.json
+"""
@@ -0,0 +1,362 @@
+# bench/run.py
+"""
+python -m bench.run [--scale full|small|tiny] [--only NAME] [--repeats N]
+                    [--save] [--check] [--threshold 0.25] [--rebuild]
+
+Prints one line per benchmark (median / min seconds, ops/s); --save writes
+bench/baselines/<scale>.json, --check compares the medians with it and
+exits 1 when any benchmark is slower than baseline * (1 + threshold).
+Baselines are machine specific: save and check on the same host.
+"""
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("bench")
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# concurrent writer processes in the contention benchmark, and writes each
+CONTENTION_WRITERS = 8
+CONTENTION_WRITES = 200
+
+
+def _bind_env(scale: str) -> None:
+    """
+    bot.config reads the environment at import: point DB_PATH at the work
+    copy, satisfy the required settings, keep metrics/diagnostics off.
+    """
+    from bench.synth import work_db_path
+
+    os.environ["DB_PATH"] = work_db_path(scale)
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["DIAGNOSTICS_ENABLED"] = "0"
+    for key, value in (("API_ID", "1"), ("API_HASH", "bench"), ("BOT_TOKEN", "bench"), ("OWNER_ID", "1")):
+        os.environ.setdefault(key, value)
+
+
+class Bench:
+    def __init__(self, name: str, fn: Callable, ops: Callable[[Dict], int], mutates: bool, repeats: int):
+        self.name = name
+        self.fn = fn
+        self.ops = ops
+        self.mutates = mutates
+        self.repeats = repeats
+
+
+BENCHMARKS: List[Bench] = []
+
+
+def benchmark(name: str, ops: Callable[[Dict], int] = lambda n: 1, mutates: bool = False, repeats: int = 5):
+    """
+    fn(ctx) runs the measured workload once. It may return {"seconds": s}
+    to report its own timing (e.g. excluding process start) plus extra fields.
+    Mutating benchmarks get a fresh DB copy before every repeat (not timed).
+    """
+    def deco(fn):
+        BENCHMARKS.append(Bench(name, fn, ops, mutates, repeats))
+        return fn
+    return deco
+
+
+# ---------------- db ----------------
+ADD_LINKS_BATCH = 10_000
+
+
+@benchmark("db.add_links", ops=lambda n: ADD_LINKS_BATCH, mutates=True)
+def bench_add_links(ctx):
+    from bot import db
+
+    now = time.time()
+    links = [(f"https://t.me/bench_new_{i}", i, now - i) for i in range(ADD_LINKS_BATCH)]
+    db.add_links(links, source_channel="https://t.me/bench_source")
+
+
+@benchmark("db.assign_unassigned_links", ops=lambda n: 1000, mutates=True)
+def bench_assign(ctx):
+    from bot import db
+
+    db.assign_unassigned_links(1, 1000)
+
+
+@benchmark("distributor.distribute_links_to_sessions", ops=lambda n: n["sessions"], mutates=True, repeats=3)
+def bench_distribute(ctx):
+    from bot.distributor import distribute_links_to_sessions
+
+    report = distribute_links_to_sessions()
+    return {"assigned": report.get("assigned_total")}
+
+
+REPLACE_CALLS = 200
+
+
+@benchmark("db.replace_dead_assignment", ops=lambda n: REPLACE_CALLS, mutates=True)
+def bench_replace_dead(ctx):
+    from bot import db
+
+    targets = ctx["pending_rows"][:REPLACE_CALLS]
+    t0 = time.perf_counter()
+    for session_id, link_id in targets:
+        db.replace_dead_assignment(session_id, link_id, "bench")
+    return {"seconds": time.perf_counter() - t0}
+
+
+@benchmark("db.get_pending_links_for_session", ops=lambda n: n["sessions"])
+def bench_pending(ctx):
+    from bot import db
+
+    for sid in range(1, ctx["scale"]["sessions"] + 1):
+        db.get_pending_links_for_session(sid, limit=1000)
+
+
+@benchmark("db.get_stats", repeats=3)
+def bench_stats(ctx):
+    from bot import db
+
+    db.get_stats()
+
+
+@benchmark("db.get_session_join_stats", repeats=3)
+def bench_join_stats(ctx):
+    from bot import db
+
+    db.get_session_join_stats(168)
+
+
+# ---------------- utils ----------------
+@benchmark("utils.extract_telegram_links", ops=lambda n: n["messages"])
+def bench_extract(ctx):
+    from bot.utils import extract_telegram_links
+
+    found = 0
+    for text in ctx["corpus"]:
+        found += len(extract_telegram_links(text))
+    return {"links": found}
+
+
+@benchmark("utils.normalize_tme_link", ops=lambda n: 0)
+def bench_normalize(ctx):
+    from bot.utils import normalize_tme_link
+
+    raw = ctx["raw_links"]
+    for link in raw:
+        normalize_tme_link(link)
+    return {"ops": len(raw)}
+
+
+# ---------------- lock contention ----------------
+def _writer(scale: str, session_id: int, writes: int, barrier, results) -> None:
+    _bind_env(scale)
+    from bot import db
+
+    rows = db.get_pending_links_for_session(session_id, limit=writes)
+    barrier.wait()
+
+    locked = 0
+    t0 = time.perf_counter()
+    for link_id, link in rows:
+        try:
+            db.mark_join_success(session_id, link_id)
+            db.log_join(session_id, link, "success", "")
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+    results.put((len(rows) * 2, time.perf_counter() - t0, locked))
+
+
+@benchmark("db.concurrent_writers", ops=lambda n: 0, mutates=True, repeats=3)
+def bench_contention(ctx):
+    """
+    CONTENTION_WRITERS processes (like sharded join workers) marking joins
+    on their own sessions at the same time; timed from a common start.
+    """
+    mpc = mp.get_context("spawn")
+    writers = min(CONTENTION_WRITERS, ctx["scale"]["sessions"])
+    barrier = mpc.Barrier(writers)
+    results = mpc.Queue()
+
+    procs = [
+        mpc.Process(target=_writer, args=(ctx["scale_name"], sid, CONTENTION_WRITES, barrier, results))
+        for sid in range(1, writers + 1)
+    ]
+    for p in procs:
+        p.start()
+    out = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    return {
+        "seconds": max(r[1] for r in out),
+        "ops": sum(r[0] for r in out),
+        "writers": writers,
+        "locked_errors": sum(r[2] for r in out),
+    }
+
+
+# ---------------- runner ----------------
+def _context(scale_name: str, scale: Dict[str, int]) -> Dict[str, Any]:
+    from bench.synth import message_corpus
+    from bot.utils import extract_telegram_links
+    from bot import db
+
+    corpus = message_corpus(scale["messages"])
+    raw_links = [link for text in corpus for link in extract_telegram_links(text)]
+
+    with db.get_conn() as conn:
+        pending_rows = [
+            (r["session_id"], r["link_id"])
+            for r in conn.execute("""
+                SELECT session_id, link_id FROM assignments
+                WHERE join_status='pending'
+                ORDER BY link_id
+                LIMIT 1000
+            """).fetchall()
+        ]
+
+    return {
+        "scale_name": scale_name,
+        "scale": scale,
+        "corpus": corpus,
+        "raw_links": raw_links,
+        "pending_rows": pending_rows,
+    }
+
+
+def run_benchmarks(scale_name: str, only: Optional[str] = None, repeats: Optional[int] = None) -> Dict[str, Dict]:
+    from bench.synth import SCALES, restore_work_db
+
+    scale = SCALES[scale_name]
+    restore_work_db(scale_name)
+    ctx = _context(scale_name, scale)
+
+    results: Dict[str, Dict] = {}
+    for b in BENCHMARKS:
+        if only and only not in b.name:
+            continue
+
+        times: List[float] = []
+        extra: Dict[str, Any] = {}
+        for _ in range(repeats or b.repeats):
+            if b.mutates:
+                restore_work_db(scale_name)
+            t0 = time.perf_counter()
+            out = b.fn(ctx) or {}
+            elapsed = time.perf_counter() - t0
+            times.append(out.pop("seconds", elapsed))
+            extra = out
+
+        if b.mutates:
+            restore_work_db(scale_name)
+
+        ops = extra.pop("ops", None) or b.ops(scale)
+        median = statistics.median(times)
+        results[b.name] = {
+            "median_s": round(median, 6),
+            "min_s": round(min(times), 6),
+            "max_s": round(max(times), 6),
+            "repeats": len(times),
+            "ops": ops,
+            "ops_per_s": round(ops / median, 1) if ops and median > 0 else None,
+            **extra,
+        }
+        r = results[b.name]
+        print(
+            f"{b.name:45s} median {r['median_s']:10.4f}s  min {r['min_s']:10.4f}s"
+            + (f"  {r['ops_per_s']:>12,.0f} ops/s" if r["ops_per_s"] else "")
+            + (f"  {extra}" if extra else ""),
+            flush=True,
+        )
+
+    return results
+
+
+def baseline_path(scale_name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{scale_name}.json")
+
+
+def save_baseline(scale_name: str, results: Dict[str, Dict]) -> str:
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(scale_name)
+    doc = {
+        "scale": scale_name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return path
+
+
+def check_regressions(scale_name: str, results: Dict[str, Dict], threshold: float) -> List[str]:
+    """
+    Names (with numbers) of benchmarks whose median is above baseline * (1 + threshold).
+    """
+    with open(baseline_path(scale_name), encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        limit = base["median_s"] * (1 + threshold)
+        if r["median_s"] > limit:
+            regressions.append(
+                f"{name}: {r['median_s']:.4f}s vs baseline {base['median_s']:.4f}s "
+                f"(+{(r['median_s'] / base['median_s'] - 1) * 100:.0f}%)"
+            )
+    return regressions
+
+
+def main() -> None:
+    from bench.synth import SCALES
+
+    parser = argparse.ArgumentParser(description="Benchmarks on synthetic production-size DBs")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--only", help="run benchmarks whose name contains this")
+    parser.add_argument("--repeats", type=int, help="override repeats per benchmark")
+    parser.add_argument("--save", action="store_true", help="write results as the baseline")
+    parser.add_argument("--check", action="store_true", help="fail on regressions against the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown (0.25 = +25%%)")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the synthetic DB")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    _bind_env(args.scale)
+
+    from bench.synth import build_db
+
+    build_db(args.scale, force=args.rebuild)
+    results = run_benchmarks(args.scale, only=args.only, repeats=args.repeats)
+
+    if args.save:
+        print(f"baseline saved: {save_baseline(args.scale, results)}")
+
+    if args.check:
+        if not os.path.exists(baseline_path(args.scale)):
+            print(f"no baseline for scale '{args.scale}' (run with --save first)")
+            sys.exit(2)
+        regressions = check_regressions(args.scale, results, args.threshold)
+        if regressions:
+            print(f"\nREGRESSIONS (threshold +{args.threshold * 100:.0f}%):")
+            for line in regressions:
+                print(f"- {line}")
+            sys.exit(1)
+        print(f"\nno regressions (threshold +{args.threshold * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
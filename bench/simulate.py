@@ -0,0 +1,273 @@
+# bench/simulate.py
+"""
+python -m bench.simulate [--sessions 300] [--hours 24] [--links N] [--seed 1]
+                         [--join-limit 20/3600] [--dead-ratio 0.03] [--request-ratio 0.05]
+                         [--channels 4] [--replay trace.jsonl] [--save out.json] [--compare base.json]
+                         [--db PATH] [--log-level error]
+
+A join run of the real bot code (distributor, JoinScheduler, SessionJoiner,
+extractor) against the fake Telegram backend (bot/fake_telegram.py) on a
+virtual clock: no accounts, no network, hours of run time in seconds/minutes.
+
+The DB is rebuilt every time (--db, default on tmpfs: every join step still
+commits to SQLite). The default 300 sessions x 24 h run takes about a minute.
+--replay takes
+per-link outcomes from a trace recorded on real clients (RPC_TRACE_PATH);
+its links are added first. --save writes the summary; --compare prints the
+difference with a saved one (same seed/options => only code changes differ).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger("bench.simulate")
+
+SOURCE_CHANNEL = "https://t.me/sim_source"
+
+# summary numbers shown by --compare
+COMPARE_KEYS = (
+    "success", "requested", "failed", "retried", "joins_per_hour",
+    "joins_per_session_hour", "flood_waits", "flood_wait_seconds", "rpcs", "pending_left",
+)
+
+
+def _bind_env(db_path: str) -> None:
+    """
+    bot.config reads the environment at import: fresh simulation DB,
+    placeholder credentials, no metrics/diagnostics/trace recording.
+    """
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    os.environ["DB_PATH"] = db_path
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["DIAGNOSTICS_ENABLED"] = "0"
+    os.environ["RPC_TRACE_PATH"] = ""
+    for key, value in (("API_ID", "1"), ("API_HASH", "sim"), ("BOT_TOKEN", "sim"), ("OWNER_ID", "1")):
+        os.environ.setdefault(key, value)
+
+
+def trace_links(path: str) -> List[str]:
+    """
+    Links behind the join RPCs of a recorded trace.
+    """
+    forms = {
+        "ImportChatInviteRequest": "https://t.me/+{}",
+        "JoinChannelRequest": "https://t.me/{}",
+        "JoinChatlistInviteRequest": "https://t.me/addlist/{}",
+        "CheckChatlistInviteRequest": "https://t.me/addlist/{}",
+    }
+    links = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            form = forms.get(rec.get("method"))
+            if form and rec.get("target"):
+                links[form.format(rec["target"])] = None
+    return list(links)
+
+
+def synthetic_links(count: int, seed: int) -> List[str]:
+    """
+    ~5% invite links, ~1% folders, the rest public usernames.
+    """
+    rnd = random.Random(seed)
+    links = []
+    for i in range(count):
+        r = rnd.random()
+        if r < 0.05:
+            links.append(f"https://t.me/+sim{seed}x{i:08d}")
+        elif r < 0.06:
+            links.append(f"https://t.me/addlist/sim{seed}x{i:08d}")
+        else:
+            links.append(f"https://t.me/sim_{seed}_{i}")
+    return links
+
+
+def seed_db(args, world) -> Dict[str, float]:
+    """
+    Sessions, source channels (fake histories, scanned by the real extractor)
+    and synthetic links up to --links. Returns extraction numbers.
+    """
+    from bench.synth import message_corpus
+    from bot import db
+
+    db.init_db()
+    db.add_sessions_bulk([
+        (f"sim-session-{i:05d}-" + "x" * 100, f"+1555{i:07d}", 2) for i in range(args.sessions)
+    ])
+
+    links: List[str] = trace_links(args.replay) if args.replay else []
+    db.add_links(links, source_channel=SOURCE_CHANNEL)
+
+    extraction = {"channels": args.channels, "messages": 0, "links": 0, "seconds": 0.0}
+    for c in range(args.channels):
+        world.add_channel(f"sim_source_{c}", message_corpus(args.messages, seed=args.seed + c))
+    if args.channels:
+        _run(_extract(args, extraction))
+
+    with db.get_conn() as conn:
+        have = conn.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+    db.add_links(synthetic_links(max(0, args.links - have), args.seed), source_channel=SOURCE_CHANNEL)
+    return extraction
+
+
+async def _extract(args, extraction: dict) -> dict:
+    from bot import db
+    from bot.extractor import extract_links_from_channel
+
+    session_string = db.list_sessions()[0][1]
+    t0 = time.perf_counter()
+    for c in range(args.channels):
+        channel = f"https://t.me/sim_source_{c}"
+        found = await extract_links_from_channel(session_string, channel)
+        db.add_links(found, source_channel=channel)
+        extraction["messages"] += args.messages
+        extraction["links"] += len(found)
+    extraction["seconds"] = round(time.perf_counter() - t0, 3)
+    return extraction
+
+
+def _run(coro):
+    from bot.fake_telegram import run_virtual
+
+    return run_virtual(coro)
+
+
+async def _join_run(hours: float) -> Tuple[list, dict, dict]:
+    """
+    distribute + one JoinScheduler run over every session, stopped after `hours`.
+    """
+    from bot import db
+    from bot.distributor import distribute_links_to_sessions
+    from bot.scheduler import JoinScheduler, add_run_sessions
+
+    distribution = distribute_links_to_sessions()
+
+    sessions = [(sid, s) for sid, s, _, _ in db.list_assignable_sessions()]
+    run_id = db.create_join_run(0, [sid for sid, _ in sessions])
+
+    stop = asyncio.Event()
+    scheduler = JoinScheduler(stop, run_id=run_id)
+    add_run_sessions(scheduler, run_id, sessions)
+    asyncio.get_running_loop().call_later(hours * 3600, stop.set)
+
+    results = await scheduler.run()
+    db.finish_join_run(run_id, "stopped" if stop.is_set() else "done")
+    return results, distribution, scheduler.stats()
+
+
+def simulate(args) -> dict:
+    from bot import db
+    from bot.clients import set_client_factory
+    from bot.fake_telegram import FLOOD_LIMITS, FakeWorld, VirtualClock, run_virtual
+
+    random.seed(args.seed)
+    calls, window = (float(x) for x in args.join_limit.split("/", 1))
+    limits = {m: ((b, int(calls), window) if b == "join" else (b, n, w)) for m, (b, n, w) in FLOOD_LIMITS.items()}
+
+    world = FakeWorld(
+        seed=args.seed, dead_ratio=args.dead_ratio, request_ratio=args.request_ratio, flood_limits=limits,
+    )
+    if args.replay:
+        logger.info(f"[sim] replaying {world.load_trace(args.replay)} link outcomes from {args.replay}")
+    set_client_factory(world.client)
+
+    wall0 = time.perf_counter()
+    extraction = seed_db(args, world)
+
+    clock = VirtualClock()
+    results, distribution, sched = run_virtual(_join_run(args.hours), clock)
+    virtual_hours = clock.elapsed / 3600
+
+    totals = {k: sum(r.get(k, 0) for r in results) for k in ("success", "failed", "requested", "retried", "topped_up")}
+    rpc = world.summary()
+    flood_waits = sum(
+        n for outcomes in rpc["by_method"].values() for outcome, n in outcomes.items() if outcome == "FloodWaitError"
+    )
+    with db.get_conn() as conn:
+        pending_left = conn.execute("SELECT COUNT(*) FROM assignments WHERE join_status='pending'").fetchone()[0]
+
+    return {
+        "options": {k: v for k, v in vars(args).items() if k not in ("save", "compare", "db", "log_level")},
+        "wall_seconds": round(time.perf_counter() - wall0, 1),
+        "virtual_hours": round(virtual_hours, 2),
+        "sessions": len(results),
+        "assigned": distribution.get("assigned_total"),
+        **totals,
+        "pending_left": pending_left,
+        "joins_per_hour": round(totals["success"] / virtual_hours, 1) if virtual_hours else None,
+        "joins_per_session_hour": round(totals["success"] / virtual_hours / max(1, len(results)), 2) if virtual_hours else None,
+        "flood_waits": flood_waits,
+        "flood_wait_seconds": rpc["flood_wait_seconds"],
+        "rpcs": rpc["rpcs"],
+        "rpcs_by_method": rpc["by_method"],
+        "scheduler_lag_max": sched.get("lag_max"),
+        "extraction": extraction,
+    }
+
+
+def compare(current: dict, baseline: dict) -> List[str]:
+    lines = []
+    for key in COMPARE_KEYS:
+        a, b = baseline.get(key), current.get(key)
+        if a is None or b is None:
+            continue
+        delta = f"{(b / a - 1) * 100:+.1f}%" if a else "n/a"
+        lines.append(f"{key:24s} {a:>12} -> {b:>12}  {delta}")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Join run simulation on the fake Telegram backend")
+    parser.add_argument("--sessions", type=int, default=300)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--links", type=int, help="links in the DB (default: 600 per session)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--join-limit", default="20/3600", help="joins allowed per window seconds (FloodWait above)")
+    parser.add_argument("--dead-ratio", type=float, default=0.03)
+    parser.add_argument("--request-ratio", type=float, default=0.05)
+    parser.add_argument("--channels", type=int, default=4, help="source channels scanned by the extractor")
+    parser.add_argument("--messages", type=int, default=5000, help="messages per source channel")
+    parser.add_argument("--replay", help="RPC trace (JSONL) recorded with RPC_TRACE_PATH")
+    parser.add_argument("--save", help="write the summary JSON here")
+    parser.add_argument("--compare", help="summary JSON of an earlier run")
+    parser.add_argument("--db", help="simulation DB path (default /dev/shm/simulate.db or BENCH_DATA_DIR)")
+    parser.add_argument("--log-level", default="error", help="bot log level (warning shows every FloodWait)")
+    args = parser.parse_args()
+    if args.links is None:
+        args.links = args.sessions * 600
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+    from bench.synth import data_dir
+
+    if args.db is None:
+        args.db = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else data_dir(), "simulate.db")
+    _bind_env(args.db)
+
+    summary = simulate(args)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("options") != summary["options"]:
+            print("\n(warning: options differ from the compared run)", file=sys.stderr)
+        print("\n" + "\n".join(compare(summary, baseline)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# bench/synth.py
+"""
+Synthetic databases and message corpora.
+
+Rows are generated inside SQLite (recursive CTEs), so the 10M join_log rows
+of the full scale take minutes, not hours. Everything is deterministic except
+invite hashes (randomblob) and dates (relative to build time).
+"""
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+SCALES: Dict[str, Dict[str, int]] = {
+    # production size
+    "full": {"links": 1_000_000, "sessions": 500, "join_log": 10_000_000, "assigned_per_session": 800, "messages": 500_000},
+    # quick local runs
+    "small": {"links": 100_000, "sessions": 50, "join_log": 1_000_000, "assigned_per_session": 800, "messages": 50_000},
+    # smoke test of the suite itself
+    "tiny": {"links": 10_000, "sessions": 10, "join_log": 50_000, "assigned_per_session": 300, "messages": 5_000},
+}
+
+SOURCE_CHANNELS = 200
+
+
+def data_dir() -> str:
+    path = os.getenv("BENCH_DATA_DIR", "/tmp/bench")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def base_db_path(scale: str) -> str:
+    return os.path.join(data_dir(), f"{scale}.db")
+
+
+def work_db_path(scale: str) -> str:
+    return os.path.join(data_dir(), f"{scale}.work.db")
+
+
+def restore_work_db(scale: str) -> None:
+    """
+    Fresh copy of the base DB at the work path (the one bot.db is bound to).
+    """
+    from bot import db
+
+    db.close_conn()
+    work = work_db_path(scale)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(base_db_path(scale), work)
+
+
+def _populate(conn: sqlite3.Connection, n: Dict[str, int]) -> None:
+    now = time.time()
+    cte = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < ?)"
+
+    conn.execute(f"""
+        {cte}
+        INSERT INTO sessions(session_string, phone, health)
+        SELECT 'synth-session-' || printf('%06d', x) || '-' || hex(zeroblob(50)), '+1000' || x, 'ok'
+        FROM c
+    """, (n["sessions"],))
+
+    # 5% invite links, 2% dead, ages up to a year
+    conn.execute(f"""
+        {cte}
+        INSERT INTO links(link, source_channel, status, source_msg_id, source_msg_date, kind)
+        SELECT CASE WHEN x % 20 = 0 THEN 'https://t.me/+' || lower(hex(randomblob(8)))
+                    ELSE 'https://t.me/synth_' || x END,
+               'https://t.me/source_' || (x % {SOURCE_CHANNELS}),
+               CASE WHEN x % 50 = 7 THEN 'dead' ELSE 'active' END,
+               x,
+               ? - (x * 7919 % 31536000),
+               CASE WHEN x % 20 = 0 THEN 'invite' ELSE 'username' END
+        FROM c
+    """, (n["links"], now))
+
+    # first sessions * assigned_per_session active links spread over sessions
+    # (id + id / 10: every session gets rows of every status):
+    # 10% pending, 2% requested, ~8% failed, rest success
+    conn.execute("""
+        INSERT INTO assignments(link_id, session_id, join_status, join_attempts)
+        SELECT id,
+               ((id + id / 10) % ?) + 1,
+               CASE WHEN id % 10 = 0 THEN 'pending'
+                    WHEN id % 50 = 1 THEN 'requested'
+                    WHEN id % 12 = 3 THEN 'failed'
+                    ELSE 'success' END,
+               1
+        FROM links
+        WHERE status = 'active'
+        ORDER BY id
+        LIMIT ?
+    """, (n["sessions"], n["sessions"] * n["assigned_per_session"]))
+
+    # 30 days of join history with the message formats the stats parse
+    conn.execute(f"""
+        {cte}
+        INSERT INTO join_log(session_id, link, status, error_message, created_at)
+        SELECT (x % ?) + 1,
+               'https://t.me/synth_' || (x % ?),
+               CASE WHEN x % 10 < 7 THEN 'success' WHEN x % 10 = 7 THEN 'requested' ELSE 'failed' END,
+               CASE WHEN x % 10 < 6 THEN ''
+                    WHEN x % 10 = 6 THEN 'already_participant'
+                    WHEN x % 10 = 7 THEN 'invite_request_sent'
+                    WHEN x % 10 = 8 THEN 'FloodWaitError wait ' || (30 + x % 600) || 's'
+                    ELSE 'dead_link: InviteHashExpiredError' END,
+               datetime(? - (x * 104729 % 2592000), 'unixepoch')
+        FROM c
+    """, (n["join_log"], n["sessions"], n["links"], now))
+
+
+def build_db(scale: str, force: bool = False) -> str:
+    """
+    Build (or reuse) the base DB of a scale. bot.db must already be bound to
+    work_db_path(scale) (DB_PATH): the schema comes from db.init_db().
+    """
+    base = base_db_path(scale)
+    if os.path.exists(base) and not force:
+        return base
+
+    from bot import db
+
+    n = SCALES[scale]
+    work = work_db_path(scale)
+    db.close_conn()
+    for path in (work, work + "-wal", work + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    t0 = time.time()
+    logger.info(f"[bench] building {scale} DB: {n}")
+    db.init_db()
+
+    conn = sqlite3.connect(work)
+    try:
+        _populate(conn, n)
+        conn.commit()
+    finally:
+        conn.close()
+
+    db.refresh_link_priorities()
+
+    conn = sqlite3.connect(work)
+    try:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+    shutil.copyfile(work, base)
+    logger.info(f"[bench] {scale} DB built in {time.time() - t0:.0f}s ({os.path.getsize(base) >> 20} MB)")
+    return base
+
+
+def message_corpus(count: int, seed: int = 42) -> List[str]:
+    """
+    Channel-post-like texts: Arabic/English filler, 0-4 links in every
+    supported form, with the punctuation/brackets extract_telegram_links strips.
+    """
+    rnd = random.Random(seed)
+    words = ["قناة", "انضم", "رابط", "جديد", "group", "join", "channel", "free", "📢", "🔥", "—", "|"]
+    forms = [
+        "https://t.me/{u}",
+        "t.me/{u}",
+        "http://telegram.me/{u}",
+        "https://t.me/+{h}",
+        "https://t.me/joinchat/{h}",
+        "t.me/addlist/{h}",
+        "(https://t.me/{u})",
+        "https://t.me/{u}?start=ref{n}.",
+        "«https://t.me/{u}»",
+    ]
+
+    corpus = []
+    for i in range(count):
+        parts = [rnd.choice(words) for _ in range(rnd.randint(5, 40))]
+        for _ in range(rnd.choice((0, 1, 1, 2, 3, 4))):
+            link = rnd.choice(forms).format(
+                u=f"chan_{rnd.randint(1, 200_000)}",
+                h="".join(rnd.choice("abcdefABCDEF0123456789_-") for _ in range(16)),
+                n=i,
+            )
+            parts.insert(rnd.randint(0, len(parts)), link)
+        corpus.append(" ".join(parts))
+    return corpus
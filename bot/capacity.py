@@ -0,0 +1,76 @@
+# bot/capacity.py
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+from telethon import TelegramClient, errors, utils
+from telethon.tl.functions.channels import LeaveChannelRequest
+from telethon.tl.types import Channel
+
+from bot.config import AUTO_LEAVE_POLICY, AUTO_LEAVE_BATCH
+
+logger = logging.getLogger(__name__)
+
+# pause between two LeaveChannel calls (returned to the scheduler as the step delay)
+LEAVE_DELAY_SECONDS = 2
+
+
+def is_capacity_channel(entity) -> bool:
+    """
+    Channels and supergroups count toward the joined channels cap (basic groups don't).
+    """
+    return isinstance(entity, Channel) and not getattr(entity, "left", False)
+
+
+def leave_info(dialog) -> Optional[Tuple[object, float, float]]:
+    """
+    (input channel, last message ts, join ts) of a dialog auto-leave may pick,
+    None for chats that don't count toward the cap or that we own / administer.
+    Kept in the dialog snapshot, so picking needs no extra iter_dialogs pass.
+    """
+    entity = dialog.entity
+    if not is_capacity_channel(entity):
+        return None
+    if getattr(entity, "creator", False) or getattr(entity, "admin_rights", None):
+        return None
+    last_message = dialog.date.timestamp() if dialog.date else 0.0
+    # Channel.date is the join date for members
+    joined = entity.date.timestamp() if getattr(entity, "date", None) else 0.0
+    return utils.get_input_channel(entity), last_message, joined
+
+
+def leave_candidates(
+    leavable: dict,
+    keep_ids: Iterable[int] = (),
+    count: int = AUTO_LEAVE_BATCH,
+    policy: str = AUTO_LEAVE_POLICY,
+) -> List[Tuple[int, object]]:
+    """
+    Up to `count` (peer_id, input channel) picked by AUTO_LEAVE_POLICY from
+    `leavable` ({peer_id: leave_info(...)}): oldest last message first
+    ('inactive') or joined longest ago ('oldest').
+    Chats in keep_ids (joined during the current run) are never picked.
+    """
+    if policy == "off" or count <= 0:
+        return []
+
+    keep = set(keep_ids)
+    key = 1 if policy == "inactive" else 2
+    picked = sorted(
+        ((peer_id, info) for peer_id, info in leavable.items() if peer_id not in keep),
+        key=lambda x: x[1][key],
+    )
+    return [(peer_id, info[0]) for peer_id, info in picked[:count]]
+
+
+async def leave_channel(client: TelegramClient, peer_id: int, input_channel) -> bool:
+    """
+    One LeaveChannel call. FloodWait is raised; other errors are logged => False.
+    """
+    try:
+        await client(LeaveChannelRequest(input_channel))
+        return True
+    except errors.FloodWaitError:
+        raise
+    except Exception as e:
+        logger.warning(f"[capacity] Leave failed for {peer_id}: {e}")
+        return False
@@ -0,0 +1,128 @@
+# bot/clients.py
+"""
+The one place Telethon clients for user sessions are created
+(joiner, extractor, folders, join requests).
+
+- new_client(session_string): a real TelegramClient, unless a factory was
+  installed with set_client_factory() (bot/fake_telegram.py in simulations)
+- RPC_TRACE_PATH set: real clients are wrapped by TracingClient, which
+  appends one JSONL record per request (method, target, outcome, latency)
+  so real behaviour can be replayed against the fake backend
+"""
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from telethon import TelegramClient, errors
+from telethon.sessions import StringSession
+
+from bot.config import API_ID, API_HASH, RPC_TRACE_PATH
+
+logger = logging.getLogger(__name__)
+
+_factory: Optional[Callable[[str], Any]] = None
+_trace_file = None
+
+
+def set_client_factory(factory: Optional[Callable[[str], Any]]) -> Optional[Callable[[str], Any]]:
+    """
+    factory(session_string) -> client object; None restores real clients.
+    Returns the previous factory.
+    """
+    global _factory
+    previous, _factory = _factory, factory
+    return previous
+
+
+def new_client(session_string: str):
+    if _factory is not None:
+        return _factory(session_string)
+
+    client = TelegramClient(StringSession(session_string), API_ID, API_HASH)
+    if RPC_TRACE_PATH:
+        return TracingClient(client, session_key(session_string))
+    return client
+
+
+def session_key(session_string: str) -> str:
+    """
+    Stable short id of a session for traces (never the session string itself).
+    """
+    return hashlib.sha1(session_string.encode("utf-8")).hexdigest()[:12]
+
+
+# ---------------- RPC traces ----------------
+def request_target(request) -> str:
+    """
+    What a request is about: invite hash, username, folder slug, ...
+    """
+    for attr in ("hash", "slug", "channel", "username", "peer"):
+        value = getattr(request, attr, None)
+        if value is None:
+            continue
+        if isinstance(value, str):
+            return value.lower() if attr in ("channel", "username") else value
+        username = getattr(value, "username", None)
+        if username:
+            return username.lower()
+        peer_id = getattr(value, "channel_id", None) or getattr(value, "id", None)
+        if peer_id is not None:
+            return str(peer_id)
+    return ""
+
+
+def rpc_outcome(e: Optional[BaseException]) -> str:
+    """
+    'ok' or the exception class name (FloodWaitError, InviteHashExpiredError, ...).
+    """
+    return "ok" if e is None else type(e).__name__
+
+
+def _write_trace(record: dict) -> None:
+    global _trace_file
+    try:
+        if _trace_file is None:
+            _trace_file = open(RPC_TRACE_PATH, "a", encoding="utf-8", buffering=1)
+        _trace_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.warning(f"[clients] RPC trace write failed: {e}")
+
+
+class TracingClient:
+    """
+    Transparent proxy of a TelegramClient recording every `await client(request)`.
+    Other attributes/methods (connect, iter_messages, ...) pass through.
+    """
+
+    def __init__(self, client: TelegramClient, key: str):
+        self._client = client
+        self._key = key
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    async def __call__(self, request, *args, **kwargs):
+        t0 = time.monotonic()
+        err: Optional[BaseException] = None
+        try:
+            return await self._client(request, *args, **kwargs)
+        except Exception as e:
+            err = e
+            raise
+        finally:
+            record = {
+                "t": round(time.time(), 3),
+                "session": self._key,
+                "method": type(request).__name__,
+                "target": request_target(request),
+                "outcome": rpc_outcome(err),
+                "latency": round(time.monotonic() - t0, 4),
+            }
+            if isinstance(err, errors.FloodWaitError):
+                record["seconds"] = int(err.seconds)
+            elif getattr(err, "message", None):
+                # RPC error text (INVITE_SLUG_EXPIRED, ...): generic classes need it
+                record["message"] = err.message
+            _write_trace(record)
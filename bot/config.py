@@ -1,5 +1,6 @@
 # bot/config.py
 import os
+import socket
 
 # Required Telegram API credentials
 API_ID = int(os.getenv("API_ID", "0"))
@@ -13,16 +14,172 @@ OWNER_ID = int(os.getenv("OWNER_ID", "0"))
 # Default changed from 60 -> 90 to reduce FloodWait probability
 JOIN_DELAY_SECONDS = int(os.getenv("JOIN_DELAY_SECONDS", "90"))
 
+# Join scheduler: max concurrent join steps (RPCs) across all sessions.
+# Sessions waiting for their delay/FloodWait don't count.
+JOIN_MAX_WORKERS = int(os.getenv("JOIN_MAX_WORKERS", "50"))
+
+# Multi-process sharding of join sessions on one host:
+# 1 = all sessions on the bot's own event loop
+# N>1 = sessions split across N worker processes (own loop + Telethon clients each)
+JOIN_WORKER_PROCESSES = int(os.getenv("JOIN_WORKER_PROCESSES", "1"))
+
+# Work leases: a worker owns a session's pending links while its lease is live.
+# Crashed workers stop heartbeating and their sessions become claimable again.
+LEASE_BACKEND = os.getenv("LEASE_BACKEND", "sqlite")
+JOIN_LEASE_SECONDS = int(os.getenv("JOIN_LEASE_SECONDS", "600"))
+
+# Headless join workers (python -m bot.worker) share this DB: 1 = the bot
+# claims its sessions through leases too. Sharded runs always use leases.
+HEADLESS_WORKERS = os.getenv("HEADLESS_WORKERS", "0") == "1"
+LEASES_ENABLED = HEADLESS_WORKERS or JOIN_WORKER_PROCESSES > 1
+
+# Transient join errors (network, Telegram 5xx): link is retried later with
+# jittered exponential backoff, failed only after JOIN_RETRY_MAX_ATTEMPTS retries.
+JOIN_RETRY_MAX_ATTEMPTS = int(os.getenv("JOIN_RETRY_MAX_ATTEMPTS", "5"))
+JOIN_RETRY_BASE_SECONDS = int(os.getenv("JOIN_RETRY_BASE_SECONDS", "30"))
+JOIN_RETRY_MAX_SECONDS = int(os.getenv("JOIN_RETRY_MAX_SECONDS", "3600"))
+
+# Identity of this process in leases (default: hostname-pid)
+WORKER_ID = os.getenv("WORKER_ID", "") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Joined channels cap per account (Telegram: 500, Premium: 1000).
+# Full accounts get no new links; pending links of an account that hits
+# ChannelsTooMuch go back to the pool.
+CHANNELS_LIMIT_PER_SESSION = int(os.getenv("CHANNELS_LIMIT_PER_SESSION", "500"))
+
+# Free slots on a full account by leaving chats (see bot/capacity.py):
+# off | oldest (joined longest ago) | inactive (oldest last message)
+AUTO_LEAVE_POLICY = os.getenv("AUTO_LEAVE_POLICY", "off").strip().lower()
+AUTO_LEAVE_BATCH = int(os.getenv("AUTO_LEAVE_BATCH", "20"))
+
+# Throughput-weighted distribution: per-session joins/hour measured from
+# join_log over this window; sessions with fewer RPCs use the nominal rate
+# (3600 / JOIN_DELAY_SECONDS).
+THROUGHPUT_WINDOW_HOURS = int(os.getenv("THROUGHPUT_WINDOW_HOURS", "168"))
+THROUGHPUT_MIN_SAMPLES = int(os.getenv("THROUGHPUT_MIN_SAMPLES", "20"))
+
+# Continuous top-up while a run is live: a session with fewer than
+# TOPUP_LOW_WATER pending links gets up to TOPUP_BATCH more (reserve kept),
+# checked at most every TOPUP_INTERVAL_SECONDS (always when its queue is empty).
+# TOPUP_BATCH=0 disables.
+TOPUP_LOW_WATER = int(os.getenv("TOPUP_LOW_WATER", "20"))
+TOPUP_BATCH = int(os.getenv("TOPUP_BATCH", "50"))
+TOPUP_INTERVAL_SECONDS = int(os.getenv("TOPUP_INTERVAL_SECONDS", "600"))
+
+# Stats screen forecast: sessions needed to finish the backlog within this many hours
+FORECAST_TARGET_HOURS = float(os.getenv("FORECAST_TARGET_HOURS", "24"))
+
 # Link reserve pool:
 # Always keep at least this many active, unassigned links in DB as backup
 # used for immediate replacement of dead/expired links.
 RESERVE_LINKS = int(os.getenv("RESERVE_LINKS", "500"))
 
+# Auto-sized reserve (bot/reserve.py): target = expected dead links of the
+# pending work (rolling dead rate per source channel and per session over
+# RESERVE_WINDOW_HOURS) * RESERVE_SAFETY_FACTOR, clamped to
+# [RESERVE_LINKS, RESERVE_LINKS_MAX]. RESERVE_LINKS_MAX=RESERVE_LINKS => fixed reserve.
+RESERVE_LINKS_MAX = int(os.getenv("RESERVE_LINKS_MAX", "5000"))
+RESERVE_SAFETY_FACTOR = float(os.getenv("RESERVE_SAFETY_FACTOR", "1.5"))
+RESERVE_WINDOW_HOURS = int(os.getenv("RESERVE_WINDOW_HOURS", "168"))
+RESERVE_RECALC_SECONDS = int(os.getenv("RESERVE_RECALC_SECONDS", "300"))
+
+# Pending link priority (higher first), see bot/priority.py:
+# score = FRESHNESS_WEIGHT * 0.5^(age_days / HALF_LIFE_DAYS)
+#       + KIND_WEIGHTS[kind]
+#       + SOURCE_WEIGHT * source channel success rate
+#       - ATTEMPT_PENALTY * previous join attempts
+PRIORITY_FRESHNESS_WEIGHT = float(os.getenv("PRIORITY_FRESHNESS_WEIGHT", "3"))
+PRIORITY_FRESHNESS_HALF_LIFE_DAYS = float(os.getenv("PRIORITY_FRESHNESS_HALF_LIFE_DAYS", "30"))
+PRIORITY_SOURCE_WEIGHT = float(os.getenv("PRIORITY_SOURCE_WEIGHT", "2"))
+PRIORITY_ATTEMPT_PENALTY = float(os.getenv("PRIORITY_ATTEMPT_PENALTY", "0.5"))
+
+# "kind:weight,..." - invite links expire, so they go before usernames by default
+PRIORITY_KIND_WEIGHTS = {
+    k.strip(): float(v)
+    for k, v in (
+        item.split(":", 1)
+        for item in os.getenv("PRIORITY_KIND_WEIGHTS", "folder:2,invite:1.5,username:1").split(",")
+        if ":" in item
+    )
+}
+
 # Messages extraction limit:
 # 0 = extract all messages from first to last
 # >0 = extract last N messages only
 EXTRACT_MESSAGES_LIMIT = int(os.getenv("EXTRACT_MESSAGES_LIMIT", "0"))
 
+# Join requests (InviteRequestSent) polling:
+# every N seconds check, per session, which requested chats were approved
+# 0 = disabled
+REQUESTED_POLL_INTERVAL_SECONDS = int(os.getenv("REQUESTED_POLL_INTERVAL_SECONDS", "1800"))
+
+# requested joins older than this are expired to failed
+REQUESTED_TTL_HOURS = int(os.getenv("REQUESTED_TTL_HOURS", "72"))
+
+# invite-hash requests can't be matched from dialogs (no username);
+# at most this many are checked one by one per session per poll
+REQUESTED_INVITE_CHECKS_PER_POLL = int(os.getenv("REQUESTED_INVITE_CHECKS_PER_POLL", "20"))
+
+# Chat folders: poll joined folders for newly added chats (0 = disabled)
+FOLDER_UPDATES_INTERVAL_SECONDS = int(os.getenv("FOLDER_UPDATES_INTERVAL_SECONDS", "3600"))
+
+# Bot output: one request per N seconds through the outbox (bot/notifier.py);
+# the pinned join progress message is edited every PROGRESS_EDIT_INTERVAL_SECONDS
+OUTBOX_MIN_INTERVAL_SECONDS = float(os.getenv("OUTBOX_MIN_INTERVAL_SECONDS", "1"))
+PROGRESS_EDIT_INTERVAL_SECONDS = int(os.getenv("PROGRESS_EDIT_INTERVAL_SECONDS", "60"))
+
+# Background bot jobs: "type:max concurrent,..." (extract / export / distribute / validate / import / health / profile / import_links)
+# and how many finished jobs stay listed in the jobs view
+JOB_CONCURRENCY = {
+    k.strip(): int(v)
+    for k, v in (
+        item.split(":", 1)
+        for item in os.getenv("JOB_CONCURRENCY", "extract:1,export:1,distribute:1,validate:1,import:1,health:1,profile:1,import_links:1").split(",")
+        if ":" in item
+    )
+}
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "20"))
+
+# Bulk session import: sessions validated concurrently (connect + get_me),
+# each one given at most SESSION_VALIDATE_TIMEOUT_SECONDS
+SESSION_IMPORT_CONCURRENCY = int(os.getenv("SESSION_IMPORT_CONCURRENCY", "20"))
+SESSION_VALIDATE_TIMEOUT_SECONDS = int(os.getenv("SESSION_VALIDATE_TIMEOUT_SECONDS", "30"))
+
+# Link dump import (txt/csv documents): links inserted per DB transaction
+LINK_IMPORT_BATCH = int(os.getenv("LINK_IMPORT_BATCH", "5000"))
+
+# Session health check (connect + get_me for every active session, 0 = disabled):
+# revoked/banned accounts are soft-deleted, restricted ones get no links
+HEALTH_CHECK_INTERVAL_SECONDS = int(os.getenv("HEALTH_CHECK_INTERVAL_SECONDS", "21600"))
+HEALTH_CHECK_CONCURRENCY = int(os.getenv("HEALTH_CHECK_CONCURRENCY", "10"))
+
+# Dead link re-verification (bot/dead_links.py, 0 = disabled): every pass
+# rechecks due dead links (oldest check first) without joining, at most
+# DEAD_RECHECK_PER_SESSION per session on up to DEAD_RECHECK_SESSIONS sessions.
+# A link is due DEAD_RECHECK_BASE_SECONDS after it was marked dead; every
+# recheck that finds it still dead doubles the wait, up to DEAD_RECHECK_MAX_SECONDS
+DEAD_RECHECK_INTERVAL_SECONDS = int(os.getenv("DEAD_RECHECK_INTERVAL_SECONDS", "3600"))
+DEAD_RECHECK_PER_SESSION = int(os.getenv("DEAD_RECHECK_PER_SESSION", "5"))
+DEAD_RECHECK_SESSIONS = int(os.getenv("DEAD_RECHECK_SESSIONS", "10"))
+DEAD_RECHECK_BASE_SECONDS = int(os.getenv("DEAD_RECHECK_BASE_SECONDS", "86400"))
+DEAD_RECHECK_MAX_SECONDS = int(os.getenv("DEAD_RECHECK_MAX_SECONDS", "2592000"))
+
+# Metrics endpoint (Prometheus text format, bot/metrics.py): 0 = disabled
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Diagnostics mode (bot/diagnostics.py): event loop lag sampler, slow callback
+# logging (asyncio debug mode, 0 = off) and timing spans; /profile works without it
+DIAGNOSTICS_ENABLED = os.getenv("DIAGNOSTICS_ENABLED", "0") == "1"
+LOOP_LAG_SAMPLE_SECONDS = float(os.getenv("LOOP_LAG_SAMPLE_SECONDS", "0.5"))
+LOOP_LAG_WARN_SECONDS = float(os.getenv("LOOP_LAG_WARN_SECONDS", "0.25"))
+SLOW_CALLBACK_SECONDS = float(os.getenv("SLOW_CALLBACK_SECONDS", "0.1"))
+
+# RPC trace: every Telethon request of the real clients (join / extract / folders)
+# is appended to this JSONL file (outcome, latency); replayed by bench/simulate.py.
+# Empty = off
+RPC_TRACE_PATH = os.getenv("RPC_TRACE_PATH", "").strip()
+
 # Database path
 DB_PATH = os.getenv("DB_PATH", "data/sessions.db")
 
@@ -36,8 +193,138 @@ if API_ID == 0 or not API_HASH or not BOT_TOKEN or OWNER_ID == 0:
 if JOIN_DELAY_SECONDS < 0:
     raise RuntimeError("JOIN_DELAY_SECONDS must be >= 0")
 
+if FOLDER_UPDATES_INTERVAL_SECONDS < 0:
+    raise RuntimeError("FOLDER_UPDATES_INTERVAL_SECONDS must be >= 0")
+
+if JOIN_MAX_WORKERS <= 0:
+    raise RuntimeError("JOIN_MAX_WORKERS must be > 0")
+
+if JOIN_WORKER_PROCESSES <= 0:
+    raise RuntimeError("JOIN_WORKER_PROCESSES must be > 0")
+
+if LEASE_BACKEND not in ("sqlite",):
+    raise RuntimeError("LEASE_BACKEND must be one of: sqlite")
+
+# a lease must outlive the delay between two joins (only checked when leases are used)
+if LEASES_ENABLED and JOIN_LEASE_SECONDS <= JOIN_DELAY_SECONDS:
+    raise RuntimeError("JOIN_LEASE_SECONDS must be > JOIN_DELAY_SECONDS")
+
+if JOIN_RETRY_MAX_ATTEMPTS < 0:
+    raise RuntimeError("JOIN_RETRY_MAX_ATTEMPTS must be >= 0")
+
+if JOIN_RETRY_BASE_SECONDS <= 0:
+    raise RuntimeError("JOIN_RETRY_BASE_SECONDS must be > 0")
+
+if JOIN_RETRY_MAX_SECONDS < JOIN_RETRY_BASE_SECONDS:
+    raise RuntimeError("JOIN_RETRY_MAX_SECONDS must be >= JOIN_RETRY_BASE_SECONDS")
+
+if PRIORITY_FRESHNESS_HALF_LIFE_DAYS <= 0:
+    raise RuntimeError("PRIORITY_FRESHNESS_HALF_LIFE_DAYS must be > 0")
+
+if CHANNELS_LIMIT_PER_SESSION <= 0:
+    raise RuntimeError("CHANNELS_LIMIT_PER_SESSION must be > 0")
+
+if AUTO_LEAVE_POLICY not in ("off", "oldest", "inactive"):
+    raise RuntimeError("AUTO_LEAVE_POLICY must be one of: off, oldest, inactive")
+
+if AUTO_LEAVE_BATCH <= 0:
+    raise RuntimeError("AUTO_LEAVE_BATCH must be > 0")
+
+if THROUGHPUT_WINDOW_HOURS <= 0:
+    raise RuntimeError("THROUGHPUT_WINDOW_HOURS must be > 0")
+
+if THROUGHPUT_MIN_SAMPLES < 0:
+    raise RuntimeError("THROUGHPUT_MIN_SAMPLES must be >= 0")
+
+if TOPUP_LOW_WATER < 0:
+    raise RuntimeError("TOPUP_LOW_WATER must be >= 0")
+
+if TOPUP_BATCH < 0:
+    raise RuntimeError("TOPUP_BATCH must be >= 0")
+
+if TOPUP_INTERVAL_SECONDS < 0:
+    raise RuntimeError("TOPUP_INTERVAL_SECONDS must be >= 0")
+
+if FORECAST_TARGET_HOURS <= 0:
+    raise RuntimeError("FORECAST_TARGET_HOURS must be > 0")
+
+if OUTBOX_MIN_INTERVAL_SECONDS < 0:
+    raise RuntimeError("OUTBOX_MIN_INTERVAL_SECONDS must be >= 0")
+
+if PROGRESS_EDIT_INTERVAL_SECONDS <= 0:
+    raise RuntimeError("PROGRESS_EDIT_INTERVAL_SECONDS must be > 0")
+
+if any(n < 1 for n in JOB_CONCURRENCY.values()):
+    raise RuntimeError("JOB_CONCURRENCY limits must be >= 1")
+
+if JOB_HISTORY < 0:
+    raise RuntimeError("JOB_HISTORY must be >= 0")
+
+if SESSION_IMPORT_CONCURRENCY < 1:
+    raise RuntimeError("SESSION_IMPORT_CONCURRENCY must be >= 1")
+
+if SESSION_VALIDATE_TIMEOUT_SECONDS <= 0:
+    raise RuntimeError("SESSION_VALIDATE_TIMEOUT_SECONDS must be > 0")
+
+if LINK_IMPORT_BATCH <= 0:
+    raise RuntimeError("LINK_IMPORT_BATCH must be > 0")
+
+if HEALTH_CHECK_INTERVAL_SECONDS < 0:
+    raise RuntimeError("HEALTH_CHECK_INTERVAL_SECONDS must be >= 0")
+
+if HEALTH_CHECK_CONCURRENCY < 1:
+    raise RuntimeError("HEALTH_CHECK_CONCURRENCY must be >= 1")
+
+if DEAD_RECHECK_INTERVAL_SECONDS < 0:
+    raise RuntimeError("DEAD_RECHECK_INTERVAL_SECONDS must be >= 0")
+
+if DEAD_RECHECK_PER_SESSION < 1:
+    raise RuntimeError("DEAD_RECHECK_PER_SESSION must be >= 1")
+
+if DEAD_RECHECK_SESSIONS < 1:
+    raise RuntimeError("DEAD_RECHECK_SESSIONS must be >= 1")
+
+if DEAD_RECHECK_BASE_SECONDS <= 0:
+    raise RuntimeError("DEAD_RECHECK_BASE_SECONDS must be > 0")
+
+if DEAD_RECHECK_MAX_SECONDS < DEAD_RECHECK_BASE_SECONDS:
+    raise RuntimeError("DEAD_RECHECK_MAX_SECONDS must be >= DEAD_RECHECK_BASE_SECONDS")
+
+if not 0 <= METRICS_PORT <= 65535:
+    raise RuntimeError("METRICS_PORT must be between 0 and 65535")
+
+if LOOP_LAG_SAMPLE_SECONDS <= 0:
+    raise RuntimeError("LOOP_LAG_SAMPLE_SECONDS must be > 0")
+
+if LOOP_LAG_WARN_SECONDS <= 0:
+    raise RuntimeError("LOOP_LAG_WARN_SECONDS must be > 0")
+
+if SLOW_CALLBACK_SECONDS < 0:
+    raise RuntimeError("SLOW_CALLBACK_SECONDS must be >= 0")
+
 if RESERVE_LINKS < 0:
     raise RuntimeError("RESERVE_LINKS must be >= 0")
 
+if RESERVE_LINKS_MAX < RESERVE_LINKS:
+    raise RuntimeError("RESERVE_LINKS_MAX must be >= RESERVE_LINKS")
+
+if RESERVE_SAFETY_FACTOR < 1:
+    raise RuntimeError("RESERVE_SAFETY_FACTOR must be >= 1")
+
+if RESERVE_WINDOW_HOURS <= 0:
+    raise RuntimeError("RESERVE_WINDOW_HOURS must be > 0")
+
+if RESERVE_RECALC_SECONDS < 0:
+    raise RuntimeError("RESERVE_RECALC_SECONDS must be >= 0")
+
 if EXTRACT_MESSAGES_LIMIT < 0:
     raise RuntimeError("EXTRACT_MESSAGES_LIMIT must be >= 0")
+
+if REQUESTED_POLL_INTERVAL_SECONDS < 0:
+    raise RuntimeError("REQUESTED_POLL_INTERVAL_SECONDS must be >= 0")
+
+if REQUESTED_TTL_HOURS <= 0:
+    raise RuntimeError("REQUESTED_TTL_HOURS must be > 0")
+
+if REQUESTED_INVITE_CHECKS_PER_POLL < 0:
+    raise RuntimeError("REQUESTED_INVITE_CHECKS_PER_POLL must be >= 0")
@@ -1,23 +1,65 @@
 # bot/db.py
+import math
 import os
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
 from typing import Optional, List, Tuple, Dict, Any
 
-from bot.config import DB_PATH, RESERVE_LINKS
+from bot.config import DB_PATH, CHANNELS_LIMIT_PER_SESSION, PRIORITY_ATTEMPT_PENALTY
+from bot import diagnostics, metrics
+from bot.priority import link_priority, link_priority_sql, source_quality
+from bot.utils import parse_link_type
 
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
 
-@contextmanager
-def get_conn():
+# one connection per thread, opened on first use: a connect + close per call
+# dominated the join loop (closing the last WAL connection checkpoints)
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
     conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
     conn.row_factory = sqlite3.Row
+    # pow() for link_priority_sql on SQLite builds without the math functions
+    try:
+        conn.execute("SELECT pow(2, 2)")
+    except sqlite3.OperationalError:
+        conn.create_function("pow", 2, math.pow, deterministic=True)
+    return conn
+
+
+@contextmanager
+def get_conn():
+    """
+    The calling thread's connection. Callers commit their own writes; a
+    transaction still open when the outermost block exits is rolled back.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
+        _local.depth = 0
+
+    _local.depth += 1
     try:
         yield conn
     finally:
+        _local.depth -= 1
+        if _local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+
+def close_conn() -> None:
+    """
+    Close the calling thread's connection (before the DB file is replaced).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
         conn.close()
 
 
@@ -30,6 +72,11 @@ def _column_exists(conn: sqlite3.Connection, table: str, col: str) -> bool:
     return False
 
 
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    return row is not None
+
+
 def _ensure_schema_migrations(conn: sqlite3.Connection) -> None:
     """
     Apply schema migrations safely for existing DB.
@@ -47,6 +94,100 @@ def _ensure_schema_migrations(conn: sqlite3.Connection) -> None:
     if not _column_exists(conn, "links", "last_checked_at"):
         conn.execute("ALTER TABLE links ADD COLUMN last_checked_at TIMESTAMP;")
 
+    if not _column_exists(conn, "assignments", "requested_at"):
+        conn.execute("ALTER TABLE assignments ADD COLUMN requested_at TIMESTAMP;")
+
+    # last CheckChatInvite of a requested invite link (unix seconds): polls rotate through them
+    if not _column_exists(conn, "assignments", "request_checked_at"):
+        conn.execute("ALTER TABLE assignments ADD COLUMN request_checked_at REAL;")
+
+    # work leases (several worker processes/hosts on one links DB)
+    if not _column_exists(conn, "assignments", "lease_owner"):
+        conn.execute("ALTER TABLE assignments ADD COLUMN lease_owner TEXT;")
+
+    if not _column_exists(conn, "assignments", "lease_expires_at"):
+        conn.execute("ALTER TABLE assignments ADD COLUMN lease_expires_at REAL;")
+
+    if not _column_exists(conn, "assignments", "heartbeat_at"):
+        conn.execute("ALTER TABLE assignments ADD COLUMN heartbeat_at REAL;")
+
+    # transient join errors: deferred retry (unix seconds) + retry count
+    if not _column_exists(conn, "assignments", "next_attempt_at"):
+        conn.execute("ALTER TABLE assignments ADD COLUMN next_attempt_at REAL;")
+
+    if not _column_exists(conn, "assignments", "retries"):
+        conn.execute("ALTER TABLE assignments ADD COLUMN retries INTEGER DEFAULT 0;")
+
+    # joined channels capacity (dialog snapshot + joins), full flag on ChannelsTooMuch
+    if not _column_exists(conn, "sessions", "joined_channels"):
+        conn.execute("ALTER TABLE sessions ADD COLUMN joined_channels INTEGER DEFAULT 0;")
+
+    if not _column_exists(conn, "sessions", "channels_full_at"):
+        conn.execute("ALTER TABLE sessions ADD COLUMN channels_full_at REAL;")
+
+    # home DC of the account (captured by bulk import validation)
+    if not _column_exists(conn, "sessions", "dc_id"):
+        conn.execute("ALTER TABLE sessions ADD COLUMN dc_id INTEGER;")
+
+    # periodic health check (bot/health.py): unknown | ok | restricted | error
+    if not _column_exists(conn, "sessions", "health"):
+        conn.execute("ALTER TABLE sessions ADD COLUMN health TEXT DEFAULT 'unknown';")
+
+    if not _column_exists(conn, "sessions", "health_checked_at"):
+        conn.execute("ALTER TABLE sessions ADD COLUMN health_checked_at REAL;")
+
+    if not _column_exists(conn, "sessions", "health_latency_ms"):
+        conn.execute("ALTER TABLE sessions ADD COLUMN health_latency_ms INTEGER;")
+
+    if not _column_exists(conn, "sessions", "health_error"):
+        conn.execute("ALTER TABLE sessions ADD COLUMN health_error TEXT;")
+
+    # link priority: source message (extractor) + kind + cached score
+    if not _column_exists(conn, "links", "source_msg_id"):
+        conn.execute("ALTER TABLE links ADD COLUMN source_msg_id INTEGER;")
+
+    if not _column_exists(conn, "links", "source_msg_date"):
+        conn.execute("ALTER TABLE links ADD COLUMN source_msg_date REAL;")
+
+    if not _column_exists(conn, "links", "kind"):
+        conn.execute("ALTER TABLE links ADD COLUMN kind TEXT;")
+
+    if not _column_exists(conn, "links", "priority"):
+        conn.execute("ALTER TABLE links ADD COLUMN priority REAL DEFAULT 0;")
+
+    # chat folder links: expanded into folder_peers
+    if not _column_exists(conn, "links", "expanded_at"):
+        conn.execute("ALTER TABLE links ADD COLUMN expanded_at TIMESTAMP;")
+
+    # chat behind a username / invite link when known (folder peers, join results):
+    # folder children are matched on it, whatever the link form
+    if not _column_exists(conn, "links", "peer_id"):
+        conn.execute("ALTER TABLE links ADD COLUMN peer_id INTEGER;")
+        if _table_exists(conn, "folder_peers"):
+            conn.execute("""
+                UPDATE links
+                SET peer_id = (SELECT fp.peer_id FROM folder_peers fp WHERE fp.child_link_id = links.id LIMIT 1)
+                WHERE id IN (SELECT child_link_id FROM folder_peers WHERE child_link_id IS NOT NULL)
+            """)
+
+    # has an assignments row (kept in sync by triggers, see init_db): the reserve
+    # (active unassigned links, priority order) comes from a partial index
+    # instead of a scan past every assigned link
+    if not _column_exists(conn, "links", "assigned"):
+        conn.execute("ALTER TABLE links ADD COLUMN assigned INTEGER DEFAULT 0;")
+        conn.execute("UPDATE links SET assigned=1 WHERE id IN (SELECT link_id FROM assignments)")
+
+    # account FloodWait deadline (unix seconds), survives restarts
+    if not _column_exists(conn, "sessions", "flood_until"):
+        conn.execute("ALTER TABLE sessions ADD COLUMN flood_until REAL DEFAULT 0;")
+
+    # dead link re-verification: rechecks that found the link still dead + next due time (unix seconds)
+    if not _column_exists(conn, "links", "dead_checks"):
+        conn.execute("ALTER TABLE links ADD COLUMN dead_checks INTEGER DEFAULT 0;")
+
+    if not _column_exists(conn, "links", "recheck_at"):
+        conn.execute("ALTER TABLE links ADD COLUMN recheck_at REAL;")
+
 
 # ---------------- init ----------------
 def init_db():
@@ -98,9 +239,126 @@ def init_db():
         );
         """)
 
+        # persisted join runs (resume after restart)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS join_runs (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          chat_id INTEGER,
+          status TEXT DEFAULT 'running',
+          started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          finished_at TIMESTAMP
+        );
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS join_run_sessions (
+          run_id INTEGER NOT NULL,
+          session_id INTEGER NOT NULL,
+          status TEXT DEFAULT 'pending',
+          last_link_id INTEGER,
+          success INTEGER DEFAULT 0,
+          failed INTEGER DEFAULT 0,
+          requested INTEGER DEFAULT 0,
+          saved_delay_slots INTEGER DEFAULT 0,
+          updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          PRIMARY KEY(run_id, session_id),
+          FOREIGN KEY(run_id) REFERENCES join_runs(id),
+          FOREIGN KEY(session_id) REFERENCES sessions(id)
+        );
+        """)
+
+        # chat folder (addlist) member peers, one row per chat
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS folder_peers (
+          folder_link_id INTEGER NOT NULL,
+          peer_id INTEGER NOT NULL,
+          username TEXT,
+          title TEXT,
+          child_link_id INTEGER,
+          PRIMARY KEY(folder_link_id, peer_id),
+          FOREIGN KEY(folder_link_id) REFERENCES links(id),
+          FOREIGN KEY(child_link_id) REFERENCES links(id)
+        );
+        """)
+
+        # chat folders joined by each session (for incremental update polling)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS session_folders (
+          session_id INTEGER NOT NULL,
+          folder_link_id INTEGER NOT NULL,
+          filter_id INTEGER NOT NULL,
+          peers_count INTEGER DEFAULT 0,
+          joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          last_polled_at TIMESTAMP,
+          last_new_peers INTEGER DEFAULT 0,
+          PRIMARY KEY(session_id, folder_link_id),
+          FOREIGN KEY(session_id) REFERENCES sessions(id),
+          FOREIGN KEY(folder_link_id) REFERENCES links(id)
+        );
+        """)
+
         # Upgrade existing DB schema
         _ensure_schema_migrations(conn)
 
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_folder_peers_child
+        ON folder_peers(child_link_id);
+        """)
+
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_folder_peers_peer
+        ON folder_peers(peer_id);
+        """)
+
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_links_peer
+        ON links(peer_id) WHERE peer_id IS NOT NULL;
+        """)
+
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_links_link_nocase
+        ON links(link COLLATE NOCASE);
+        """)
+
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_links_priority
+        ON links(priority DESC, id ASC);
+        """)
+
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_links_reserve
+        ON links(priority DESC, id ASC) WHERE assigned=0 AND (status IS NULL OR status='active');
+        """)
+
+        cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_assignments_insert AFTER INSERT ON assignments
+        BEGIN
+          UPDATE links SET assigned=1 WHERE id=NEW.link_id;
+        END;
+        """)
+
+        cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_assignments_delete AFTER DELETE ON assignments
+        BEGIN
+          UPDATE links SET assigned=0 WHERE id=OLD.link_id;
+        END;
+        """)
+
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_links_dead_checked
+        ON links(last_checked_at) WHERE status='dead';
+        """)
+
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_join_log_session_created
+        ON join_log(session_id, created_at);
+        """)
+
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_assignments_session_status
+        ON assignments(session_id, join_status);
+        """)
+
         conn.commit()
 
 
@@ -118,6 +376,40 @@ def add_session(session_string: str, phone: str = "") -> bool:
             return False
 
 
+def get_existing_session_strings(session_strings: List[str]) -> set:
+    """
+    Subset of session_strings already stored (any status).
+    """
+    found = set()
+    strings = [x.strip() for x in session_strings]
+    with get_conn() as conn:
+        # stay below SQLite's bound parameters limit
+        for i in range(0, len(strings), 500):
+            chunk = strings[i:i + 500]
+            rows = conn.execute(
+                f"SELECT session_string FROM sessions WHERE session_string IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            found.update(r["session_string"] for r in rows)
+    return found
+
+
+def add_sessions_bulk(rows: List[Tuple[str, str, Optional[int]]]) -> List[Optional[int]]:
+    """
+    Insert validated sessions (session_string, phone, dc_id) in one transaction.
+    Returns the new session id per row, None for duplicates.
+    """
+    ids: List[Optional[int]] = []
+    with _immediate_tx() as conn:
+        for session_string, phone, dc_id in rows:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO sessions(session_string, phone, dc_id) VALUES(?,?,?)",
+                (session_string.strip(), (phone or "").strip(), dc_id),
+            )
+            ids.append(cur.lastrowid if cur.rowcount else None)
+    return ids
+
+
 def list_sessions():
     with get_conn() as conn:
         cur = conn.cursor()
@@ -130,6 +422,66 @@ def list_sessions():
         return [tuple(r) for r in cur.fetchall()]
 
 
+def list_assignable_sessions():
+    """
+    Active sessions that may receive links: same rows as list_sessions()
+    minus accounts the health checker found restricted.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, session_string, phone, created_at
+            FROM sessions
+            WHERE status='active'
+              AND COALESCE(health, 'unknown') != 'restricted'
+            ORDER BY id ASC
+        """)
+        return [tuple(r) for r in cur.fetchall()]
+
+
+def set_session_health(
+    session_id: int,
+    health: str,
+    latency_ms: Optional[int] = None,
+    error: Optional[str] = None,
+) -> int:
+    """
+    Store a health check result. A restricted account gives its pending links
+    back to the pool (like a full one). Returns number of released links.
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE sessions
+            SET health=?,
+                health_checked_at=?,
+                health_latency_ms=?,
+                health_error=?
+            WHERE id=?
+        """, (health, time.time(), latency_ms, error, session_id))
+
+        released = 0
+        if health == "restricted":
+            cur = conn.execute("""
+                DELETE FROM assignments
+                WHERE session_id=?
+                  AND join_status='pending'
+            """, (session_id,))
+            released = cur.rowcount
+
+        conn.commit()
+        return released
+
+
+def get_sessions_health() -> Dict[int, Dict[str, Any]]:
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT id, dc_id, health, health_checked_at, health_latency_ms, health_error
+            FROM sessions
+            WHERE status='active'
+        """).fetchall()
+        return {r["id"]: dict(r) for r in rows}
+
+
 def soft_delete_session(session_id: int) -> None:
     """
     Soft delete session to avoid losing assigned links permanently.
@@ -169,29 +521,565 @@ def get_session_by_id(session_id: int):
         return tuple(row) if row else None
 
 
-# ---------------- links ----------------
-def add_links(links: List[str], source_channel: str) -> int:
-    """
-    Insert links as active by default.
-    Dead links are NOT reactivated.
-    """
-    added = 0
+def is_session_joinable(session_id: int) -> bool:
+    """
+    Still active and not flagged restricted (soft_delete_session /
+    set_session_health release the pending links of other sessions).
+    """
+    with get_conn() as conn:
+        row = conn.execute("""
+            SELECT 1
+            FROM sessions
+            WHERE id=?
+              AND status='active'
+              AND COALESCE(health, 'unknown') != 'restricted'
+        """, (session_id,)).fetchone()
+        return row is not None
+
+
+def set_session_flood_until(session_id: int, until_ts: float) -> None:
+    """
+    Persist account FloodWait deadline (unix seconds).
+    """
+    with get_conn() as conn:
+        conn.execute("UPDATE sessions SET flood_until=? WHERE id=?", (float(until_ts), session_id))
+        conn.commit()
+
+
+def get_session_flood_until(session_id: int) -> float:
+    with get_conn() as conn:
+        row = conn.execute("SELECT flood_until FROM sessions WHERE id=?", (session_id,)).fetchone()
+        return float(row["flood_until"] or 0) if row else 0.0
+
+
+# ---------------- capacity ----------------
+def set_session_joined_channels(session_id: int, count: int) -> None:
+    """
+    Known joined channels count; below the cap clears the full flag.
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE sessions
+            SET joined_channels=?,
+                channels_full_at=CASE WHEN ? < ? THEN NULL ELSE channels_full_at END
+            WHERE id=?
+        """, (count, count, CHANNELS_LIMIT_PER_SESSION, session_id))
+        conn.commit()
+
+
+def add_session_joined_channels(session_id: int, count: int) -> None:
+    """
+    Bump the joined channels count (joins made outside the joiner, e.g. folder updates).
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE sessions
+            SET joined_channels=COALESCE(joined_channels, 0) + ?
+            WHERE id=?
+        """, (count, session_id))
+        conn.commit()
+
+
+def mark_session_channels_full(session_id: int) -> int:
+    """
+    Account hit ChannelsTooMuch: flag it full and give its pending links back
+    to the pool (unassigned). Returns number of released links.
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE sessions
+            SET channels_full_at=?,
+                joined_channels=MAX(COALESCE(joined_channels, 0), ?)
+            WHERE id=?
+        """, (time.time(), CHANNELS_LIMIT_PER_SESSION, session_id))
+
+        cur = conn.execute("""
+            DELETE FROM assignments
+            WHERE session_id=?
+              AND join_status='pending'
+        """, (session_id,))
+
+        conn.commit()
+        return cur.rowcount
+
+
+def _sessions_capacity(conn, session_id: Optional[int] = None) -> Dict[int, Dict[str, Any]]:
+    sql = """
+        SELECT s.id,
+               s.channels_full_at,
+               COALESCE(s.health, 'unknown') AS health,
+               COALESCE(s.joined_channels, 0) AS joined,
+               (SELECT COUNT(*) FROM assignments a
+                WHERE a.session_id = s.id AND a.join_status='pending') AS pending,
+               (SELECT COALESCE(SUM(
+                    CASE
+                      -- chat of a pending folder of the same session: its join covers it
+                      WHEN l.peer_id IS NOT NULL AND EXISTS (
+                          SELECT 1
+                          FROM folder_peers fp
+                          JOIN assignments fa ON fa.link_id = fp.folder_link_id
+                          WHERE fp.peer_id = l.peer_id
+                            AND fa.session_id = a.session_id
+                            AND fa.join_status = 'pending'
+                            AND fa.link_id != l.id
+                      ) THEN 0
+                      -- folder: one slot per member chat
+                      ELSE MAX(1, (SELECT COUNT(*) FROM folder_peers fp WHERE fp.folder_link_id = l.id))
+                    END), 0)
+                FROM assignments a
+                JOIN links l ON l.id = a.link_id
+                WHERE a.session_id = s.id AND a.join_status='pending') AS pending_slots
+        FROM sessions s
+        WHERE s.status='active'
+    """
+    params: tuple = ()
+    if session_id is not None:
+        sql += " AND s.id=?"
+        params = (session_id,)
+
+    capacity = {}
+    for r in conn.execute(sql, params).fetchall():
+        full = bool(r["channels_full_at"]) or r["joined"] >= CHANNELS_LIMIT_PER_SESSION
+        healthy = r["health"] != "restricted"
+        free = 0 if full or not healthy else max(0, CHANNELS_LIMIT_PER_SESSION - r["joined"] - r["pending_slots"])
+        capacity[r["id"]] = {
+            "joined": r["joined"], "pending": r["pending"], "full": full, "healthy": healthy, "free": free,
+        }
+    return capacity
+
+
+def get_sessions_capacity() -> Dict[int, Dict[str, Any]]:
+    """
+    Channels capacity per active session:
+    - full: flagged by ChannelsTooMuch or joined channels at the cap
+    - healthy: not flagged restricted by the health checker
+    - free: cap - joined channels - channel slots of links already pending for it
+      (a folder takes one per member chat, its covered links none; 0 when full or unhealthy)
+    """
+    with get_conn() as conn:
+        return _sessions_capacity(conn)
+
+
+# ---------------- join runs ----------------
+def create_join_run(chat_id: int, session_ids: List[int]) -> int:
+    """
+    Create a run record + one row per session (status 'pending').
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO join_runs(chat_id, status) VALUES(?, 'running')", (chat_id,))
+        run_id = cur.lastrowid
+
+        cur.executemany("""
+            INSERT OR IGNORE INTO join_run_sessions(run_id, session_id)
+            VALUES(?,?)
+        """, [(run_id, sid) for sid in session_ids])
+
+        conn.commit()
+        return run_id
+
+
+def get_active_join_run() -> Optional[Dict[str, Any]]:
+    """
+    Latest run that is running or stopping (if any).
+    """
+    with get_conn() as conn:
+        row = conn.execute("""
+            SELECT id, chat_id, status, started_at
+            FROM join_runs
+            WHERE status IN ('running', 'stopping')
+            ORDER BY id DESC
+            LIMIT 1
+        """).fetchone()
+        return dict(row) if row else None
+
+
+def list_join_runs_by_status(status: str) -> List[Dict[str, Any]]:
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT id, chat_id, status, started_at
+            FROM join_runs
+            WHERE status=?
+            ORDER BY id ASC
+        """, (status,)).fetchall()
+        return [dict(r) for r in rows]
+
+
+def request_stop_join_run(run_id: int) -> None:
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE join_runs
+            SET status='stopping'
+            WHERE id=? AND status='running'
+        """, (run_id,))
+        conn.commit()
+
+
+def is_join_run_stopping(run_id: int) -> bool:
+    with get_conn() as conn:
+        row = conn.execute("SELECT status FROM join_runs WHERE id=?", (run_id,)).fetchone()
+        return bool(row) and row["status"] in ("stopping", "stopped")
+
+
+def finish_join_run(run_id: int, status: str = "done") -> None:
+    """
+    status: 'done' | 'stopped'
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE join_runs
+            SET status=?,
+                finished_at=CURRENT_TIMESTAMP
+            WHERE id=?
+        """, (status, run_id))
+        conn.commit()
+
+
+def get_run_sessions(run_id: int) -> List[Dict[str, Any]]:
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT session_id, status, last_link_id, success, failed, requested, saved_delay_slots
+            FROM join_run_sessions
+            WHERE run_id=?
+            ORDER BY session_id ASC
+        """, (run_id,)).fetchall()
+        return [dict(r) for r in rows]
+
+
+def get_run_session(run_id: int, session_id: int) -> Optional[Dict[str, Any]]:
+    with get_conn() as conn:
+        row = conn.execute("""
+            SELECT session_id, status, last_link_id, success, failed, requested, saved_delay_slots
+            FROM join_run_sessions
+            WHERE run_id=? AND session_id=?
+        """, (run_id, session_id)).fetchone()
+        return dict(row) if row else None
+
+
+def set_run_session_status(run_id: int, session_id: int, status: str) -> None:
+    """
+    status: 'pending' | 'flood_wait' | 'running' | 'done' | 'stopped' | 'error'
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE join_run_sessions
+            SET status=?,
+                updated_at=CURRENT_TIMESTAMP
+            WHERE run_id=? AND session_id=?
+        """, (status, run_id, session_id))
+        conn.commit()
+
+
+def save_run_session_progress(
+    run_id: int,
+    session_id: int,
+    last_link_id: Optional[int],
+    success: int,
+    failed: int,
+    requested: int,
+    saved_delay_slots: int,
+) -> None:
+    """
+    Persist cursor (last processed link id) + counters.
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE join_run_sessions
+            SET last_link_id=COALESCE(?, last_link_id),
+                success=?,
+                failed=?,
+                requested=?,
+                saved_delay_slots=?,
+                updated_at=CURRENT_TIMESTAMP
+            WHERE run_id=? AND session_id=?
+        """, (last_link_id, success, failed, requested, saved_delay_slots, run_id, session_id))
+        conn.commit()
+
+
+# ---------------- links ----------------
+def _source_quality_map(conn, source_channels=None) -> Dict[str, float]:
+    """
+    Smoothed join success rate per source channel (see bot/priority.py).
+    """
+    sql = """
+        SELECT l.source_channel,
+               SUM(CASE WHEN a.join_status IN ('success','requested') THEN 1 ELSE 0 END) AS ok,
+               SUM(CASE WHEN l.status='dead' OR a.join_status='failed' THEN 1 ELSE 0 END) AS bad
+        FROM links l
+        LEFT JOIN assignments a ON a.link_id = l.id
+    """
+    params: tuple = ()
+    if source_channels is not None:
+        sql += f" WHERE l.source_channel IN ({','.join('?' * len(source_channels))})"
+        params = tuple(source_channels)
+    sql += " GROUP BY l.source_channel"
+
+    return {
+        r["source_channel"]: source_quality(r["ok"] or 0, r["bad"] or 0)
+        for r in conn.execute(sql, params).fetchall()
+    }
+
+
+def add_links(links: List[Any], source_channel: str) -> int:
+    """
+    Insert links as active by default.
+    Dead links are NOT reactivated.
+
+    Items are link strings or (link, source_msg_id, source_msg_date) tuples
+    (extractor); a link seen again in a newer message gets the newer date.
+    """
+    added = 0
+    now = time.time()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        quality = _source_quality_map(conn, [source_channel]).get(source_channel, source_quality(0, 0))
+
+        for item in links:
+            if isinstance(item, (tuple, list)):
+                link, msg_id, msg_date = item
+            else:
+                link, msg_id, msg_date = item, None, None
+
+            link = (link or "").strip()
+            if not link:
+                continue
+
+            kind = parse_link_type(link)[0]
+            priority = link_priority(kind, msg_date, quality, now=now)
+            cur.execute(
+                """
+                INSERT OR IGNORE INTO links(link, source_channel, status, source_msg_id, source_msg_date, kind, priority)
+                VALUES(?,?, 'active', ?,?,?,?)
+                """,
+                (link, source_channel, msg_id, msg_date, kind, priority),
+            )
+            if cur.rowcount > 0:
+                added += 1
+            elif msg_date:
+                # newer date => fresher: rescore too (keeping the attempts penalty)
+                cur.execute("""
+                    UPDATE links
+                    SET source_msg_id=?, source_msg_date=?,
+                        priority=round(? - ? * COALESCE(
+                            (SELECT join_attempts FROM assignments WHERE link_id=links.id), 0), 4)
+                    WHERE link=? AND COALESCE(source_msg_date, 0) < ?
+                """, (msg_id, msg_date, priority, PRIORITY_ATTEMPT_PENALTY, link, msg_date))
+
+        conn.commit()
+    return added
+
+
+def get_source_quality(source_channel: str) -> float:
+    with get_conn() as conn:
+        return _source_quality_map(conn, [source_channel]).get(source_channel, source_quality(0, 0))
+
+
+def add_links_bulk(links: List[str], source_channel: str, quality: Optional[float] = None) -> int:
+    """
+    Insert normalized links as active in one transaction (large imports,
+    bot/link_import.py). Existing links of any status are left untouched.
+    quality: source quality computed once by the caller (else looked up).
+    Returns number of links inserted.
+    """
+    if not links:
+        return 0
+
+    now = time.time()
+    if quality is None:
+        quality = get_source_quality(source_channel)
+
+    rows = []
+    for link in links:
+        kind = parse_link_type(link)[0]
+        rows.append((link, source_channel, kind, link_priority(kind, None, quality, now=now)))
+
+    with _immediate_tx() as conn:
+        before = conn.total_changes
+        conn.executemany("""
+            INSERT OR IGNORE INTO links(link, source_channel, status, kind, priority)
+            VALUES(?,?, 'active', ?,?)
+        """, rows)
+        return conn.total_changes - before
+
+
+def refresh_link_priorities() -> int:
+    """
+    Recompute links.priority for links still waiting to be joined
+    (unassigned or pending): freshness decays, source channel quality and
+    join attempts change as runs progress. Also backfills links.kind.
+
+    Scored in SQL (link_priority_sql), only changed rows are written:
+    rescoring ~1M links row by row in Python stalled every distribution.
+    Returns number of links updated.
+    """
+    with get_conn() as conn:
+        # kind is set on insert: only links from before the column need parsing
+        missing = conn.execute("SELECT id, link FROM links WHERE kind IS NULL").fetchall()
+        conn.executemany(
+            "UPDATE links SET kind=? WHERE id=?",
+            [(parse_link_type(r["link"])[0], r["id"]) for r in missing],
+        )
+
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS source_quality(
+                source_channel TEXT PRIMARY KEY,
+                quality REAL
+            )
+        """)
+        conn.execute("DELETE FROM temp.source_quality")
+        conn.executemany("INSERT INTO temp.source_quality VALUES(?,?)", _source_quality_map(conn).items())
+
+        score, params = link_priority_sql()
+        cur = conn.execute(f"""
+            UPDATE links AS t
+            SET priority = p.score
+            FROM (
+                SELECT id, priority, {score} AS score
+                FROM (
+                    SELECT l.id, l.priority, l.kind, l.source_msg_date AS msg_date,
+                           COALESCE(q.quality, ?) AS quality, a.join_attempts AS attempts
+                    FROM links l
+                    LEFT JOIN assignments a ON a.link_id = l.id
+                    LEFT JOIN temp.source_quality q ON q.source_channel = l.source_channel
+                    WHERE (l.status IS NULL OR l.status='active')
+                      AND (l.assigned=0 OR a.join_status='pending')
+                )
+            ) AS p
+            WHERE t.id = p.id AND p.priority IS NOT p.score
+        """, (*params, source_quality(0, 0)))
+        conn.commit()
+        return cur.rowcount + len(missing)
+
+
+def get_unexpanded_folder_links(limit: int = 100) -> List[Tuple[int, str]]:
+    """
+    Active chat folder (addlist) links not expanded into member peers yet.
+    """
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT id, link
+            FROM links
+            WHERE link LIKE '%/addlist/%'
+              AND (status IS NULL OR status='active')
+              AND expanded_at IS NULL
+            ORDER BY id ASC
+            LIMIT ?
+        """, (limit,)).fetchall()
+        return [(r["id"], r["link"]) for r in rows]
+
+
+def save_folder_peers(folder_link_id: int, peers: List[Tuple[int, str, str]]) -> int:
+    """
+    Store (peer_id, username, title) child rows of a folder link and mark it expanded.
+    Username peers are linked to existing individual links of the same chat
+    (links.peer_id stamped); links of the chat already known by peer_id
+    (invite links joined before) are covered too.
+    Returns number of individual links covered by the folder.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+
+        for peer_id, username, title in peers:
+            child_link_id = None
+            if username:
+                row = cur.execute(
+                    "SELECT id FROM links WHERE link = ? COLLATE NOCASE",
+                    (f"https://t.me/{username}",),
+                ).fetchone()
+                if row:
+                    child_link_id = row["id"]
+                    cur.execute("UPDATE links SET peer_id=? WHERE id=?", (peer_id, child_link_id))
+
+            cur.execute("""
+                INSERT OR REPLACE INTO folder_peers(folder_link_id, peer_id, username, title, child_link_id)
+                VALUES(?,?,?,?,?)
+            """, (folder_link_id, peer_id, username or None, (title or "")[:255], child_link_id))
+
+        cur.execute("UPDATE links SET expanded_at=CURRENT_TIMESTAMP WHERE id=?", (folder_link_id,))
+        covered = cur.execute("""
+            SELECT COUNT(*)
+            FROM folder_peers fp
+            JOIN links c ON c.peer_id = fp.peer_id
+            WHERE fp.folder_link_id = ? AND c.id != ?
+        """, (folder_link_id, folder_link_id)).fetchone()[0]
+        conn.commit()
+        return covered
+
+
+def get_link_peer_ids(link_ids: List[int]) -> Dict[int, int]:
+    """
+    {link_id: peer_id} for links whose chat is known.
+    """
+    out: Dict[int, int] = {}
+    with get_conn() as conn:
+        for i in range(0, len(link_ids), 500):
+            chunk = link_ids[i:i + 500]
+            for r in conn.execute(f"""
+                SELECT id, peer_id FROM links
+                WHERE peer_id IS NOT NULL AND id IN ({','.join('?' * len(chunk))})
+            """, chunk).fetchall():
+                out[r["id"]] = r["peer_id"]
+    return out
+
+
+def save_session_folder(session_id: int, folder_link_id: int, filter_id: int, peers_count: int = 0) -> None:
+    """
+    Remember the dialog filter (folder) a session joined through a folder link.
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            INSERT INTO session_folders(session_id, folder_link_id, filter_id, peers_count)
+            VALUES(?,?,?,?)
+            ON CONFLICT(session_id, folder_link_id) DO UPDATE SET
+                filter_id=excluded.filter_id,
+                peers_count=MAX(session_folders.peers_count, excluded.peers_count)
+        """, (session_id, folder_link_id, int(filter_id), int(peers_count)))
+        conn.commit()
+
+
+def list_session_folders(session_id: int) -> List[Dict[str, Any]]:
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT sf.folder_link_id, sf.filter_id, sf.peers_count, sf.last_polled_at, l.link
+            FROM session_folders sf
+            JOIN links l ON l.id = sf.folder_link_id
+            WHERE sf.session_id=?
+            ORDER BY sf.folder_link_id ASC
+        """, (session_id,)).fetchall()
+        return [dict(r) for r in rows]
+
+
+def list_sessions_with_folders() -> List[int]:
     with get_conn() as conn:
-        cur = conn.cursor()
-        for link in links:
-            link = (link or "").strip()
-            if not link:
-                continue
+        rows = conn.execute("""
+            SELECT DISTINCT sf.session_id
+            FROM session_folders sf
+            JOIN sessions s ON s.id = sf.session_id
+            WHERE s.status='active'
+            ORDER BY sf.session_id ASC
+        """).fetchall()
+        return [r["session_id"] for r in rows]
 
-            cur.execute(
-                "INSERT OR IGNORE INTO links(link, source_channel, status) VALUES(?,?, 'active')",
-                (link, source_channel),
-            )
-            if cur.rowcount > 0:
-                added += 1
 
+def mark_session_folder_polled(session_id: int, folder_link_id: int, new_peers: int) -> None:
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE session_folders
+            SET last_polled_at=CURRENT_TIMESTAMP,
+                last_new_peers=?,
+                peers_count=peers_count+?
+            WHERE session_id=? AND folder_link_id=?
+        """, (new_peers, new_peers, session_id, folder_link_id))
+        conn.commit()
+
+
+def delete_session_folder(session_id: int, folder_link_id: int) -> None:
+    with get_conn() as conn:
+        conn.execute("""
+            DELETE FROM session_folders
+            WHERE session_id=? AND folder_link_id=?
+        """, (session_id, folder_link_id))
         conn.commit()
-    return added
 
 
 def mark_link_dead(link_id: int, reason: str = "") -> None:
@@ -206,6 +1094,62 @@ def mark_link_dead(link_id: int, reason: str = "") -> None:
         conn.commit()
 
 
+def get_dead_links_due(limit: int, base_seconds: int) -> List[Tuple[int, str, int]]:
+    """
+    Dead links due for a recheck, oldest last_checked_at first:
+    recheck_at passed, or never rechecked and dead for base_seconds.
+    Returns (link_id, link, dead_checks).
+    """
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT id, link, COALESCE(dead_checks, 0) AS dead_checks
+            FROM links
+            WHERE status='dead'
+              AND CASE
+                    WHEN recheck_at IS NULL THEN COALESCE(last_checked_at, '') <= datetime('now', ?)
+                    ELSE recheck_at <= ?
+                  END
+            ORDER BY last_checked_at ASC, id ASC
+            LIMIT ?
+        """, (f"-{int(base_seconds)} seconds", time.time(), limit)).fetchall()
+        return [(r["id"], r["link"], r["dead_checks"]) for r in rows]
+
+
+def save_dead_link_rechecks(alive: List[int], still_dead: List[Tuple[int, str, float]]) -> int:
+    """
+    Apply one recheck batch in one transaction:
+    - alive: link ids back to active (failed assignment rows dropped so the
+      distributor can assign them again)
+    - still_dead: (link_id, reason, recheck_at) => dead_checks + 1, next due time
+    Returns number of links reactivated.
+    """
+    with _immediate_tx() as conn:
+        reactivated = 0
+        for link_id in alive:
+            cur = conn.execute("""
+                UPDATE links
+                SET status='active',
+                    dead_reason=NULL,
+                    dead_checks=0,
+                    recheck_at=NULL,
+                    last_checked_at=CURRENT_TIMESTAMP
+                WHERE id=? AND status='dead'
+            """, (link_id,))
+            if cur.rowcount:
+                reactivated += 1
+                conn.execute("DELETE FROM assignments WHERE link_id=? AND join_status='failed'", (link_id,))
+
+        conn.executemany("""
+            UPDATE links
+            SET dead_reason=?,
+                dead_checks=COALESCE(dead_checks, 0) + 1,
+                recheck_at=?,
+                last_checked_at=CURRENT_TIMESTAMP
+            WHERE id=? AND status='dead'
+        """, [((reason or "")[:1000], recheck_at, link_id) for link_id, reason, recheck_at in still_dead])
+        return reactivated
+
+
 def count_links_total() -> int:
     with get_conn() as conn:
         return conn.execute("SELECT COUNT(*) FROM links").fetchone()[0]
@@ -225,8 +1169,7 @@ def count_links_unassigned_active() -> int:
         return conn.execute("""
             SELECT COUNT(*)
             FROM links l
-            LEFT JOIN assignments a ON a.link_id = l.id
-            WHERE a.link_id IS NULL
+            WHERE l.assigned=0
               AND (l.status IS NULL OR l.status='active')
         """).fetchone()[0]
 
@@ -239,69 +1182,148 @@ def count_links_unassigned_any() -> int:
         return conn.execute("""
             SELECT COUNT(*)
             FROM links l
-            LEFT JOIN assignments a ON a.link_id = l.id
-            WHERE a.link_id IS NULL
+            WHERE l.assigned=0
         """).fetchone()[0]
 
 
-def pop_reserve_link() -> Optional[Tuple[int, str]]:
+# ---------------- assignments ----------------
+# SQL condition on links l: not a chat of a folder that is itself still waiting
+# to be assigned (the folder brings it along)
+_NOT_WAITING_FOR_FOLDER = """(
+    l.peer_id IS NULL OR l.peer_id NOT IN (
+        SELECT fp.peer_id
+        FROM folder_peers fp
+        JOIN links f ON f.id = fp.folder_link_id
+        WHERE f.assigned=0
+          AND (f.status IS NULL OR f.status='active')
+    )
+)"""
+
+
+def _assign_unassigned_links(cur, session_id: int, limit: int) -> int:
     """
-    Get ONE active unassigned link from reserve pool.
+    Assignment step of assign_unassigned_links on an open cursor (caller commits).
+
+    `limit` is a budget of channel slots: a plain link costs 1, a folder costs
+    max(member chats, 1 + covered links brought along). A folder that
+    doesn't fit the remaining budget is skipped for cheaper links.
     """
-    with get_conn() as conn:
-        row = conn.execute("""
-            SELECT l.id, l.link
+    assigned = 0
+    budget = limit
+    skipped = 0
+    while budget > 0:
+        # skipped folders stay unassigned ahead of the next candidates: OFFSET past them
+        rows = cur.execute(f"""
+            SELECT l.id,
+                   (SELECT COUNT(*) FROM folder_peers fp WHERE fp.folder_link_id = l.id) AS peers
             FROM links l
-            LEFT JOIN assignments a ON a.link_id = l.id
-            WHERE a.link_id IS NULL
+            WHERE l.assigned=0
               AND (l.status IS NULL OR l.status='active')
-            ORDER BY l.id ASC
-            LIMIT 1
-        """).fetchone()
+              AND {_NOT_WAITING_FOR_FOLDER}
+            ORDER BY l.priority DESC, l.id ASC
+            LIMIT ? OFFSET ?
+        """, (budget, skipped)).fetchall()
+        if not rows:
+            break
 
-        if not row:
-            return None
-        return (row["id"], row["link"])
+        for r in rows:
+            if budget <= 0:
+                break
+            assigned_now, cost = _assign_with_children(cur, session_id, r["id"], r["peers"], budget)
+            if cost == 0:
+                skipped += 1
+            assigned += assigned_now
+            budget -= cost
+
+    return assigned
+
+
+def _assign_with_children(cur, session_id: int, link_id: int, peers: int, budget: int) -> Tuple[int, int]:
+    """
+    Assign one link (and, for a folder, its covered links) if its slot cost fits
+    `budget`. Returns (links assigned, slots used); (0, 0) => skipped.
+    """
+    children: List[int] = []
+    if peers:
+        # folder => its covered individual links go along (same chats, one join)
+        children = [c["id"] for c in cur.execute("""
+            SELECT DISTINCT c.id
+            FROM folder_peers fp
+            JOIN links c ON c.peer_id = fp.peer_id
+            WHERE fp.folder_link_id = ?
+              AND c.id != ?
+              AND c.assigned=0
+              AND (c.status IS NULL OR c.status='active')
+        """, (link_id, link_id)).fetchall()]
+
+    cost = max(peers, 1 + len(children))
+    if cost > budget:
+        return 0, 0
+
+    cur.execute("""
+        INSERT OR IGNORE INTO assignments(link_id, session_id)
+        VALUES(?,?)
+    """, (link_id, session_id))
+    if cur.rowcount <= 0:
+        return 0, 0
+
+    cur.executemany("""
+        INSERT OR IGNORE INTO assignments(link_id, session_id)
+        VALUES(?,?)
+    """, [(cid, session_id) for cid in children])
+    return 1 + len(children), cost
 
 
-# ---------------- assignments ----------------
 def assign_unassigned_links(session_id: int, limit: int) -> int:
     """
-    Assign up to `limit` unassigned ACTIVE links to a session.
+    Assign unassigned ACTIVE links to a session, `limit` channel slots worth
+    (see _assign_unassigned_links). Returns number of links assigned.
+
+    Chat folders:
+    - individual links covered by a still-unassigned folder wait for it
+    - when a folder is assigned, its covered unassigned links go to the
+      same session (one folder join satisfies all of them)
     """
     with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT l.id
+        assigned = _assign_unassigned_links(conn.cursor(), session_id, limit)
+        conn.commit()
+        return assigned
+
+
+def top_up_session_links(session_id: int, low_water: int, batch: int, reserve: int) -> int:
+    """
+    Continuous distribution during a run: if the session has fewer than
+    `low_water` pending links, assign up to `batch` more (priority order),
+    never touching the last `reserve` unassigned links and never beyond
+    the session's free channel slots.
+
+    One BEGIN IMMEDIATE transaction, so concurrent top-ups (sessions,
+    worker processes) can't both take the same reserve headroom.
+    Returns number of links assigned.
+    """
+    with _immediate_tx() as conn:
+        cap = _sessions_capacity(conn, session_id).get(session_id)
+        if not cap or cap["full"] or cap["pending"] >= low_water:
+            return 0
+
+        unassigned = conn.execute("""
+            SELECT COUNT(*)
             FROM links l
-            LEFT JOIN assignments a ON a.link_id = l.id
-            WHERE a.link_id IS NULL
+            WHERE l.assigned=0
               AND (l.status IS NULL OR l.status='active')
-            ORDER BY l.id ASC
-            LIMIT ?
-        """, (limit,))
-        rows = cur.fetchall()
+        """).fetchone()[0]
 
-        if not rows:
+        n = min(batch, unassigned - reserve, cap["free"])
+        if n <= 0:
             return 0
 
-        assigned = 0
-        for r in rows:
-            link_id = r["id"]
-            cur.execute("""
-                INSERT OR IGNORE INTO assignments(link_id, session_id)
-                VALUES(?,?)
-            """, (link_id, session_id))
-            if cur.rowcount > 0:
-                assigned += 1
-
-        conn.commit()
-        return assigned
+        return _assign_unassigned_links(conn.cursor(), session_id, n)
 
 
 def get_pending_links_for_session(session_id: int, limit: int = 1000):
     """
-    Return active links where assignment status is pending.
+    Return active links where assignment status is pending
+    (links deferred by a transient error are skipped until their next_attempt_at).
     """
     with get_conn() as conn:
         cur = conn.cursor()
@@ -312,13 +1334,44 @@ def get_pending_links_for_session(session_id: int, limit: int = 1000):
             WHERE a.session_id = ?
               AND a.join_status = 'pending'
               AND (l.status IS NULL OR l.status='active')
-            ORDER BY l.id ASC
+              AND (a.next_attempt_at IS NULL OR a.next_attempt_at <= ?)
+            ORDER BY l.priority DESC, l.id ASC
             LIMIT ?
-        """, (session_id, limit))
+        """, (session_id, time.time(), limit))
         return [(r["id"], r["link"]) for r in cur.fetchall()]
 
 
-def mark_join_success(session_id: int, link_id: int):
+def get_deferred_links_for_session(session_id: int) -> List[Tuple[int, str, float]]:
+    """
+    Pending links waiting for a retry: (link_id, link, next_attempt_at).
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT l.id, l.link, a.next_attempt_at
+            FROM links l
+            JOIN assignments a ON a.link_id = l.id
+            WHERE a.session_id = ?
+              AND a.join_status = 'pending'
+              AND (l.status IS NULL OR l.status='active')
+              AND a.next_attempt_at > ?
+            ORDER BY a.next_attempt_at ASC
+        """, (session_id, time.time()))
+        return [(r["id"], r["link"], r["next_attempt_at"]) for r in cur.fetchall()]
+
+
+def mark_join_success(
+    session_id: int,
+    link_id: int,
+    peer_id: Optional[int] = None,
+    link: Optional[str] = None,
+    note: str = "",
+):
+    """
+    peer_id: the chat the link led to (single-chat join result), stamped on
+    the link so folders containing that chat cover it.
+    link: also write its join_log success row (note) in the same transaction.
+    """
     with get_conn() as conn:
         conn.execute("""
             UPDATE assignments
@@ -326,9 +1379,41 @@ def mark_join_success(session_id: int, link_id: int):
                 joined_at=CURRENT_TIMESTAMP
             WHERE session_id=? AND link_id=?
         """, (session_id, link_id))
+        if peer_id is not None:
+            conn.execute("UPDATE links SET peer_id=? WHERE id=? AND peer_id IS NULL", (int(peer_id), link_id))
+        if link is not None:
+            conn.execute("""
+                INSERT INTO join_log(session_id, link, status, error_message)
+                VALUES(?,?,?,?)
+            """, (session_id, link, "success", (note or "")[:1000]))
         conn.commit()
 
 
+def mark_joins_success_bulk(session_id: int, links: List[Tuple[int, str]], note: str = "") -> int:
+    """
+    Mark many (link_id, link) assignments success in one transaction + join_log rows.
+    Used when links are already satisfied without any RPC.
+    """
+    if not links:
+        return 0
+
+    with get_conn() as conn:
+        conn.executemany("""
+            UPDATE assignments
+            SET join_status='success',
+                joined_at=CURRENT_TIMESTAMP
+            WHERE session_id=? AND link_id=?
+        """, [(session_id, link_id) for link_id, _ in links])
+
+        conn.executemany("""
+            INSERT INTO join_log(session_id, link, status, error_message)
+            VALUES(?,?,?,?)
+        """, [(session_id, link, "success", (note or "")[:1000]) for _, link in links])
+
+        conn.commit()
+    return len(links)
+
+
 def mark_join_failed(session_id: int, link_id: int, error: str):
     with get_conn() as conn:
         conn.execute("""
@@ -350,12 +1435,99 @@ def mark_join_requested(session_id: int, link_id: int, note: str = ""):
             UPDATE assignments
             SET join_status='requested',
                 join_attempts=join_attempts+1,
-                last_error=?
+                last_error=?,
+                requested_at=CURRENT_TIMESTAMP
             WHERE session_id=? AND link_id=?
         """, ((note or "")[:1000], session_id, link_id))
         conn.commit()
 
 
+def list_sessions_with_requested() -> List[int]:
+    """
+    Active sessions having at least one 'requested' assignment.
+    """
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT DISTINCT a.session_id
+            FROM assignments a
+            JOIN sessions s ON s.id = a.session_id
+            WHERE a.join_status='requested'
+              AND s.status='active'
+            ORDER BY a.session_id ASC
+        """).fetchall()
+        return [r["session_id"] for r in rows]
+
+
+def get_requested_links_for_session(session_id: int) -> List[Tuple[int, str]]:
+    """
+    Links waiting for admin approval: least recently checked first
+    (never checked first), then oldest request.
+    """
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT l.id, l.link
+            FROM links l
+            JOIN assignments a ON a.link_id = l.id
+            WHERE a.session_id = ?
+              AND a.join_status = 'requested'
+            ORDER BY COALESCE(a.request_checked_at, 0) ASC,
+                     COALESCE(a.requested_at, a.assigned_at) ASC, l.id ASC
+        """, (session_id,)).fetchall()
+        return [(r["id"], r["link"]) for r in rows]
+
+
+def mark_requests_checked(session_id: int, link_ids: List[int]) -> None:
+    """
+    Requested invite links checked this poll go to the back of the rotation.
+    """
+    if not link_ids:
+        return
+    now = time.time()
+    with get_conn() as conn:
+        conn.executemany("""
+            UPDATE assignments
+            SET request_checked_at=?
+            WHERE session_id=? AND link_id=?
+        """, [(now, session_id, lid) for lid in link_ids])
+        conn.commit()
+
+
+def expire_stale_requests(ttl_hours: int) -> int:
+    """
+    requested -> failed ('request_expired') when older than ttl_hours.
+    Rows from before requested_at existed fall back to assigned_at.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cutoff = f"-{int(ttl_hours)} hours"
+
+        rows = cur.execute("""
+            SELECT a.session_id, a.link_id, l.link
+            FROM assignments a
+            JOIN links l ON l.id = a.link_id
+            WHERE a.join_status='requested'
+              AND COALESCE(a.requested_at, a.assigned_at) < datetime('now', ?)
+        """, (cutoff,)).fetchall()
+
+        if not rows:
+            return 0
+
+        cur.executemany("""
+            UPDATE assignments
+            SET join_status='failed',
+                last_error='request_expired'
+            WHERE session_id=? AND link_id=?
+        """, [(r["session_id"], r["link_id"]) for r in rows])
+
+        cur.executemany("""
+            INSERT INTO join_log(session_id, link, status, error_message)
+            VALUES(?,?, 'failed', 'request_expired')
+        """, [(r["session_id"], r["link"]) for r in rows])
+
+        conn.commit()
+        return len(rows)
+
+
 def bump_attempt(session_id: int, link_id: int, error: str = ""):
     """
     FloodWait handling: increase attempt count without changing join_status.
@@ -370,6 +1542,31 @@ def bump_attempt(session_id: int, link_id: int, error: str = ""):
         conn.commit()
 
 
+def get_assignment_retries(session_id: int, link_id: int) -> int:
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT retries FROM assignments WHERE session_id=? AND link_id=?",
+            (session_id, link_id),
+        ).fetchone()
+        return int(row["retries"] or 0) if row else 0
+
+
+def schedule_join_retry(session_id: int, link_id: int, next_attempt_at: float, error: str = "") -> None:
+    """
+    Transient error: keep the link pending, retry not before next_attempt_at.
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE assignments
+            SET join_attempts=join_attempts+1,
+                retries=COALESCE(retries, 0)+1,
+                next_attempt_at=?,
+                last_error=?
+            WHERE session_id=? AND link_id=?
+        """, (next_attempt_at, (error or "")[:1000], session_id, link_id))
+        conn.commit()
+
+
 def log_join(session_id: int, link: str, status: str, error_message: str = ""):
     with get_conn() as conn:
         conn.execute("""
@@ -388,10 +1585,13 @@ def replace_dead_assignment(
     Replace dead link assigned to a session:
     1) mark link dead
     2) delete its assignment
-    3) pull new link from reserve (active unassigned)
+    3) pull new link from reserve (active unassigned), same filters as
+       _assign_unassigned_links: not waiting for its folder, within the
+       session's free channel slots, one slot at most (a folder bringing
+       covered links along is left to the distributor)
     4) assign it to same session
 
-    Returns (new_link_id, new_link) or None if reserve empty.
+    Returns (new_link_id, new_link) or None if reserve empty or session full.
     """
     with get_conn() as conn:
         cur = conn.cursor()
@@ -411,16 +1611,29 @@ def replace_dead_assignment(
             WHERE session_id=? AND link_id=?
         """, (session_id, dead_link_id))
 
-        # 3) pick reserve link
-        row = cur.execute("""
-            SELECT l.id, l.link
-            FROM links l
-            LEFT JOIN assignments a ON a.link_id = l.id
-            WHERE a.link_id IS NULL
-              AND (l.status IS NULL OR l.status='active')
-            ORDER BY l.id ASC
-            LIMIT 1
-        """).fetchone()
+        # 3) pick reserve link (the dead link's slot is free again)
+        cap = _sessions_capacity(conn, session_id).get(session_id)
+        row = None
+        if cap and cap["free"] > 0:
+            row = cur.execute(f"""
+                SELECT l.id, l.link
+                FROM links l
+                WHERE l.assigned=0
+                  AND (l.status IS NULL OR l.status='active')
+                  AND {_NOT_WAITING_FOR_FOLDER}
+                  AND (SELECT COUNT(*) FROM folder_peers fp WHERE fp.folder_link_id = l.id) <= 1
+                  AND NOT EXISTS (
+                      SELECT 1
+                      FROM folder_peers fp
+                      JOIN links c ON c.peer_id = fp.peer_id
+                      WHERE fp.folder_link_id = l.id
+                        AND c.id != l.id
+                        AND c.assigned=0
+                        AND (c.status IS NULL OR c.status='active')
+                  )
+                ORDER BY l.priority DESC, l.id ASC
+                LIMIT 1
+            """).fetchone()
 
         if not row:
             conn.commit()
@@ -439,6 +1652,282 @@ def replace_dead_assignment(
         return (new_link_id, new_link)
 
 
+# ---------------- work leases ----------------
+# A worker owns a session's pending work while it holds a live lease
+# (lease_expires_at > now) on that session's pending assignment rows.
+# Claims run inside BEGIN IMMEDIATE so concurrent workers serialize on SQLite.
+@contextmanager
+def _immediate_tx():
+    with get_conn() as conn:
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.isolation_level = ""
+
+
+def _lease_session_rows(conn, worker_id: str, session_id: int, lease_seconds: float, now: float) -> int:
+    cur = conn.execute("""
+        UPDATE assignments
+        SET lease_owner=?,
+            lease_expires_at=?,
+            heartbeat_at=?
+        WHERE session_id=?
+          AND join_status='pending'
+          AND (lease_owner IS NULL OR lease_owner=? OR lease_expires_at IS NULL OR lease_expires_at <= ?)
+    """, (worker_id, now + lease_seconds, now, session_id, worker_id, now))
+    return cur.rowcount
+
+
+def _session_leased_by_other(conn, worker_id: str, session_id: int, now: float) -> bool:
+    row = conn.execute("""
+        SELECT 1
+        FROM assignments
+        WHERE session_id=?
+          AND join_status='pending'
+          AND lease_owner IS NOT NULL
+          AND lease_owner != ?
+          AND lease_expires_at > ?
+        LIMIT 1
+    """, (session_id, worker_id, now)).fetchone()
+    return row is not None
+
+
+def claim_session_lease(worker_id: str, session_id: int, lease_seconds: float) -> bool:
+    """
+    Lease all pending rows of one session to worker_id.
+    False if another worker holds a live lease on that session.
+    """
+    now = time.time()
+    with _immediate_tx() as conn:
+        if _session_leased_by_other(conn, worker_id, session_id, now):
+            return False
+        _lease_session_rows(conn, worker_id, session_id, lease_seconds, now)
+        return True
+
+
+def claim_next_session_lease(
+    worker_id: str,
+    lease_seconds: float,
+    exclude_session_ids: Optional[List[int]] = None,
+) -> Optional[int]:
+    """
+    Pick an active, not flood-limited session with pending work and no live
+    lease, lease its pending rows to worker_id and return its id (None if nothing).
+    """
+    now = time.time()
+    exclude = list(exclude_session_ids or [])
+    exclude_sql = f"AND a.session_id NOT IN ({','.join('?' * len(exclude))})" if exclude else ""
+
+    with _immediate_tx() as conn:
+        row = conn.execute(f"""
+            SELECT a.session_id
+            FROM assignments a
+            JOIN sessions s ON s.id = a.session_id
+            WHERE a.join_status='pending'
+              AND s.status='active'
+              AND COALESCE(s.flood_until, 0) <= ?
+              {exclude_sql}
+            GROUP BY a.session_id
+            HAVING SUM(CASE WHEN a.lease_owner IS NOT NULL AND a.lease_expires_at > ? THEN 1 ELSE 0 END) = 0
+            ORDER BY a.session_id ASC
+            LIMIT 1
+        """, (now, *exclude, now)).fetchone()
+
+        if not row:
+            return None
+
+        session_id = row["session_id"]
+        _lease_session_rows(conn, worker_id, session_id, lease_seconds, now)
+        return session_id
+
+
+def heartbeat_session_lease(worker_id: str, session_id: int, lease_seconds: float) -> int:
+    """
+    Extend our lease on the session's pending rows (and adopt unowned pending rows,
+    e.g. reserve replacements). Returns number of rows leased; 0 while work remains
+    means the lease was lost to another worker.
+    """
+    now = time.time()
+    with _immediate_tx() as conn:
+        if _session_leased_by_other(conn, worker_id, session_id, now):
+            return 0
+        return _lease_session_rows(conn, worker_id, session_id, lease_seconds, now)
+
+
+def release_session_lease(worker_id: str, session_id: int) -> None:
+    with get_conn() as conn:
+        conn.execute("""
+            UPDATE assignments
+            SET lease_owner=NULL,
+                lease_expires_at=NULL
+            WHERE session_id=? AND lease_owner=?
+        """, (session_id, worker_id))
+        conn.commit()
+
+
+def reclaim_expired_leases() -> int:
+    """
+    Clear leases whose holder stopped heartbeating (crashed worker).
+    Expired leases are claimable anyway; this just makes ownership visible.
+    """
+    with get_conn() as conn:
+        cur = conn.execute("""
+            UPDATE assignments
+            SET lease_owner=NULL,
+                lease_expires_at=NULL
+            WHERE lease_owner IS NOT NULL
+              AND lease_expires_at <= ?
+        """, (time.time(),))
+        conn.commit()
+        return cur.rowcount
+
+
+def count_live_leases(exclude_worker_id: str = "") -> int:
+    """
+    Sessions currently leased (live) by workers other than exclude_worker_id.
+    """
+    with get_conn() as conn:
+        return conn.execute("""
+            SELECT COUNT(DISTINCT session_id)
+            FROM assignments
+            WHERE join_status='pending'
+              AND lease_owner IS NOT NULL
+              AND lease_owner != ?
+              AND lease_expires_at > ?
+        """, (exclude_worker_id, time.time())).fetchone()[0]
+
+
+# ---------------- throughput ----------------
+def get_session_join_stats(window_hours: int) -> Dict[int, Dict[str, int]]:
+    """
+    Per-session join activity from join_log over the last window_hours:
+    - joins: chats joined by RPC + join requests sent
+    - delayed: joins followed by a JOIN_DELAY_SECONDS pause
+    - rpcs: join RPCs answered with anything but FloodWait
+    - dead: links found dead (expired / invalid / private)
+    - flood_events / flood_seconds: FloodWait hits and total wait
+    Skips without RPC (snapshot / folder coverage / approvals) are not counted.
+    """
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT session_id,
+                   SUM(CASE WHEN (status='success' AND msg='') OR status='requested'
+                            THEN 1 ELSE 0 END) AS joins,
+                   SUM(CASE WHEN status='success' AND msg='' THEN 1 ELSE 0 END) AS delayed,
+                   SUM(CASE WHEN (status='success' AND msg IN ('', 'already_participant'))
+                              OR status IN ('requested', 'retry')
+                              OR (status='failed' AND msg NOT LIKE 'FloodWaitError%')
+                            THEN 1 ELSE 0 END) AS rpcs,
+                   SUM(CASE WHEN status='failed' AND msg LIKE 'dead_link:%'
+                            THEN 1 ELSE 0 END) AS dead,
+                   SUM(CASE WHEN status='failed' AND msg LIKE 'FloodWaitError wait %'
+                            THEN 1 ELSE 0 END) AS flood_events,
+                   SUM(CASE WHEN status='failed' AND msg LIKE 'FloodWaitError wait %'
+                            THEN CAST(substr(msg, 21) AS INTEGER) ELSE 0 END) AS flood_seconds
+            FROM (
+                SELECT session_id, status, COALESCE(error_message, '') AS msg
+                FROM join_log
+                WHERE created_at >= datetime('now', ?)
+            )
+            GROUP BY session_id
+        """, (f"-{int(window_hours)} hours",)).fetchall()
+
+        return {
+            r["session_id"]: {
+                "joins": r["joins"] or 0,
+                "delayed": r["delayed"] or 0,
+                "rpcs": r["rpcs"] or 0,
+                "dead": r["dead"] or 0,
+                "flood_events": r["flood_events"] or 0,
+                "flood_seconds": r["flood_seconds"] or 0,
+            }
+            for r in rows
+        }
+
+
+def get_source_dead_stats(window_hours: int) -> Dict[str, Dict[str, int]]:
+    """
+    Per source channel over the last window_hours:
+    - dead: links marked dead (links.last_checked_at; links already rechecked
+      by bot/dead_links.py are not counted again)
+    - ok: links joined or requested (assignments.joined_at / requested_at)
+    """
+    since = f"-{int(window_hours)} hours"
+    with get_conn() as conn:
+        stats: Dict[str, Dict[str, int]] = {}
+        for r in conn.execute("""
+            SELECT source_channel, COUNT(*) AS n
+            FROM links
+            WHERE status='dead'
+              AND COALESCE(dead_checks, 0) = 0
+              AND last_checked_at >= datetime('now', ?)
+            GROUP BY source_channel
+        """, (since,)).fetchall():
+            stats.setdefault(r["source_channel"], {"dead": 0, "ok": 0})["dead"] = r["n"]
+
+        for r in conn.execute("""
+            SELECT l.source_channel, COUNT(*) AS n
+            FROM assignments a
+            JOIN links l ON l.id = a.link_id
+            WHERE a.join_status IN ('success', 'requested')
+              AND COALESCE(a.joined_at, a.requested_at) >= datetime('now', ?)
+            GROUP BY l.source_channel
+        """, (since,)).fetchall():
+            stats.setdefault(r["source_channel"], {"dead": 0, "ok": 0})["ok"] = r["n"]
+
+        return stats
+
+
+def count_open_links_by_source() -> Tuple[List[Tuple[int, str, int]], Dict[str, int]]:
+    """
+    Work still ahead, by source channel:
+    - pending: [(session_id, source_channel, count)]
+    - unassigned active: {source_channel: count}
+    """
+    with get_conn() as conn:
+        pending = [
+            (r["session_id"], r["source_channel"], r["n"])
+            for r in conn.execute("""
+                SELECT a.session_id, l.source_channel, COUNT(*) AS n
+                FROM assignments a
+                JOIN links l ON l.id = a.link_id
+                WHERE a.join_status='pending'
+                  AND (l.status IS NULL OR l.status='active')
+                GROUP BY a.session_id, l.source_channel
+            """).fetchall()
+        ]
+
+        unassigned = {
+            r["source_channel"]: r["n"]
+            for r in conn.execute("""
+                SELECT l.source_channel, COUNT(*) AS n
+                FROM links l
+                WHERE l.assigned=0
+                  AND (l.status IS NULL OR l.status='active')
+                GROUP BY l.source_channel
+            """).fetchall()
+        }
+
+        return pending, unassigned
+
+
+def count_pending_per_session() -> Dict[int, int]:
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT session_id, COUNT(*) AS n
+            FROM assignments
+            WHERE join_status='pending'
+            GROUP BY session_id
+        """).fetchall()
+        return {r["session_id"]: r["n"] for r in rows}
+
+
 # ---------------- export functions ----------------
 def get_links_for_session_export(session_id: int, limit: int = 1000) -> List[str]:
     """
@@ -469,10 +1958,9 @@ def get_reserve_links_export(limit: int = 500) -> List[str]:
         rows = conn.execute("""
             SELECT l.link
             FROM links l
-            LEFT JOIN assignments a ON a.link_id = l.id
-            WHERE a.link_id IS NULL
+            WHERE l.assigned=0
               AND (l.status IS NULL OR l.status='active')
-            ORDER BY l.id ASC
+            ORDER BY l.priority DESC, l.id ASC
             LIMIT ?
         """, (limit,)).fetchall()
 
@@ -496,16 +1984,14 @@ def get_stats() -> Dict[str, Any]:
         reserve_links = cur.execute("""
             SELECT COUNT(*)
             FROM links l
-            LEFT JOIN assignments a ON a.link_id = l.id
-            WHERE a.link_id IS NULL
+            WHERE l.assigned=0
               AND (l.status IS NULL OR l.status='active')
         """).fetchone()[0]
 
         unassigned_any = cur.execute("""
             SELECT COUNT(*)
             FROM links l
-            LEFT JOIN assignments a ON a.link_id = l.id
-            WHERE a.link_id IS NULL
+            WHERE l.assigned=0
         """).fetchone()[0]
 
         assigned_total = cur.execute("""
@@ -551,7 +2037,6 @@ def get_stats() -> Dict[str, Any]:
             "dead_links": dead_links,
 
             "reserve_links": reserve_links,
-            "reserve_target": RESERVE_LINKS,
 
             "assigned": assigned_total,
             "unassigned": unassigned_any,
@@ -563,3 +2048,15 @@ def get_stats() -> Dict[str, Any]:
 
             "per_session": per_session,
         }
+
+
+# ---------------- metrics / diagnostics ----------------
+def _observe_call(name: str, seconds: float) -> None:
+    metrics.DB_CALL_SECONDS.observe(seconds, function=name)
+    diagnostics.record_span(f"db.{name}", seconds)
+
+
+# latency of every public function above (db_call_seconds{function=...},
+# span db.<function>); nothing is wrapped while both are disabled
+if metrics.ENABLED or diagnostics.ENABLED:
+    metrics.instrument_functions(globals(), _observe_call, exclude=("get_conn", "close_conn"))
@@ -0,0 +1,201 @@
+# bot/dead_links.py
+"""
+Background re-verification of dead links.
+
+A link is marked dead on the first dead-classified error (bot/joiner.py),
+but some of those are temporary: ChannelPrivateError on a channel that
+later goes public, ChatAdminRequiredError, peer errors of a bad session.
+Each pass takes the due dead links (oldest last_checked_at first) and
+checks them without joining, on a few sessions with a small budget each:
+
+- username: ResolveUsername => a channel / group resolves
+- invite:   CheckChatInvite  => the invite is valid
+- folder:   CheckChatlistInvite
+
+Alive => back to active (the distributor picks it up again). Still dead =>
+dead_checks + 1 and the next recheck waits twice as long
+(DEAD_RECHECK_BASE_SECONDS * 2^dead_checks, capped at DEAD_RECHECK_MAX_SECONDS).
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+
+from telethon import errors
+from telethon.tl.functions.chatlists import CheckChatlistInviteRequest
+from telethon.tl.functions.contacts import ResolveUsernameRequest
+from telethon.tl.functions.messages import CheckChatInviteRequest
+from telethon.tl.types import ChannelForbidden, ChatForbidden, PeerUser
+
+from bot.clients import new_client
+from bot.config import (
+    DEAD_RECHECK_BASE_SECONDS,
+    DEAD_RECHECK_INTERVAL_SECONDS,
+    DEAD_RECHECK_MAX_SECONDS,
+    DEAD_RECHECK_PER_SESSION,
+    DEAD_RECHECK_SESSIONS,
+)
+from bot.joiner import RETRYABLE_EXCEPTIONS, classify_error
+from bot.utils import parse_link_type
+from bot import db, metrics
+
+logger = logging.getLogger(__name__)
+
+# pause between two checks of one session (these are low priority)
+CHECK_DELAY_SECONDS = 2
+
+
+def recheck_delay_seconds(dead_checks: int) -> float:
+    """
+    Wait before the next recheck of a link found dead dead_checks times.
+    """
+    return min(DEAD_RECHECK_MAX_SECONDS, DEAD_RECHECK_BASE_SECONDS * (2 ** max(0, dead_checks)))
+
+
+async def check_link_alive(client, link: str) -> Tuple[bool, str]:
+    """
+    (alive, reason) of one link, no join. Dead-classified errors => (False, error);
+    FloodWait and transient errors are raised.
+    """
+    kind, value = parse_link_type(link)
+    try:
+        if kind == "invite":
+            await client(CheckChatInviteRequest(value))
+            return True, ""
+
+        if kind == "folder":
+            await client(CheckChatlistInviteRequest(value))
+            return True, ""
+
+        if kind == "username":
+            resolved = await client(ResolveUsernameRequest(value.split("/", 1)[0]))
+            if isinstance(resolved.peer, PeerUser):
+                return False, "resolves to a user"
+            chats = getattr(resolved, "chats", None) or []
+            if any(isinstance(c, (ChannelForbidden, ChatForbidden)) for c in chats):
+                return False, "chat forbidden"
+            return True, ""
+
+    except (errors.FloodWaitError, *RETRYABLE_EXCEPTIONS):
+        raise
+    except Exception as e:
+        # dead-classified or unexpected ('fatal'): both back off like a dead link
+        return False, f"{classify_error(e)}: {type(e).__name__}: {e}"
+
+    return False, f"unknown link kind: {kind}"
+
+
+async def recheck_session_links(session_id: int, session_string: str, links: List[Tuple[int, str, int]]) -> Dict:
+    """
+    Check `links` ((link_id, link, dead_checks)) on one session and save the outcomes.
+    FloodWait / transient errors stop the session: unchecked links stay due.
+    """
+    report = {"session_id": session_id, "checked": 0, "alive": 0, "dead": 0}
+    alive: List[int] = []
+    still_dead: List[Tuple[int, str, float]] = []
+
+    client = new_client(session_string)
+    await client.connect()
+
+    try:
+        for i, (link_id, link, dead_checks) in enumerate(links):
+            if i:
+                await asyncio.sleep(CHECK_DELAY_SECONDS)
+
+            kind = parse_link_type(link)[0]
+            try:
+                ok, reason = await check_link_alive(client, link)
+            except errors.FloodWaitError as e:
+                db.set_session_flood_until(session_id, time.time() + int(e.seconds) + 5)
+                logger.warning(f"[dead_links] Session {session_id} FloodWait {e.seconds}s, stop rechecking")
+                metrics.observe_dead_recheck(kind, "error")
+                break
+            except RETRYABLE_EXCEPTIONS as e:
+                logger.warning(f"[dead_links] Session {session_id} recheck failed ({e}), stop rechecking")
+                metrics.observe_dead_recheck(kind, "error")
+                break
+
+            report["checked"] += 1
+            if ok:
+                alive.append(link_id)
+                logger.info(f"[dead_links] {link} is alive again")
+            else:
+                still_dead.append((link_id, f"recheck: {reason}", time.time() + recheck_delay_seconds(dead_checks + 1)))
+            metrics.observe_dead_recheck(kind, "alive" if ok else "dead")
+
+    finally:
+        await client.disconnect()
+        if alive or still_dead:
+            report["alive"] = db.save_dead_link_rechecks(alive, still_dead)
+            report["dead"] = len(still_dead)
+
+    return report
+
+
+def _recheck_sessions(limit: int) -> List[Tuple[int, str]]:
+    """
+    Up to `limit` assignable sessions outside FloodWait; sessions not busy
+    in the active join run first.
+    """
+    busy = set()
+    run = db.get_active_join_run()
+    if run:
+        busy = {r["session_id"] for r in db.get_run_sessions(run["id"]) if r["status"] == "running"}
+
+    now = time.time()
+    sessions = [
+        (sid, s) for sid, s, _, _ in db.list_assignable_sessions()
+        if db.get_session_flood_until(sid) <= now
+    ]
+    sessions.sort(key=lambda x: x[0] in busy)
+    return sessions[:limit]
+
+
+async def recheck_dead_links(
+    sessions_limit: int = DEAD_RECHECK_SESSIONS,
+    per_session: int = DEAD_RECHECK_PER_SESSION,
+) -> Dict:
+    """
+    One pass: due dead links spread round-robin over the recheck sessions,
+    sessions checked one after another.
+    """
+    report = {"due": 0, "checked": 0, "alive": 0, "dead": 0}
+
+    sessions = _recheck_sessions(sessions_limit)
+    if not sessions:
+        return report
+
+    due = db.get_dead_links_due(len(sessions) * per_session, DEAD_RECHECK_BASE_SECONDS)
+    report["due"] = len(due)
+
+    for i, (session_id, session_string) in enumerate(sessions):
+        links = due[i::len(sessions)]
+        if not links:
+            break
+        try:
+            res = await recheck_session_links(session_id, session_string, links)
+        except Exception as e:
+            logger.warning(f"[dead_links] Session {session_id} recheck crashed: {e}")
+            continue
+        for k in ("checked", "alive", "dead"):
+            report[k] += res[k]
+
+    if report["due"]:
+        logger.info(f"[dead_links] {report}")
+    return report
+
+
+async def dead_links_loop() -> None:
+    """
+    Background task: one recheck pass every DEAD_RECHECK_INTERVAL_SECONDS (0 = disabled).
+    """
+    if DEAD_RECHECK_INTERVAL_SECONDS <= 0:
+        return
+
+    while True:
+        try:
+            await recheck_dead_links()
+        except Exception as e:
+            logger.exception(f"[dead_links] recheck pass crashed: {e}")
+
+        await asyncio.sleep(DEAD_RECHECK_INTERVAL_SECONDS)
@@ -0,0 +1,229 @@
+# bot/diagnostics.py
+"""
+Diagnostics mode (DIAGNOSTICS_ENABLED=1) to find what makes the bot sluggish:
+
+- event loop lag sampler: a task sleeping LOOP_LAG_SAMPLE_SECONDS measures
+  how late it wakes up (anything blocking the loop shows up here)
+- slow callback logging: asyncio debug mode logs every callback/step that
+  holds the loop longer than SLOW_CALLBACK_SECONDS (sqlite, crypto, handlers)
+- timing spans: wall time per name (join_one_link, db.<function>,
+  extractor.channel), slow ones logged
+
+On-demand sampling profile (any mode): a thread samples the stacks of all
+threads every PROFILE_INTERVAL_SECONDS for N seconds and writes a text
+report (top functions, spans, loop lag, collapsed stacks for flame graphs).
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Deque, Dict, List, Optional
+
+from bot.config import (
+    DIAGNOSTICS_ENABLED,
+    LOOP_LAG_SAMPLE_SECONDS,
+    LOOP_LAG_WARN_SECONDS,
+    SLOW_CALLBACK_SECONDS,
+)
+from bot import metrics
+
+logger = logging.getLogger(__name__)
+
+ENABLED = DIAGNOSTICS_ENABLED
+
+# spans longer than this are logged
+SLOW_SPAN_SECONDS = 1.0
+
+# lag samples kept for avg/max (~1 minute at the default sample interval)
+LAG_WINDOW = 120
+
+PROFILE_INTERVAL_SECONDS = 0.005
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP = 40
+PROFILE_DIR = "/tmp"
+
+LOOP_LAG_SECONDS = metrics.Histogram(
+    "event_loop_lag_seconds", "How late the loop lag sampler wakes up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+_lag: Deque[float] = collections.deque(maxlen=LAG_WINDOW)
+# name => [count, total seconds, max seconds]
+_spans: Dict[str, list] = {}
+_NOOP = nullcontext()
+
+
+# ---------------- spans ----------------
+def record_span(name: str, seconds: float) -> None:
+    if not ENABLED:
+        return
+    row = _spans.get(name)
+    if row is None:
+        row = _spans[name] = [0, 0.0, 0.0]
+    row[0] += 1
+    row[1] += seconds
+    if seconds > row[2]:
+        row[2] = seconds
+    if seconds >= SLOW_SPAN_SECONDS:
+        logger.warning(f"[diag] slow span {name}: {seconds:.3f}s")
+
+
+@contextmanager
+def _span(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - t0)
+
+
+def span(name: str):
+    """
+    `with span("name"):` (also around awaits: wall time of the block).
+    A shared no-op context when diagnostics are off.
+    """
+    return _span(name) if ENABLED else _NOOP
+
+
+def spans_summary() -> List[dict]:
+    rows = [
+        {"name": name, "count": c, "total": round(t, 3), "avg_ms": round(t / c * 1000, 2), "max_ms": round(m * 1000, 2)}
+        for name, (c, t, m) in _spans.items()
+    ]
+    return sorted(rows, key=lambda r: r["total"], reverse=True)
+
+
+# ---------------- event loop lag ----------------
+def loop_lag_stats() -> Optional[dict]:
+    if not _lag:
+        return None
+    return {
+        "last_ms": round(_lag[-1] * 1000, 1),
+        "avg_ms": round(sum(_lag) / len(_lag) * 1000, 1),
+        "max_ms": round(max(_lag) * 1000, 1),
+    }
+
+
+async def _lag_sampler(interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - t0 - interval)
+
+        _lag.append(lag)
+        LOOP_LAG_SECONDS.observe(lag)
+        if lag >= LOOP_LAG_WARN_SECONDS:
+            logger.warning(f"[diag] event loop lag {lag * 1000:.0f}ms")
+
+
+def start() -> None:
+    """
+    Called once from the running loop: lag sampler + slow callback logging.
+    """
+    if not ENABLED:
+        return
+
+    loop = asyncio.get_running_loop()
+    if SLOW_CALLBACK_SECONDS > 0:
+        # asyncio logs "Executing <Handle ...> took N seconds" (logger 'asyncio')
+        loop.slow_callback_duration = SLOW_CALLBACK_SECONDS
+        loop.set_debug(True)
+
+    asyncio.create_task(_lag_sampler(LOOP_LAG_SAMPLE_SECONDS))
+    logger.info(
+        f"[diag] diagnostics on: lag sample {LOOP_LAG_SAMPLE_SECONDS}s, slow callbacks >= {SLOW_CALLBACK_SECONDS}s"
+    )
+
+
+# ---------------- sampling profile ----------------
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def _sample_stacks(seconds: float, interval: float) -> Dict[tuple, int]:
+    """
+    Collapsed stacks (root first, thread name as root) => samples.
+    Runs in its own thread; the sampler thread itself is skipped.
+    """
+    me = threading.get_ident()
+    stacks: Dict[tuple, int] = collections.Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+
+    return stacks
+
+
+def _profile_report(stacks: Dict[tuple, int], seconds: float, interval: float, tasks: int) -> str:
+    total = sum(stacks.values()) or 1
+    self_counts: Dict[str, int] = collections.Counter()
+    cumulative: Dict[str, int] = collections.Counter()
+    for stack, n in stacks.items():
+        # per function (file:function), lines only in the collapsed stacks
+        funcs = [f.rsplit(":", 1)[0] for f in stack[1:]]
+        if funcs:
+            self_counts[funcs[-1]] += n
+        for name in set(funcs):
+            cumulative[name] += n
+
+    lines = [
+        f"# sampling profile: {seconds:g}s, {total} samples every {interval * 1000:g}ms (all threads)",
+        f"# {time.strftime('%Y-%m-%d %H:%M:%S')} | asyncio tasks: {tasks}",
+        "",
+        "## top functions (self)",
+    ]
+    lines += [f"{n * 100 / total:6.2f}%  {n:7d}  {name}" for name, n in self_counts.most_common(PROFILE_TOP)]
+
+    lines += ["", "## top functions (cumulative)"]
+    lines += [f"{n * 100 / total:6.2f}%  {n:7d}  {name}" for name, n in cumulative.most_common(PROFILE_TOP)]
+
+    lag = loop_lag_stats()
+    lines += ["", "## event loop lag"]
+    lines.append(
+        f"last {lag['last_ms']}ms | avg {lag['avg_ms']}ms | max {lag['max_ms']}ms" if lag
+        else "(diagnostics off: DIAGNOSTICS_ENABLED=1 to sample)"
+    )
+
+    lines += ["", "## spans (total s | count | avg ms | max ms)"]
+    spans = spans_summary()
+    lines += [f"{r['total']:10.3f}  {r['count']:7d}  {r['avg_ms']:9.2f}  {r['max_ms']:9.2f}  {r['name']}" for r in spans]
+    if not spans:
+        lines.append("(none)")
+
+    lines += ["", "## collapsed stacks (flamegraph.pl / speedscope)"]
+    lines += [f"{';'.join(stack)} {n}" for stack, n in sorted(stacks.items(), key=lambda x: -x[1])]
+    return "\n".join(lines) + "\n"
+
+
+async def dump_profile(seconds: float, interval: float = PROFILE_INTERVAL_SECONDS) -> str:
+    """
+    Sample all threads for `seconds` (the loop keeps running) and write the
+    report file. Returns its path.
+    """
+    seconds = max(1.0, min(float(seconds), PROFILE_MAX_SECONDS))
+    stacks = await asyncio.to_thread(_sample_stacks, seconds, interval)
+
+    path = os.path.join(PROFILE_DIR, f"profile_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+    report = _profile_report(stacks, seconds, interval, len(asyncio.all_tasks()))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(report)
+
+    logger.info(f"[diag] profile written: {path}")
+    return path
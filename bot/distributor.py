@@ -1,65 +1,259 @@
 # bot/distributor.py
+import heapq
+import math
+import threading
+import time
+from typing import Dict, List, Optional
+
 from bot import db
-from bot.config import RESERVE_LINKS
+from bot.config import (
+    CHANNELS_LIMIT_PER_SESSION,
+    FORECAST_TARGET_HOURS,
+    JOIN_DELAY_SECONDS,
+    THROUGHPUT_MIN_SAMPLES,
+    THROUGHPUT_WINDOW_HOURS,
+)
+from bot.reserve import reserve_target
 
 MAX_LINKS_PER_SESSION = 1000
 
+# rough cost of one join RPC on top of the delays (keeps no-delay joins bounded)
+RPC_OVERHEAD_SECONDS = 2
+
+# floor for a session's rate so a terrible history still gets a little work
+MIN_RATE_PER_HOUR = 1.0
+
+# dead links cost no join delay; cap so a bad history can't promise infinite speed
+MAX_DEAD_RATE = 0.9
+
+
+# ---------------- throughput model ----------------
+def session_throughput(stats: Dict[str, int]) -> Dict[str, float]:
+    """
+    Joins/hour for one session from its join_log stats (db.get_session_join_stats).
+
+    Measured (>= THROUGHPUT_MIN_SAMPLES RPCs):
+        joins / (delayed * JOIN_DELAY_SECONDS + flood_seconds + rpcs * overhead)
+    otherwise the nominal rate 3600 / (JOIN_DELAY_SECONDS + overhead),
+    scaled down by the session's FloodWait rate.
+    """
+    joins = stats.get("joins", 0)
+    rpcs = stats.get("rpcs", 0)
+    flood_events = stats.get("flood_events", 0)
+
+    flood_rate = flood_events / (rpcs + flood_events) if (rpcs + flood_events) else 0.0
 
-def distribute_links_to_sessions() -> dict:
+    if rpcs >= THROUGHPUT_MIN_SAMPLES and joins > 0:
+        busy = (
+            stats.get("delayed", 0) * JOIN_DELAY_SECONDS
+            + stats.get("flood_seconds", 0)
+            + rpcs * RPC_OVERHEAD_SECONDS
+        )
+        rate = joins * 3600 / max(1, busy)
+        measured = True
+    else:
+        rate = 3600 / (JOIN_DELAY_SECONDS + RPC_OVERHEAD_SECONDS) * (1 - flood_rate)
+        measured = False
+
+    dead_rate = min(MAX_DEAD_RATE, stats.get("dead", 0) / rpcs) if rpcs else 0.0
+
+    return {
+        "rate_per_hour": max(MIN_RATE_PER_HOUR, rate),
+        "flood_rate": flood_rate,
+        "dead_rate": dead_rate,
+        "measured": measured,
+    }
+
+
+def links_per_hour(tp: Dict[str, float]) -> float:
+    """
+    Links a session gets through per hour: joins/hour, plus dead links,
+    which fail fast without a join delay.
+    """
+    return tp["rate_per_hour"] / (1 - tp["dead_rate"])
+
+
+def plan_allocation(sessions: List[Dict], total: int) -> Dict[int, int]:
+    """
+    Split `total` links so every session finishes at about the same time.
+
+    sessions: dicts with session_id, rate_per_hour, pending (already queued), cap.
+    Finish time of a session = (pending + allocated) / rate. Find the common
+    horizon T where sum(clamp(rate * T - pending, 0, cap)) covers `total`
+    (binary search), then hand out rounding leftovers earliest-finish first.
+    """
+    sessions = [s for s in sessions if s["cap"] > 0]
+    target = min(total, sum(s["cap"] for s in sessions))
+    if target <= 0:
+        return {}
+
+    def _alloc_at(t: float) -> Dict[int, int]:
+        return {
+            s["session_id"]: min(s["cap"], max(0, int(s["rate_per_hour"] * t - s["pending"])))
+            for s in sessions
+        }
+
+    lo, hi = 0.0, 1.0
+    while sum(_alloc_at(hi).values()) < target:
+        hi *= 2
+
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        if sum(_alloc_at(mid).values()) < target:
+            lo = mid
+        else:
+            hi = mid
+
+    alloc = _alloc_at(lo)
+    leftover = target - sum(alloc.values())
+
+    heap = [
+        ((s["pending"] + alloc[s["session_id"]] + 1) / s["rate_per_hour"], s["session_id"])
+        for s in sessions if alloc[s["session_id"]] < s["cap"]
+    ]
+    heapq.heapify(heap)
+    by_id = {s["session_id"]: s for s in sessions}
+
+    while leftover > 0 and heap:
+        _, sid = heapq.heappop(heap)
+        alloc[sid] += 1
+        leftover -= 1
+        s = by_id[sid]
+        if alloc[sid] < s["cap"]:
+            heapq.heappush(heap, ((s["pending"] + alloc[sid] + 1) / s["rate_per_hour"], sid))
+
+    return alloc
+
+
+def predicted_makespan_hours(sessions: List[Dict], alloc: Dict[int, int]) -> float:
+    """
+    Hours until the slowest session drains its queue (pending + allocated).
+    """
+    finish = [
+        (s["pending"] + alloc.get(s["session_id"], 0)) / s["rate_per_hour"]
+        for s in sessions
+    ]
+    return round(max(finish, default=0.0), 2)
+
+
+def _flat_allocation(sessions: List[Dict], total: int) -> Dict[int, int]:
+    # previous behaviour (session order, up to cap each), for comparison in the report
+    alloc, remaining = {}, total
+    for s in sessions:
+        alloc[s["session_id"]] = min(s["cap"], max(0, remaining))
+        remaining -= alloc[s["session_id"]]
+    return alloc
+
+
+def distribute_links_to_sessions(stop: Optional[threading.Event] = None) -> dict:
     """
     Assign up to 1000 ACTIVE unassigned links for each active session,
-    while always keeping a reserve pool of RESERVE_LINKS links.
+    while always keeping a reserve pool (auto-sized from the dead link rate,
+    see bot/reserve.py; RESERVE_LINKS is its floor).
+
+    Allocation is weighted by each session's measured throughput (joins/hour
+    and FloodWait rate from join_log) so all sessions finish at about the
+    same time; the report carries the predicted makespan (and the one a flat
+    allocation would have) in hours.
 
     Reserve definition:
     - ACTIVE links
     - Unassigned (not in assignments)
-    - Keep at least RESERVE_LINKS in DB
+    - Keep at least the reserve target in DB
+
+    Links are taken in priority order (links.priority, see bot/priority.py).
+    Sessions get no more than their free channel slots
+    (CHANNELS_LIMIT_PER_SESSION - joined - pending); full accounts get nothing,
+    accounts found restricted by the health checker are left out.
+
+    stop: checked between sessions; once set, the remaining sessions get
+    nothing and the report carries "cancelled": True.
 
     Returns report dict.
     """
-    sessions = db.list_sessions()
+    sessions = db.list_assignable_sessions()
     if not sessions:
         return {"ok": False, "error": "No sessions found"}
 
+    # best links are assigned first, the reserve keeps the lowest priority ones
+    db.refresh_link_priorities()
+
     # Unassigned active links only (reserve pool)
     unassigned_active_before = db.count_links_unassigned_active()
 
-    # Leave RESERVE_LINKS untouched
-    distributable = unassigned_active_before - RESERVE_LINKS
+    # Leave the reserve untouched
+    reserve = reserve_target(force=True)
+    distributable = unassigned_active_before - reserve
     if distributable < 0:
         distributable = 0
 
+    capacity = db.get_sessions_capacity()
+
+    join_stats = db.get_session_join_stats(THROUGHPUT_WINDOW_HOURS)
+    pending = db.count_pending_per_session()
+
+    plan = []
+    full_sessions = 0
+    for (sid, _, _, _) in sessions:
+        cap = capacity.get(sid, {"free": 0, "full": False})
+        if cap["full"]:
+            full_sessions += 1
+
+        tp = session_throughput(join_stats.get(sid, {}))
+        plan.append({
+            "session_id": sid,
+            "cap": min(MAX_LINKS_PER_SESSION, cap["free"]),
+            "full": cap["full"],
+            "pending": pending.get(sid, 0),
+            **tp,
+            "rate_per_hour": links_per_hour(tp),
+        })
+
+    alloc = plan_allocation(plan, distributable)
+
     report = {
         "ok": True,
         "sessions": len(sessions),
-        "reserve_target": RESERVE_LINKS,
+        "full_sessions": full_sessions,
+        "reserve_target": reserve,
         "unassigned_active_before": unassigned_active_before,
         "distributable_before": distributable,
         "assigned_total": 0,
+        "predicted_makespan_hours": predicted_makespan_hours(plan, alloc),
+        "flat_makespan_hours": predicted_makespan_hours(plan, _flat_allocation(plan, distributable)),
         "per_session": [],
     }
 
     remaining = distributable
 
-    # Distribute in order: session 1, session 2, ...
-    for (sid, _, _, _) in sessions:
-        if remaining <= 0:
-            assigned = 0
-        else:
-            to_assign = min(MAX_LINKS_PER_SESSION, remaining)
-            assigned = db.assign_unassigned_links(sid, to_assign)
-            remaining -= assigned
+    for s in plan:
+        if stop is not None and stop.is_set():
+            report["cancelled"] = True
+            break
+        sid = s["session_id"]
+        to_assign = min(alloc.get(sid, 0), remaining)
+
+        # to_assign is in channel slots: a folder and the links it covers count as its member chats
+        assigned = db.assign_unassigned_links(sid, to_assign) if to_assign > 0 else 0
+        remaining -= assigned
 
         report["assigned_total"] += assigned
-        report["per_session"].append({"session_id": sid, "assigned": assigned})
+        report["per_session"].append({
+            "session_id": sid,
+            "assigned": assigned,
+            "full": s["full"],
+            "rate_per_hour": round(s["rate_per_hour"], 1),
+            "flood_rate": round(s["flood_rate"], 3),
+            "predicted_hours": round((s["pending"] + assigned) / s["rate_per_hour"], 2),
+        })
 
     # After distribution
     unassigned_active_after = db.count_links_unassigned_active()
     report["unassigned_active_after"] = unassigned_active_after
 
-    # reserve after distribution should be >= RESERVE_LINKS (unless DB doesn't have enough)
+    # reserve after distribution should be >= reserve target (unless DB doesn't have enough)
     report["reserve_after"] = unassigned_active_after
-    report["distributable_after"] = max(unassigned_active_after - RESERVE_LINKS, 0)
+    report["distributable_after"] = max(unassigned_active_after - reserve, 0)
 
     return report
 
@@ -76,8 +270,9 @@ def estimate_needed_sessions() -> dict:
     => needed_sessions=3
     """
     unassigned_active = db.count_links_unassigned_active()
+    reserve = reserve_target()
 
-    distributable = unassigned_active - RESERVE_LINKS
+    distributable = unassigned_active - reserve
     if distributable < 0:
         distributable = 0
 
@@ -85,7 +280,74 @@ def estimate_needed_sessions() -> dict:
 
     return {
         "unassigned_active": unassigned_active,
-        "reserve_target": RESERVE_LINKS,
+        "reserve_target": reserve,
         "distributable": distributable,
         "needed_sessions": needed_sessions,
     }
+
+
+def forecast_completion(target_hours: Optional[float] = None) -> dict:
+    """
+    Completion forecast for the current backlog (pending + distributable links)
+    from measured per-session throughput, dead rate and FloodWait rate (join_log).
+
+    - eta_hours: makespan if the distributable links were spread with the
+      throughput-weighted allocation over the active sessions
+    - sessions_needed: sessions (at the fleet's mean speed) to finish within
+      target_hours, also bounded by the channels cap per account
+    - unplaceable: links beyond the free channel slots of all sessions
+      (eta_hours then covers only what fits)
+    """
+    target_hours = target_hours or FORECAST_TARGET_HOURS
+
+    sessions = db.list_assignable_sessions()
+    capacity = db.get_sessions_capacity()
+    pending = db.count_pending_per_session()
+    join_stats = db.get_session_join_stats(THROUGHPUT_WINDOW_HOURS)
+
+    unassigned_active = db.count_links_unassigned_active()
+    distributable = max(0, unassigned_active - reserve_target())
+
+    plan = []
+    for (sid, _, _, _) in sessions:
+        tp = session_throughput(join_stats.get(sid, {}))
+        plan.append({
+            "session_id": sid,
+            "cap": capacity.get(sid, {"free": 0})["free"],
+            "pending": pending.get(sid, 0),
+            "rate_per_hour": links_per_hour(tp),
+            **{k: tp[k] for k in ("flood_rate", "dead_rate", "measured")},
+        })
+
+    pending_total = sum(s["pending"] for s in plan)
+    backlog = pending_total + distributable
+
+    alloc = plan_allocation(plan, distributable)
+    placed = sum(alloc.values())
+    eta_hours = predicted_makespan_hours(plan, alloc)
+
+    # a new account is expected to behave like the fleet average
+    fleet_rate = sum(s["rate_per_hour"] for s in plan)
+    mean_rate = fleet_rate / len(plan) if plan else links_per_hour(session_throughput({}))
+
+    sessions_needed = max(
+        math.ceil(backlog / (mean_rate * target_hours)) if backlog else 0,
+        math.ceil(backlog / CHANNELS_LIMIT_PER_SESSION) if backlog else 0,
+    )
+
+    return {
+        "backlog": backlog,
+        "pending": pending_total,
+        "distributable": distributable,
+        "unplaceable": distributable - placed,
+        "sessions": len(plan),
+        "measured_sessions": sum(1 for s in plan if s["measured"]),
+        "fleet_rate_per_hour": round(fleet_rate, 1),
+        "mean_flood_rate": round(sum(s["flood_rate"] for s in plan) / len(plan), 3) if plan else 0.0,
+        "mean_dead_rate": round(sum(s["dead_rate"] for s in plan) / len(plan), 3) if plan else 0.0,
+        "eta_hours": eta_hours,
+        "eta_at": time.time() + eta_hours * 3600 if backlog else None,
+        "target_hours": target_hours,
+        "sessions_needed": sessions_needed,
+        "additional_sessions_needed": max(0, sessions_needed - len(plan)),
+    }
@@ -1,15 +1,24 @@
 # bot/extractor.py
 import logging
-from telethon import TelegramClient
-from telethon.sessions import StringSession
+import time
+from typing import Callable, Optional
 
-from bot.config import API_ID, API_HASH, EXTRACT_MESSAGES_LIMIT
+from bot.clients import new_client
+from bot.config import EXTRACT_MESSAGES_LIMIT
 from bot.utils import extract_telegram_links, normalize_tme_link
+from bot import diagnostics, metrics
 
 logger = logging.getLogger(__name__)
 
+# progress callback interval while iterating messages
+PROGRESS_EVERY_MESSAGES = 1000
 
-async def extract_links_from_channel(session_string: str, channel_link: str) -> list[str]:
+
+async def extract_links_from_channel(
+    session_string: str,
+    channel_link: str,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> list[tuple[str, int, float]]:
     """
     Extract telegram links from channel messages.
 
@@ -22,17 +31,31 @@ async def extract_links_from_channel(session_string: str, channel_link: str) ->
     Output:
     - returns unique links normalized to:
       https://t.me/<path>
+      as (link, source_msg_id, source_msg_date) of the NEWEST message
+      containing the link (used for link priority)
 
     Notes:
-    - Uses Telethon StringSession.
+    - Uses Telethon StringSession (bot/clients.py).
     - Will ignore empty messages.
+    - progress(messages_scanned, links_found) is called every
+      PROGRESS_EVERY_MESSAGES messages (bot job progress).
     """
     channel_link = normalize_tme_link(channel_link)
 
-    client = TelegramClient(StringSession(session_string), API_ID, API_HASH)
+    client = new_client(session_string)
     await client.connect()
 
-    found = set()
+    found: dict[str, tuple[int, float]] = {}
+    scanned = 0
+    t0 = time.monotonic()
+
+    def _add(link: str, msg) -> None:
+        n = normalize_tme_link(link)
+        if not n:
+            return
+        prev = found.get(n)
+        if prev is None or msg.id > prev[0]:
+            found[n] = (msg.id, msg.date.timestamp() if msg.date else 0.0)
 
     try:
         entity = await client.get_entity(channel_link)
@@ -47,14 +70,16 @@ async def extract_links_from_channel(session_string: str, channel_link: str) ->
                 if not msg:
                     continue
 
+                scanned += 1
+                if progress is not None and scanned % PROGRESS_EVERY_MESSAGES == 0:
+                    progress(scanned, len(found))
+
                 text = msg.message or ""
                 if not text.strip():
                     continue
 
                 for link in extract_telegram_links(text):
-                    n = normalize_tme_link(link)
-                    if n:
-                        found.add(n)
+                    _add(link, msg)
 
         # ---------------- Full mode: all messages ----------------
         else:
@@ -65,18 +90,23 @@ async def extract_links_from_channel(session_string: str, channel_link: str) ->
                 if not msg:
                     continue
 
+                scanned += 1
+                if progress is not None and scanned % PROGRESS_EVERY_MESSAGES == 0:
+                    progress(scanned, len(found))
+
                 text = msg.message or ""
                 if not text.strip():
                     continue
 
                 for link in extract_telegram_links(text):
-                    n = normalize_tme_link(link)
-                    if n:
-                        found.add(n)
+                    _add(link, msg)
 
-        result = sorted(found)
+        result = [(link, msg_id, msg_date) for link, (msg_id, msg_date) in sorted(found.items())]
         logger.info(f"[extractor] Done. Found {len(result)} unique links from {channel_link}")
         return result
 
     finally:
+        elapsed = time.monotonic() - t0
+        metrics.observe_extraction(scanned, elapsed)
+        diagnostics.record_span("extractor.channel", elapsed)
         await client.disconnect()
@@ -0,0 +1,525 @@
+# bot/fake_telegram.py
+"""
+Fake Telegram backend: measure scheduler / rate-limit changes without real accounts.
+
+- FakeWorld: chats behind links (dead, join request, public), per-account
+  joined chats and FloodWait limits per method, channel message histories.
+  Outcomes are deterministic per (seed, link); optionally replayed from an
+  RPC trace recorded on real clients (RPC_TRACE_PATH, bot/clients.py)
+- FakeTelegramClient: the subset of TelegramClient used by bot/joiner.py,
+  bot/extractor.py, bot/capacity.py, bot/folders.py and bot/dead_links.py;
+  raises the real telethon errors, so the bot's error handling is what gets
+  exercised
+- run_virtual(): runs a coroutine on an event loop with a virtual clock;
+  sleeps / timeouts / time.time() jump forward instead of waiting, so a
+  24h join run finishes in (wall) seconds to minutes
+
+    world = FakeWorld(seed=1)
+    set_client_factory(world.client)
+    run_virtual(main())
+
+Driver: bench/simulate.py.
+"""
+import asyncio
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import math
+import random
+import selectors
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from telethon import errors
+from telethon.tl import types
+from telethon.tl.functions.channels import JoinChannelRequest, LeaveChannelRequest
+from telethon.tl.functions.chatlists import CheckChatlistInviteRequest, JoinChatlistInviteRequest
+from telethon.tl.functions.contacts import ResolveUsernameRequest
+from telethon.tl.functions.messages import CheckChatInviteRequest, ImportChatInviteRequest
+from telethon.utils import get_peer_id
+
+from bot.clients import request_target, session_key
+from bot.utils import parse_link_type
+
+logger = logging.getLogger(__name__)
+
+# method => (flood bucket, calls allowed per window, window seconds);
+# methods sharing a bucket share the budget (all joins count together)
+FLOOD_LIMITS: Dict[str, Tuple[str, int, float]] = {
+    "JoinChannelRequest": ("join", 20, 3600),
+    "ImportChatInviteRequest": ("join", 20, 3600),
+    "JoinChatlistInviteRequest": ("join", 20, 3600),
+    "CheckChatlistInviteRequest": ("check", 60, 3600),
+    "CheckChatInviteRequest": ("check", 60, 3600),
+    "ResolveUsernameRequest": ("check", 60, 3600),
+    "LeaveChannelRequest": ("leave", 30, 3600),
+    "GetHistoryRequest": ("history", 3000, 300),
+}
+
+# joined channels/supergroups per account
+CHANNELS_LIMIT = 500
+
+# RPC latency range (seconds, uniform)
+LATENCY = (0.05, 0.4)
+
+# messages per GetHistory page (iter_messages)
+HISTORY_PAGE = 100
+
+# chats behind one folder link
+FOLDER_SIZE = (3, 8)
+
+# trace outcomes that are not telethon RPC errors
+_PLAIN_ERRORS = {
+    "ConnectionError": ConnectionError,
+    "OSError": OSError,
+    "TimeoutError": asyncio.TimeoutError,
+}
+
+
+def _unit(*parts: Any) -> float:
+    """
+    Deterministic float in [0, 1) from the parts.
+    """
+    digest = hashlib.sha1(":".join(map(str, parts)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def _chat_id(target: str) -> int:
+    return 1_000_000_000 + int(_unit("chat", target) * 1_000_000_000)
+
+
+def _channel(target: str, username: Optional[str] = None, date: Optional[float] = None) -> types.Channel:
+    return types.Channel(
+        id=_chat_id(target),
+        title=f"fake {target}",
+        photo=types.ChatPhotoEmpty(),
+        date=datetime.datetime.fromtimestamp(date if date is not None else time.time(), datetime.timezone.utc),
+        megagroup=_unit("megagroup", target) < 0.5,
+        access_hash=int(_unit("hash", target) * 2 ** 62),
+        username=username,
+    )
+
+
+class _Dialog:
+    """
+    What iter_dialogs() consumers read: entity, is_group, is_channel, id, date.
+    """
+
+    def __init__(self, entity: types.Channel):
+        self.entity = entity
+        self.id = entity.id
+        self.date = entity.date
+        self.is_group = bool(entity.megagroup)
+        self.is_channel = True
+
+
+class _FakeSession:
+    """
+    What callers read from client.session.
+    """
+
+    def __init__(self, dc_id: int):
+        self.dc_id = dc_id
+
+
+class _Account:
+    def __init__(self, key: str):
+        self.key = key
+        self.joined: Dict[int, types.Channel] = {}
+        self.calls: Dict[str, Deque[float]] = collections.defaultdict(collections.deque)
+        self.flood_until: Dict[str, float] = {}
+        self.rpcs = 0
+
+
+class FakeWorld:
+    """
+    Shared state of the fake Telegram (all accounts of a simulation).
+
+    Per link target (invite hash / username / folder slug), decided once:
+    dead with dead_ratio, join request with request_ratio, else joinable.
+    retryable_ratio: per call, a transient RpcCallFailError.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        dead_ratio: float = 0.03,
+        request_ratio: float = 0.05,
+        retryable_ratio: float = 0.002,
+        flood_limits: Optional[Dict[str, Tuple[str, int, float]]] = None,
+        channels_limit: int = CHANNELS_LIMIT,
+        latency: Tuple[float, float] = LATENCY,
+    ):
+        self.seed = seed
+        self.dead_ratio = dead_ratio
+        self.request_ratio = request_ratio
+        self.retryable_ratio = retryable_ratio
+        self.flood_limits = dict(FLOOD_LIMITS if flood_limits is None else flood_limits)
+        self.channels_limit = channels_limit
+        self.latency = latency
+
+        self.rnd = random.Random(seed)
+        self.accounts: Dict[str, _Account] = {}
+        # username => message texts (oldest first)
+        self.channels: Dict[str, List[str]] = {}
+        # (method, target) => recorded trace record
+        self.replay: Dict[Tuple[str, str], dict] = {}
+
+        # (method, outcome) => calls; FloodWait seconds handed out
+        self.stats: Dict[Tuple[str, str], int] = collections.Counter()
+        self.flood_seconds = 0
+
+    # ---------------- setup ----------------
+    def client(self, session_string: str) -> "FakeTelegramClient":
+        """
+        Client factory (bot.clients.set_client_factory(world.client)).
+        """
+        return FakeTelegramClient(self, session_string)
+
+    def account(self, key: str) -> _Account:
+        acct = self.accounts.get(key)
+        if acct is None:
+            acct = self.accounts[key] = _Account(key)
+        return acct
+
+    def add_channel(self, username: str, texts: List[str]) -> None:
+        self.channels[username.lower()] = list(texts)
+
+    def load_trace(self, path: str) -> int:
+        """
+        Replay per-link outcomes and latencies of a recorded RPC trace
+        (last record per method + target wins). FloodWait records are not
+        replayed: flood behaviour comes from flood_limits (it depends on
+        the pacing being tested). Returns number of replayable targets.
+        """
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                rec = json.loads(line)
+                if rec.get("outcome") == "FloodWaitError" or not rec.get("target"):
+                    continue
+                self.replay[(rec["method"], rec["target"])] = rec
+        return len(self.replay)
+
+    # ---------------- model ----------------
+    def _fate(self, target: str) -> str:
+        """
+        'dead' | 'request' | 'open' for a link target.
+        """
+        u = _unit(self.seed, "fate", target)
+        if u < self.dead_ratio:
+            return "dead"
+        if u < self.dead_ratio + self.request_ratio:
+            return "request"
+        return "open"
+
+    def _check_flood(self, acct: _Account, method: str, request) -> None:
+        limit = self.flood_limits.get(method)
+        if limit is None:
+            return
+        bucket, calls, window = limit
+        now = time.time()
+
+        until = acct.flood_until.get(bucket, 0.0)
+        if until > now:
+            self._flood(int(until - now) + 1, request)
+
+        q = acct.calls[bucket]
+        while q and q[0] <= now - window:
+            q.popleft()
+        if len(q) >= calls:
+            wait = int(q[0] + window - now) + 1
+            acct.flood_until[bucket] = now + wait
+            self._flood(wait, request)
+        q.append(now)
+
+    def _flood(self, seconds: int, request) -> None:
+        self.flood_seconds += seconds
+        raise errors.FloodWaitError(request=request, capture=seconds)
+
+    def _replayed_error(self, rec: dict, request) -> Optional[Exception]:
+        outcome = rec["outcome"]
+        if outcome == "ok":
+            return None
+        if outcome in _PLAIN_ERRORS:
+            return _PLAIN_ERRORS[outcome](rec.get("message") or outcome)
+
+        cls = getattr(errors, outcome, None)
+        if isinstance(cls, type) and issubclass(cls, errors.RPCError):
+            try:
+                return cls(request=request)
+            except TypeError:
+                pass
+        return errors.RPCError(request, rec.get("message") or outcome, 400)
+
+    async def call(self, acct: _Account, request) -> Any:
+        method = type(request).__name__
+        target = request_target(request)
+        outcome = "ok"
+        acct.rpcs += 1
+        try:
+            rec = self.replay.get((method, target))
+            latency = rec["latency"] if rec else self.rnd.uniform(*self.latency)
+            await asyncio.sleep(latency)
+
+            self._check_flood(acct, method, request)
+
+            if rec is not None:
+                err = self._replayed_error(rec, request)
+                if err is not None:
+                    raise err
+            elif self.retryable_ratio and self.rnd.random() < self.retryable_ratio:
+                raise errors.RpcCallFailError(request=request)
+
+            return self._handle(acct, request, target, replayed=rec is not None)
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self.stats[(method, outcome)] += 1
+
+    def _handle(self, acct: _Account, request, target: str, replayed: bool) -> Any:
+        fate = "open" if replayed else self._fate(target)
+
+        if isinstance(request, (JoinChannelRequest, ImportChatInviteRequest)):
+            if fate == "dead":
+                if isinstance(request, ImportChatInviteRequest):
+                    raise errors.InviteHashExpiredError(request=request)
+                raise errors.UsernameNotOccupiedError(request=request)
+            username = target if isinstance(request, JoinChannelRequest) else None
+            return self._join(acct, request, [target], username=username, request_join=fate == "request")
+
+        if isinstance(request, CheckChatlistInviteRequest):
+            if fate == "dead":
+                raise errors.RPCError(request, "INVITE_SLUG_EXPIRED", 400)
+            chats = [_channel(t) for t in self._folder_targets(target)]
+            return types.chatlists.ChatlistInvite(
+                title=f"folder {target}",
+                peers=[types.PeerChannel(c.id) for c in chats],
+                chats=chats,
+                users=[],
+            )
+
+        if isinstance(request, JoinChatlistInviteRequest):
+            if fate == "dead":
+                raise errors.RPCError(request, "INVITE_SLUG_EXPIRED", 400)
+            wanted = {get_peer_id(p, add_mark=False) for p in request.peers}
+            targets = [t for t in self._folder_targets(target) if _chat_id(t) in wanted]
+            result = self._join(acct, request, targets, username=None, request_join=False)
+            result.updates.append(types.UpdateDialogFilter(id=int(_unit("filter", target) * 250) + 2))
+            return result
+
+        if isinstance(request, CheckChatInviteRequest):
+            if fate == "dead":
+                raise errors.InviteHashExpiredError(request=request)
+            chat_id = _chat_id(target)
+            if chat_id in acct.joined:
+                return types.ChatInviteAlready(chat=acct.joined[chat_id])
+            return types.ChatInvite(
+                title=f"fake {target}", photo=types.PhotoEmpty(id=0), participants_count=100, color=0,
+                channel=True, request_needed=fate == "request",
+            )
+
+        if isinstance(request, ResolveUsernameRequest):
+            if fate == "dead":
+                raise errors.UsernameNotOccupiedError(request=request)
+            chat = _channel(target, username=target)
+            return types.contacts.ResolvedPeer(peer=types.PeerChannel(chat.id), chats=[chat], users=[])
+
+        if isinstance(request, LeaveChannelRequest):
+            chat_id = getattr(request.channel, "channel_id", None) or getattr(request.channel, "id", None)
+            if acct.joined.pop(chat_id, None) is None:
+                raise errors.UserNotParticipantError(request=request)
+            return types.Updates(updates=[], users=[], chats=[], date=None, seq=0)
+
+        raise errors.RPCError(request, f"FAKE_UNSUPPORTED_{type(request).__name__.upper()}", 400)
+
+    def _folder_targets(self, slug: str) -> List[str]:
+        n = FOLDER_SIZE[0] + int(_unit(self.seed, "folder", slug) * (FOLDER_SIZE[1] - FOLDER_SIZE[0] + 1))
+        return [f"{slug}_chat{i}" for i in range(n)]
+
+    def _join(self, acct: _Account, request, targets: List[str], username: Optional[str], request_join: bool):
+        chats = []
+        for target in targets:
+            chat_id = _chat_id(target)
+            if chat_id in acct.joined:
+                if len(targets) == 1:
+                    raise errors.UserAlreadyParticipantError(request=request)
+                continue
+            if request_join:
+                raise errors.InviteRequestSentError(request=request)
+            if len(acct.joined) >= self.channels_limit:
+                raise errors.ChannelsTooMuchError(request=request)
+            chat = _channel(target, username=username)
+            acct.joined[chat_id] = chat
+            chats.append(chat)
+        return types.Updates(updates=[], users=[], chats=chats, date=None, seq=0)
+
+    # ---------------- report ----------------
+    def summary(self) -> dict:
+        by_method: Dict[str, Dict[str, int]] = {}
+        for (method, outcome), n in sorted(self.stats.items()):
+            by_method.setdefault(method, {})[outcome] = n
+        return {
+            "rpcs": sum(self.stats.values()),
+            "by_method": by_method,
+            "flood_wait_seconds": self.flood_seconds,
+            "accounts": len(self.accounts),
+            "joined_chats": sum(len(a.joined) for a in self.accounts.values()),
+        }
+
+
+class FakeTelegramClient:
+    """
+    Stand-in for TelegramClient(StringSession(s), API_ID, API_HASH) on a FakeWorld.
+    """
+
+    def __init__(self, world: FakeWorld, session_string: str):
+        self.world = world
+        self.account = world.account(session_key(session_string))
+        self.session = _FakeSession(dc_id=1 + int(_unit("dc", self.account.key) * 5))
+        self._connected = False
+
+    # ---------------- connection ----------------
+    async def connect(self) -> None:
+        await asyncio.sleep(self.world.rnd.uniform(*self.world.latency))
+        self._connected = True
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def disconnect(self) -> None:
+        self._connected = False
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def get_me(self) -> types.User:
+        user_id = int(_unit("user", self.account.key) * 2 ** 40)
+        return types.User(id=user_id, phone=f"1555{user_id % 10_000_000:07d}", first_name="fake")
+
+    # ---------------- RPCs ----------------
+    async def __call__(self, request, *args, **kwargs):
+        if not self._connected:
+            raise ConnectionError("fake client not connected")
+        return await self.world.call(self.account, request)
+
+    async def iter_dialogs(self, *args, **kwargs):
+        for chat in list(self.account.joined.values()):
+            yield _Dialog(chat)
+
+    async def get_entity(self, link: str) -> types.Channel:
+        await asyncio.sleep(self.world.rnd.uniform(*self.world.latency))
+        kind, value = parse_link_type(link)
+        username = (value or "").split("/", 1)[0].lower()
+        if kind != "username" or username not in self.world.channels:
+            raise ValueError(f'No user has "{username or link}" as username')
+        return _channel(username, username=username)
+
+    async def iter_messages(self, entity, limit: Optional[int] = None, reverse: bool = False, **kwargs):
+        """
+        Channel history (ids 1..n, one message per minute up to now), newest
+        first unless reverse; one GetHistory page (latency + flood) per HISTORY_PAGE.
+        """
+        texts = self.world.channels.get((getattr(entity, "username", "") or "").lower(), [])
+        n = len(texts)
+        ids = range(1, n + 1) if reverse else range(n, 0, -1)
+        if limit:
+            ids = ids[:limit]
+
+        now = time.time()
+        peer = types.PeerChannel(entity.id)
+        for i, msg_id in enumerate(ids):
+            if i % HISTORY_PAGE == 0:
+                await asyncio.sleep(self.world.rnd.uniform(*self.world.latency))
+                self.world._check_flood(self.account, "GetHistoryRequest", None)
+                self.world.stats[("GetHistoryRequest", "ok")] += 1
+            yield types.Message(
+                id=msg_id,
+                peer_id=peer,
+                date=datetime.datetime.fromtimestamp(now - (n - msg_id) * 60, datetime.timezone.utc),
+                message=texts[msg_id - 1],
+            )
+
+
+# ---------------- virtual clock ----------------
+class VirtualClock:
+    """
+    Simulated wall clock: time() is epoch seconds (start + elapsed), the loop
+    runs on `elapsed` (small floats: full precision for timer deadlines).
+    Moves only when the loop would sleep.
+    """
+
+    def __init__(self, start: Optional[float] = None):
+        self.start = time.time() if start is None else start
+        self.elapsed = 0.0
+
+    @property
+    def now(self) -> float:
+        return self.start + self.elapsed
+
+    def time(self) -> float:
+        return self.start + self.elapsed
+
+    def advance(self, seconds: float) -> None:
+        # tiny timeouts may round to 0: always move forward
+        elapsed = self.elapsed + seconds
+        self.elapsed = elapsed if elapsed > self.elapsed else math.nextafter(self.elapsed, math.inf)
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """
+    Instead of blocking until the next timer, advance the clock to it.
+    Blocks for real only when nothing is scheduled (threads / real I/O).
+    """
+
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            return super().select(None)
+        self._clock.advance(timeout)
+        return []
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock):
+        super().__init__(_VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self) -> float:
+        return self.clock.elapsed
+
+
+def run_virtual(coro, clock: Optional[VirtualClock] = None):
+    """
+    Run coro to completion on a VirtualClockLoop. time.time() follows the
+    virtual clock meanwhile (flood_until, retry deadlines, ... in the bot
+    are epoch seconds); SQLite's own 'now' stays real.
+    """
+    clock = clock or VirtualClock()
+    loop = VirtualClockLoop(clock)
+    real_time = time.time
+    time.time = clock.time
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        try:
+            # like asyncio.run: cancel what is left (scheduler stop watcher, ...)
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        finally:
+            time.time = real_time
+            loop.close()
@@ -0,0 +1,241 @@
+# bot/folders.py
+import asyncio
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from telethon import errors
+from telethon.tl.functions.chatlists import (
+    CheckChatlistInviteRequest,
+    GetChatlistUpdatesRequest,
+    JoinChatlistUpdatesRequest,
+)
+from telethon.tl.types import InputChatlistDialogFilter, UpdateDialogFilter
+from telethon.utils import get_peer_id
+
+from bot.capacity import is_capacity_channel
+from bot.clients import new_client
+from bot.config import AUTO_LEAVE_POLICY, FOLDER_UPDATES_INTERVAL_SECONDS
+from bot.utils import parse_link_type
+from bot import db
+
+logger = logging.getLogger(__name__)
+
+# chat folder slug errors have no dedicated exception class in Telethon
+DEAD_FOLDER_RPC_MESSAGES = ("INVITE_SLUG_EXPIRED", "INVITE_SLUG_EMPTY")
+
+
+def is_dead_folder_error(e: Exception) -> bool:
+    return getattr(e, "message", None) in DEAD_FOLDER_RPC_MESSAGES
+
+
+def folder_invite_peers(invite) -> list:
+    """
+    Peers offered by CheckChatlistInvite:
+    - ChatlistInvite: peers
+    - ChatlistInviteAlready (folder already added): missing_peers
+    """
+    return list(getattr(invite, "peers", None) or getattr(invite, "missing_peers", None) or [])
+
+
+def folder_peer_rows(invite) -> List[Tuple[int, str, str]]:
+    """
+    (peer_id, username, title) for every chat of the folder invite.
+    """
+    chats = {c.id: c for c in (getattr(invite, "chats", None) or [])}
+
+    rows = []
+    peers = folder_invite_peers(invite) + list(getattr(invite, "already_peers", None) or [])
+    for peer in peers:
+        peer_id = get_peer_id(peer, add_mark=False)
+        chat = chats.get(peer_id)
+        rows.append((
+            peer_id,
+            (getattr(chat, "username", None) or "") if chat else "",
+            (getattr(chat, "title", None) or "") if chat else "",
+        ))
+    return rows
+
+
+def folder_filter_id(result) -> Optional[int]:
+    """
+    Dialog filter id created by JoinChatlistInvite (UpdateDialogFilter in the Updates),
+    or filter_id of a ChatlistInviteAlready.
+    """
+    filter_id = getattr(result, "filter_id", None)
+    if filter_id is not None:
+        return int(filter_id)
+
+    for upd in getattr(result, "updates", None) or []:
+        if isinstance(upd, UpdateDialogFilter):
+            return int(upd.id)
+    return None
+
+
+def peers_not_joined(peers: list, joined_peer_ids) -> list:
+    """
+    Drop folder peers the account already belongs to (dialog snapshot ids).
+    """
+    return [p for p in peers if get_peer_id(p, add_mark=False) not in joined_peer_ids]
+
+
+async def expand_folder_links(session_string: str, limit: int = 100) -> dict:
+    """
+    Validation step for chat folder (addlist) links:
+    - CheckChatlistInvite once per folder (no join)
+    - store member peers as child rows (folder_peers), linked to existing
+      individual username links of the same chats
+    - expired/invalid slugs => link marked dead
+
+    Covered individual links are then distributed together with their folder
+    and satisfied by the single folder join (see db.assign_unassigned_links).
+    """
+    folders = db.get_unexpanded_folder_links(limit)
+    report = {"folders": len(folders), "expanded": 0, "dead": 0, "peers": 0, "covered_links": 0}
+    if not folders:
+        return report
+
+    client = new_client(session_string)
+    await client.connect()
+
+    try:
+        for link_id, link in folders:
+            _, slug = parse_link_type(link)
+            try:
+                invite = await client(CheckChatlistInviteRequest(slug))
+            except errors.FloodWaitError as e:
+                logger.warning(f"[folders] FloodWait {e.seconds}s, stopping expansion")
+                break
+            except Exception as e:
+                if is_dead_folder_error(e):
+                    db.mark_link_dead(link_id, f"folder: {e}")
+                    report["dead"] += 1
+                    continue
+                logger.warning(f"[folders] Check failed for {link}: {e}")
+                continue
+
+            rows = folder_peer_rows(invite)
+            covered = db.save_folder_peers(link_id, rows)
+
+            report["expanded"] += 1
+            report["peers"] += len(rows)
+            report["covered_links"] += covered
+
+        logger.info(f"[folders] {report}")
+        return report
+
+    finally:
+        await client.disconnect()
+
+
+# ---------------- incremental folder updates ----------------
+async def poll_session_folder_updates(session_id: int, session_string: str) -> dict:
+    """
+    For every folder this session joined:
+    - GetChatlistUpdates (one cheap request) => only chats added since we joined
+    - new chats => JoinChatlistUpdates (one bulk join for all of them)
+    Folder state (peers_count / last_polled_at) is kept in session_folders.
+
+    FloodWait (either request) => flood_until persisted, session stops here.
+    ChannelsTooMuch => with AUTO_LEAVE_POLICY=off the account is flagged full
+    (pending links released, as the joiner does); otherwise nothing is left
+    for optional folder additions: they wait for the next poll.
+    """
+    folders = db.list_session_folders(session_id)
+    report = {"session_id": session_id, "folders": len(folders), "new_peers": 0, "joined_updates": 0}
+    if not folders:
+        return report
+
+    client = new_client(session_string)
+    await client.connect()
+
+    try:
+        for f in folders:
+            chatlist = InputChatlistDialogFilter(filter_id=f["filter_id"])
+            try:
+                updates = await client(GetChatlistUpdatesRequest(chatlist=chatlist))
+            except errors.FilterIdInvalidError:
+                # folder removed from the account
+                db.delete_session_folder(session_id, f["folder_link_id"])
+                continue
+            except errors.FloodWaitError as e:
+                db.set_session_flood_until(session_id, time.time() + int(e.seconds) + 5)
+                logger.warning(f"[folders] Session {session_id} FloodWait {e.seconds}s on folder update check")
+                break
+
+            new_peers = list(getattr(updates, "missing_peers", None) or [])
+            if not new_peers:
+                db.mark_session_folder_polled(session_id, f["folder_link_id"], 0)
+                continue
+
+            try:
+                result = await client(JoinChatlistUpdatesRequest(chatlist=chatlist, peers=new_peers))
+            except errors.FloodWaitError as e:
+                db.set_session_flood_until(session_id, time.time() + int(e.seconds) + 5)
+                logger.warning(f"[folders] Session {session_id} FloodWait {e.seconds}s on folder update")
+                break
+            except errors.ChannelsTooMuchError:
+                db.log_join(session_id, f["link"], "failed", "ChannelsTooMuchError (folder update)")
+                if AUTO_LEAVE_POLICY == "off":
+                    released = db.mark_session_channels_full(session_id)
+                    logger.warning(
+                        f"[folders] Session {session_id} channels limit reached on folder update, "
+                        f"released {released} pending links"
+                    )
+                else:
+                    logger.warning(f"[folders] Session {session_id} channels limit reached, folder update postponed")
+                break
+
+            # chats joined count toward the account's channel cap
+            chats = getattr(result, "chats", None)
+            joined = sum(1 for c in chats if is_capacity_channel(c)) if chats is not None else len(new_peers)
+            db.add_session_joined_channels(session_id, joined)
+
+            db.save_folder_peers(f["folder_link_id"], folder_peer_rows(updates))
+            db.mark_session_folder_polled(session_id, f["folder_link_id"], len(new_peers))
+            db.log_join(session_id, f["link"], "success", f"folder_update +{len(new_peers)} chats")
+
+            report["new_peers"] += len(new_peers)
+            report["joined_updates"] += 1
+
+        return report
+
+    finally:
+        await client.disconnect()
+
+
+async def poll_all_folder_updates() -> dict:
+    new_peers = 0
+    for session_id in db.list_sessions_with_folders():
+        if db.get_session_flood_until(session_id) > time.time():
+            continue
+
+        row = db.get_session_by_id(session_id)
+        if not row:
+            continue
+
+        try:
+            res = await poll_session_folder_updates(session_id, row[1])
+            new_peers += res["new_peers"]
+        except Exception as e:
+            logger.warning(f"[folders] Session {session_id} update poll failed: {e}")
+
+    if new_peers:
+        logger.info(f"[folders] joined {new_peers} new folder chats")
+    return {"new_peers": new_peers}
+
+
+async def folder_updates_loop() -> None:
+    """
+    Background task: poll joined folders every FOLDER_UPDATES_INTERVAL_SECONDS (0 = disabled).
+    """
+    if FOLDER_UPDATES_INTERVAL_SECONDS <= 0:
+        return
+
+    while True:
+        try:
+            await poll_all_folder_updates()
+        except Exception as e:
+            logger.exception(f"[folders] update pass crashed: {e}")
+
+        await asyncio.sleep(FOLDER_UPDATES_INTERVAL_SECONDS)
@@ -0,0 +1,102 @@
+# bot/health.py
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+from bot.config import HEALTH_CHECK_CONCURRENCY, HEALTH_CHECK_INTERVAL_SECONDS
+from bot.session_import import validate_session
+from bot import db
+
+logger = logging.getLogger(__name__)
+
+# one pass at a time (periodic loop and bot-triggered checks)
+_CHECK_LOCK = asyncio.Lock()
+
+
+async def check_session_health(session_id: int, session_string: str) -> Dict:
+    """
+    Probe one session (connect + get_me) and apply the result:
+    - revoked / deauthorized / banned => soft_delete_session (pending links requeued)
+    - restricted => kept, but its pending links are released and it gets no new ones
+    - network errors / timeouts / AUTH_KEY_DUPLICATED => 'error', stays assignable (next pass retries)
+    """
+    res = await validate_session(session_string)
+    status = res["status"]
+
+    if status in ("revoked", "invalid"):
+        db.soft_delete_session(session_id)
+        logger.warning(f"[health] Session {session_id} dead ({res.get('error')}), soft-deleted")
+        return {"session_id": session_id, "health": "dead", "released": 0, "error": res.get("error")}
+
+    if status == "error":
+        db.set_session_health(session_id, "error", error=res.get("error"))
+        return {"session_id": session_id, "health": "error", "released": 0, "error": res.get("error")}
+
+    health = "restricted" if res["restricted"] else "ok"
+    released = db.set_session_health(
+        session_id, health, latency_ms=res["latency_ms"], error=res["restriction"] or None,
+    )
+    if health == "restricted":
+        logger.warning(f"[health] Session {session_id} restricted ({res['restriction']}), released {released} links")
+
+    return {"session_id": session_id, "health": health, "released": released, "latency_ms": res["latency_ms"]}
+
+
+async def check_all_sessions(
+    concurrency: int = HEALTH_CHECK_CONCURRENCY,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict:
+    """
+    Health check of every active session, `concurrency` at a time.
+    Sessions running in the active join run are skipped: a second connection
+    with the same auth key would race the joiner (AUTH_KEY_DUPLICATED).
+    progress(checked, total) is called after every session.
+    """
+    async with _CHECK_LOCK:
+        busy = set()
+        run = db.get_active_join_run()
+        if run:
+            busy = {r["session_id"] for r in db.get_run_sessions(run["id"]) if r["status"] == "running"}
+
+        active = db.list_sessions()
+        sessions = [s for s in active if s[0] not in busy]
+        sem = asyncio.Semaphore(concurrency)
+        report = {
+            "checked": 0, "ok": 0, "restricted": 0, "dead": 0, "error": 0, "released": 0,
+            "busy": len(active) - len(sessions),
+        }
+
+        async def _one(session_id: int, session_string: str) -> None:
+            async with sem:
+                try:
+                    res = await check_session_health(session_id, session_string)
+                except Exception as e:
+                    logger.warning(f"[health] Session {session_id} check crashed: {e}")
+                    res = {"health": "error", "released": 0}
+
+            report["checked"] += 1
+            report[res["health"]] += 1
+            report["released"] += res["released"]
+            if progress is not None:
+                progress(report["checked"], len(sessions))
+
+        await asyncio.gather(*(_one(sid, ss) for sid, ss, _, _ in sessions))
+
+        logger.info(f"[health] {report}")
+        return report
+
+
+async def health_check_loop() -> None:
+    """
+    Background task: check all sessions every HEALTH_CHECK_INTERVAL_SECONDS (0 = disabled).
+    """
+    if HEALTH_CHECK_INTERVAL_SECONDS <= 0:
+        return
+
+    while True:
+        try:
+            await check_all_sessions()
+        except Exception as e:
+            logger.exception(f"[health] check pass crashed: {e}")
+
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
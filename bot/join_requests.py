@@ -0,0 +1,131 @@
+# bot/join_requests.py
+import asyncio
+import logging
+import time
+
+from telethon import errors
+from telethon.tl.functions.messages import CheckChatInviteRequest
+from telethon.tl.types import ChatInviteAlready
+
+from bot.clients import new_client
+from bot.config import (
+    REQUESTED_POLL_INTERVAL_SECONDS,
+    REQUESTED_TTL_HOURS,
+    REQUESTED_INVITE_CHECKS_PER_POLL,
+)
+from bot.joiner import take_dialog_snapshot
+from bot.utils import parse_link_type
+from bot import db
+
+logger = logging.getLogger(__name__)
+
+
+async def poll_session_requests(session_id: int, session_string: str) -> dict:
+    """
+    Check which 'requested' links of one session were approved.
+
+    - one dialogs snapshot (a few GetDialogs pages) matches username links
+    - invite-hash links can't be matched offline; up to
+      REQUESTED_INVITE_CHECKS_PER_POLL of them are checked with CheckChatInvite
+      (ChatInviteAlready => approved, expired hash => failed), least recently
+      checked first so every poll moves on to the next ones
+
+    Approved => success (bulk). Still waiting => untouched.
+    """
+    requested = db.get_requested_links_for_session(session_id)
+    report = {"session_id": session_id, "checked": len(requested), "approved": 0, "failed": 0}
+    if not requested:
+        return report
+
+    client = new_client(session_string)
+    await client.connect()
+
+    try:
+        snapshot = await take_dialog_snapshot(client)
+
+        approved = []
+        invites = []
+        for link_id, link in requested:
+            if snapshot.covers(link):
+                approved.append((link_id, link))
+            elif parse_link_type(link)[0] == "invite":
+                invites.append((link_id, link))
+
+        checked = []
+        for link_id, link in invites[:REQUESTED_INVITE_CHECKS_PER_POLL]:
+            _, invite_hash = parse_link_type(link)
+            try:
+                invite = await client(CheckChatInviteRequest(invite_hash))
+            except (errors.InviteHashExpiredError, errors.InviteHashInvalidError) as e:
+                db.mark_join_failed(session_id, link_id, f"request_invite_dead: {e}")
+                db.log_join(session_id, link, "failed", f"request_invite_dead: {e}")
+                report["failed"] += 1
+                continue
+            except errors.FloodWaitError as e:
+                # persisted: the join scheduler must not run into the same limit
+                db.set_session_flood_until(session_id, time.time() + int(e.seconds) + 5)
+                logger.warning(f"[requests] Session {session_id} FloodWait {e.seconds}s, stop checking invites")
+                break
+
+            if isinstance(invite, ChatInviteAlready):
+                approved.append((link_id, link))
+            else:
+                checked.append(link_id)
+
+        db.mark_requests_checked(session_id, checked)
+
+        if approved:
+            db.mark_joins_success_bulk(session_id, approved, note="request_approved")
+            report["approved"] = len(approved)
+
+        return report
+
+    finally:
+        await client.disconnect()
+
+
+async def poll_all_requests() -> dict:
+    """
+    One polling pass:
+    1) expire stale requests (TTL)
+    2) check remaining requests per session
+    """
+    expired = db.expire_stale_requests(REQUESTED_TTL_HOURS)
+
+    approved = 0
+    failed = 0
+    for session_id in db.list_sessions_with_requested():
+        if db.get_session_flood_until(session_id) > time.time():
+            continue
+
+        row = db.get_session_by_id(session_id)
+        if not row:
+            continue
+
+        try:
+            res = await poll_session_requests(session_id, row[1])
+            approved += res["approved"]
+            failed += res["failed"]
+        except Exception as e:
+            logger.warning(f"[requests] Session {session_id} poll failed: {e}")
+
+    if expired or approved or failed:
+        logger.info(f"[requests] approved={approved} failed={failed} expired={expired}")
+
+    return {"approved": approved, "failed": failed, "expired": expired}
+
+
+async def requests_poll_loop() -> None:
+    """
+    Background task: poll every REQUESTED_POLL_INTERVAL_SECONDS (0 = disabled).
+    """
+    if REQUESTED_POLL_INTERVAL_SECONDS <= 0:
+        return
+
+    while True:
+        try:
+            await poll_all_requests()
+        except Exception as e:
+            logger.exception(f"[requests] poll pass crashed: {e}")
+
+        await asyncio.sleep(REQUESTED_POLL_INTERVAL_SECONDS)
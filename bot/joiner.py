@@ -1,10 +1,13 @@
 # bot/joiner.py
 import asyncio
+import heapq
 import logging
-from typing import Optional, Tuple
+import random
+import socket
+import time
+from typing import Dict, Optional, Tuple, List, Set
 
 from telethon import TelegramClient, errors
-from telethon.sessions import StringSession
 from telethon.tl.functions.channels import JoinChannelRequest
 from telethon.tl.functions.messages import ImportChatInviteRequest
 
@@ -14,9 +17,25 @@ from telethon.tl.functions.chatlists import (
     JoinChatlistInviteRequest,
 )
 
-from bot.config import API_ID, API_HASH, JOIN_DELAY_SECONDS
+from bot.capacity import LEAVE_DELAY_SECONDS, is_capacity_channel, leave_candidates, leave_channel, leave_info
+from bot.clients import new_client
+from bot.config import (
+    AUTO_LEAVE_POLICY,
+    CHANNELS_LIMIT_PER_SESSION,
+    JOIN_DELAY_SECONDS,
+    JOIN_LEASE_SECONDS,
+    JOIN_RETRY_MAX_ATTEMPTS,
+    JOIN_RETRY_BASE_SECONDS,
+    JOIN_RETRY_MAX_SECONDS,
+    TOPUP_BATCH,
+    TOPUP_INTERVAL_SECONDS,
+    TOPUP_LOW_WATER,
+)
+from bot.folders import folder_filter_id, folder_invite_peers, is_dead_folder_error, peers_not_joined
+from bot.leases import get_lease_backend
+from bot.reserve import reserve_target
 from bot.utils import parse_link_type
-from bot import db
+from bot import db, diagnostics, metrics
 
 logger = logging.getLogger(__name__)
 
@@ -40,39 +59,244 @@ DEAD_LINK_EXCEPTIONS = (
 )
 
 
-def _is_dead_link_error(e: Exception) -> bool:
-    return isinstance(e, DEAD_LINK_EXCEPTIONS)
+# ---------------- Transient errors (retry later, link is fine) ----------------
+RETRYABLE_EXCEPTIONS = (
+    # network / transport (not bare OSError: file/permission errors are bugs)
+    ConnectionError,
+    asyncio.TimeoutError,
+    TimeoutError,
+    socket.gaierror,
+
+    # Telegram side: 5xx and internal timeouts
+    errors.ServerError,
+    errors.TimedOutError,
+    errors.RpcCallFailError,
+    errors.RpcMcgetFailError,
+    errors.InterdcCallErrorError,
+    errors.InterdcCallRichErrorError,
+    errors.WorkerBusyTooLongRetryError,
+)
+
+# Checked in order; anything else is 'fatal' (failed, not retried).
+# FloodWait / already participant / request sent are handled before this table.
+ERROR_CLASSES = (
+    ("dead", DEAD_LINK_EXCEPTIONS),
+    ("retryable", RETRYABLE_EXCEPTIONS),
+)
+
+
+def classify_error(e: Exception) -> str:
+    """
+    Returns 'dead' | 'retryable' | 'fatal'.
+    """
+    if is_dead_folder_error(e):
+        return "dead"
+    for kind, types in ERROR_CLASSES:
+        if isinstance(e, types):
+            return kind
+    return "fatal"
+
+
+def join_outcome(e: Optional[Exception]) -> str:
+    """
+    Outcome label of one join RPC (metrics): success | already_participant |
+    requested | flood_wait | channels_too_much | dead | retryable | fatal.
+    """
+    if e is None:
+        return "success"
+    if isinstance(e, errors.UserAlreadyParticipantError):
+        return "already_participant"
+    if isinstance(e, errors.InviteRequestSentError):
+        return "requested"
+    if isinstance(e, errors.FloodWaitError):
+        return "flood_wait"
+    if isinstance(e, errors.ChannelsTooMuchError):
+        return "channels_too_much"
+    return classify_error(e)
+
+
+def retry_backoff_seconds(retry: int) -> float:
+    """
+    Jittered exponential backoff for the n-th retry (1-based):
+    base * 2^(n-1), capped, then scaled by a random factor in [0.5, 1.5).
+    """
+    delay = min(JOIN_RETRY_MAX_SECONDS, JOIN_RETRY_BASE_SECONDS * (2 ** max(0, retry - 1)))
+    return delay * random.uniform(0.5, 1.5)
+
+
+# ---------------- Dialog snapshot (already joined chats) ----------------
+class DialogSnapshot:
+    """
+    Chats the account already belongs to:
+    - peer_ids: raw ids of joined groups/channels
+    - usernames: lowercase public usernames of those chats
+    - channel_ids: channels/supergroups (count toward the account's channels cap)
+    - joined_ids: chats joined since the snapshot was taken
+    - leavable: {peer_id: capacity.leave_info(...)} of chats auto-leave may pick
+
+    Built once from the dialogs list, then updated incrementally
+    from join results (no extra RPC).
+    """
+
+    def __init__(self):
+        self.peer_ids: Set[int] = set()
+        self.usernames: Set[str] = set()
+        self.channel_ids: Set[int] = set()
+        self.joined_ids: Set[int] = set()
+        self.leavable: Dict[int, Tuple] = {}
+        self._names_by_id: Dict[int, Set[str]] = {}
+
+    @property
+    def channel_count(self) -> int:
+        return len(self.channel_ids)
+
+    def add_entity(self, entity) -> None:
+        if entity is None:
+            return
+
+        names = set()
+        username = getattr(entity, "username", None)
+        if username:
+            names.add(username.lower())
+
+        # collectible usernames (fragment)
+        for u in getattr(entity, "usernames", None) or []:
+            name = getattr(u, "username", None)
+            if name and getattr(u, "active", True):
+                names.add(name.lower())
+
+        self.usernames.update(names)
+
+        peer_id = getattr(entity, "id", None)
+        if peer_id is not None:
+            self.peer_ids.add(int(peer_id))
+            self._names_by_id.setdefault(int(peer_id), set()).update(names)
+            if is_capacity_channel(entity):
+                self.channel_ids.add(int(peer_id))
+
+    def add_join_result(self, result) -> None:
+        """
+        Join RPCs return Updates carrying the joined chat(s).
+        """
+        for chat in getattr(result, "chats", None) or []:
+            if getattr(chat, "left", False):
+                continue
+            self.add_entity(chat)
+            self.joined_ids.add(int(chat.id))
+
+    def remove_ids(self, peer_ids) -> None:
+        """
+        Chats left (auto-leave).
+        """
+        for peer_id in peer_ids:
+            self.peer_ids.discard(peer_id)
+            self.channel_ids.discard(peer_id)
+            self.leavable.pop(peer_id, None)
+            self.usernames.difference_update(self._names_by_id.pop(peer_id, ()))
+
+    def covers(self, link: str) -> bool:
+        """
+        True if link points to a chat we are already in.
+        Only username links can be matched offline (invite hashes need an RPC).
+        """
+        kind, value = parse_link_type(link)
+        if kind != "username" or not value:
+            return False
+        return value.split("/", 1)[0].lower() in self.usernames
+
+
+async def take_dialog_snapshot(client: TelegramClient) -> DialogSnapshot:
+    """
+    One pass over dialogs (GetDialogs pages), groups/channels only.
+    """
+    snapshot = DialogSnapshot()
+    async for dialog in client.iter_dialogs():
+        if dialog.is_group or dialog.is_channel:
+            snapshot.add_entity(dialog.entity)
+            info = leave_info(dialog)
+            if info:
+                snapshot.leavable[int(dialog.entity.id)] = info
+    return snapshot
+
+
+def _skip_already_joined(
+    session_id: int,
+    pending: List[Tuple[int, str]],
+    snapshot: DialogSnapshot,
+    note: str = "already_joined_snapshot",
+    peer_ids: Optional[Dict[int, int]] = None,
+) -> Tuple[List[Tuple[int, str]], int]:
+    """
+    Remove links already satisfied by the snapshot and mark them success in bulk.
+    peer_ids: known chat of link ids (links.peer_id), matches invite links too.
+    Returns (remaining_pending, skipped_count).
+    """
+    peer_ids = peer_ids or {}
+    satisfied = [
+        (lid, link) for lid, link in pending
+        if snapshot.covers(link) or peer_ids.get(lid) in snapshot.peer_ids
+    ]
+    if not satisfied:
+        return pending, 0
+
+    db.mark_joins_success_bulk(session_id, satisfied, note=note)
+
+    satisfied_ids = {lid for lid, _ in satisfied}
+    remaining = [(lid, link) for lid, link in pending if lid not in satisfied_ids]
+    return remaining, len(satisfied)
 
 
-async def join_one_link(client: TelegramClient, link: str) -> None:
+class FolderAlreadyJoined:
+    """
+    join_one_link result for a folder whose chats are all joined already
+    (no join RPC sent). filter_id: the account's folder, when it has one.
+    """
+
+    def __init__(self, filter_id: Optional[int]):
+        self.filter_id = filter_id
+
+
+def joined_peer_id(result) -> Optional[int]:
+    """
+    Id of the chat a single-chat join (username / invite link) led to.
+    """
+    chats = [c for c in getattr(result, "chats", None) or [] if not getattr(c, "left", False)]
+    return int(chats[0].id) if len(chats) == 1 else None
+
+
+async def join_one_link(client: TelegramClient, link: str, snapshot: Optional[DialogSnapshot] = None):
     """
     Join:
     - username links (public)
     - invite links (+hash / joinchat/hash)
-    - chat folder links (addlist/slug)
+    - chat folder links (addlist/slug): one join for all member chats,
+      minus chats already in the snapshot
+
+    Returns the RPC result (Updates with joined chats), or FolderAlreadyJoined.
     """
     kind, value = parse_link_type(link)
 
     if kind == "invite":
-        await client(ImportChatInviteRequest(value))
-        return
+        return await client(ImportChatInviteRequest(value))
 
     if kind == "username":
-        await client(JoinChannelRequest(value))
-        return
+        return await client(JoinChannelRequest(value))
 
     if kind == "folder":
         invite = await client(CheckChatlistInviteRequest(value))
 
-        peers = []
-        if hasattr(invite, "peers") and invite.peers:
-            peers = invite.peers
+        peers = folder_invite_peers(invite)
+        if not peers and not getattr(invite, "already_peers", None):
+            raise Exception("Chat folder invite returned empty peers list")
+
+        if snapshot is not None:
+            peers = peers_not_joined(peers, snapshot.peer_ids)
 
+        # every chat of the folder is joined already
         if not peers:
-            raise Exception("Chat folder invite returned empty peers list")
+            return FolderAlreadyJoined(folder_filter_id(invite))
 
-        await client(JoinChatlistInviteRequest(slug=value, peers=peers))
-        return
+        return await client(JoinChatlistInviteRequest(slug=value, peers=peers))
 
     raise Exception(f"Unsupported link kind: {kind}")
 
@@ -108,126 +332,686 @@ async def _replace_dead_link_immediately(
     return (new_link_id, new_link)
 
 
-async def run_session_joiner(
-    session_id: int,
-    session_string: str,
-    limit: int = 1000,
-    stop_flag=None,
-):
+def _should_stop(stop_flag, run_id: Optional[int]) -> bool:
     """
-    - pending ACTIVE links only
-    - join sequentially
-
-    Rules:
-    - success/already participant => mark success + sleep JOIN_DELAY_SECONDS
-    - dead => replace immediately, no sleep
-    - floodwait => sleep only that account, retry same link
-    - join request required => mark requested (NOT failed, NOT dead), no sleep
+    Stop if the in-process flag is set or the persisted run was asked to stop.
     """
-    client = TelegramClient(StringSession(session_string), API_ID, API_HASH)
-    await client.connect()
+    if stop_flag and stop_flag.is_set():
+        return True
+    if run_id is not None and db.is_join_run_stopping(run_id):
+        return True
+    return False
+
 
+async def sleep_or_stop(seconds: float, stop_flag) -> None:
+    """
+    Sleep `seconds` but wake up early when stop_flag is set.
+    """
+    if seconds <= 0:
+        return
+    if stop_flag is None:
+        await asyncio.sleep(seconds)
+        return
     try:
-        pending = db.get_pending_links_for_session(session_id, limit=limit)
+        await asyncio.wait_for(stop_flag.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
 
-        success = 0
-        failed = 0
-        requested = 0
 
-        i = 0
-        while i < len(pending):
-            link_id, link = pending[i]
+# run progress rows (counters for resume / notifier) are rewritten at most this
+# often while stepping; close() always saves. Join state itself lives in assignments.
+PROGRESS_SAVE_SECONDS = 5
 
-            if stop_flag and stop_flag.is_set():
-                logger.info(f"[Session {session_id}] Stop flag set. Exiting.")
-                break
 
-            try:
-                await join_one_link(client, link)
+class SessionJoiner:
+    """
+    Join queue of ONE account, driven step by step (see bot/scheduler.py).
 
-                db.mark_join_success(session_id, link_id)
-                db.log_join(session_id, link, "success", "")
-                success += 1
+    step() handles exactly one pending link and returns how many seconds
+    this session must wait before its next step (None => queue finished).
+    No sleeping happens inside; the caller decides when to call again.
 
-                logger.info(f"[Session {session_id}] Joined OK: {link}")
-                await asyncio.sleep(JOIN_DELAY_SECONDS)
+    Rules:
+    - already in dialogs snapshot => mark success in bulk, no RPC, no delay
+    - success => mark success, next step after JOIN_DELAY_SECONDS
+    - already participant => mark success, no delay
+    - dead => replace immediately, no delay
+    - floodwait => persist flood_until, retry same link after the wait
+    - join request required => mark requested (NOT failed, NOT dead), no delay
+    - transient error (network, 5xx) => link deferred with jittered backoff
+      (assignments.next_attempt_at), session continues with other links;
+      failed only after JOIN_RETRY_MAX_ATTEMPTS retries
+    - disconnected client => reconnect before the next step (with backoff)
+    - account deleted / restricted by the health checker meanwhile (its
+      pending links already back in the pool) => stop, run status 'stopped'
+    - channels too much => auto-leave one chat per step (LEAVE_DELAY_SECONDS
+      apart), then retry the link; nothing to leave => account full, stop
+
+    If run_id is given, progress (cursor/counters/status) is persisted in join_run_sessions.
+
+    If lease_owner is given, the session's pending rows are leased to that worker
+    (see bot/leases.py); the lease is renewed while stepping and the session is
+    given up if another worker holds or takes it.
+    """
 
-                i += 1
-                continue
+    def __init__(
+        self,
+        session_id: int,
+        session_string: str,
+        limit: int = 1000,
+        run_id: Optional[int] = None,
+        lease_owner: Optional[str] = None,
+    ):
+        self.session_id = session_id
+        self.session_string = session_string
+        self.limit = limit
+        self.run_id = run_id
+        self.lease_owner = lease_owner
+        self.lease_lost = False
+        self._lease_renewed_at = 0.0
+
+        self.client: Optional[TelegramClient] = None
+        self.snapshot = DialogSnapshot()
+        self.pending: List[Tuple[int, str]] = []
+        self.deferred: List[Tuple[float, int, str]] = []  # heap of (next_attempt_at, link_id, link)
+        self.i = 0
+        self.reconnect_failures = 0
+        self.snapshot_ok = False
+        self._left_for_link: Optional[int] = None
+        self._leave_queue: List[Tuple[int, object]] = []  # (peer_id, input channel), one left per step
+        self._leave_for: Optional[str] = None
+        self._left_count = 0
+        self._last_topup = 0.0
+        self.channels_full = False
+        self._joined_dirty = False  # snapshot channel count not yet in sessions.joined_channels
+        self._progress_saved_at = 0.0
+        self.released = False
+        self.started = False
+        self.closed = False
+        self._step_ended_at: Optional[float] = None
+
+        self.success = 0
+        self.failed = 0
+        self.requested = 0
+        self.saved_delay_slots = 0
+        self.retried = 0
+        self.topped_up = 0
+
+    def initial_delay(self) -> float:
+        """
+        Seconds until the account's persisted FloodWait window expires (0 if none).
+        """
+        return max(0.0, db.get_session_flood_until(self.session_id) - time.time())
+
+    async def _start(self) -> None:
+        sid = self.session_id
+        self.started = True
+
+        if self.lease_owner:
+            if not get_lease_backend().claim_session(self.lease_owner, sid, JOIN_LEASE_SECONDS):
+                logger.info(f"[Session {sid}] Leased by another worker, skipping")
+                self.lease_lost = True
+                return
+            self._lease_renewed_at = time.time()
+
+        self.client = new_client(self.session_string)
+        await self.client.connect()
+
+        if self.run_id is not None:
+            db.set_run_session_status(self.run_id, sid, "running")
+
+        pending = db.get_pending_links_for_session(sid, limit=self.limit)
+        self.deferred = [(ts, lid, link) for lid, link, ts in db.get_deferred_links_for_session(sid)]
+        heapq.heapify(self.deferred)
+
+        try:
+            self.snapshot = await take_dialog_snapshot(self.client)
+            self.snapshot_ok = True
+            db.set_session_joined_channels(sid, self.snapshot.channel_count)
+        except Exception as e:
+            logger.warning(f"[Session {sid}] Dialog snapshot failed: {e}")
+
+        # folders first: one folder join can satisfy many individual links
+        pending.sort(key=lambda x: 0 if parse_link_type(x[1])[0] == "folder" else 1)
+
+        self.pending, skipped = _skip_already_joined(sid, pending, self.snapshot)
+        if skipped:
+            logger.info(f"[Session {sid}] Skipped {skipped} already joined links (snapshot)")
+
+        self.success += skipped
+        self.saved_delay_slots += skipped
+
+        # already at the channels cap and nothing may be left: don't waste the links
+        if (
+            self.snapshot_ok
+            and self.snapshot.channel_count >= CHANNELS_LIMIT_PER_SESSION
+            and AUTO_LEAVE_POLICY == "off"
+        ):
+            self._release_full(f"{self.snapshot.channel_count} channels joined")
+
+        # resumed run: continue counters from the persisted row
+        if self.run_id is not None:
+            prev = db.get_run_session(self.run_id, sid)
+            if prev:
+                self.success += prev["success"]
+                self.failed += prev["failed"]
+                self.requested += prev["requested"]
+                self.saved_delay_slots += prev["saved_delay_slots"]
+
+    def _save_progress(self) -> None:
+        if self.run_id is None:
+            return
+        self._progress_saved_at = time.monotonic()
+        db.save_run_session_progress(
+            self.run_id, self.session_id,
+            last_link_id=self.pending[self.i - 1][0] if self.i > 0 else None,
+            success=self.success, failed=self.failed, requested=self.requested,
+            saved_delay_slots=self.saved_delay_slots,
+        )
 
-            except errors.UserAlreadyParticipantError:
-                db.mark_join_success(session_id, link_id)
-                db.log_join(session_id, link, "success", "already_participant")
-                success += 1
+    def _advance(self) -> None:
+        self.i += 1
+        if time.monotonic() - self._progress_saved_at >= PROGRESS_SAVE_SECONDS:
+            self._save_progress()
+
+    def _renew_lease(self) -> bool:
+        """
+        Heartbeat the lease once a third of it has elapsed. False => lease lost.
+        """
+        now = time.time()
+        if now - self._lease_renewed_at < JOIN_LEASE_SECONDS / 3:
+            return True
+
+        if get_lease_backend().heartbeat(self.lease_owner, self.session_id, JOIN_LEASE_SECONDS) == 0:
+            logger.warning(f"[Session {self.session_id}] Lease lost to another worker, stopping")
+            self.lease_lost = True
+            return False
+
+        self._lease_renewed_at = now
+        return True
+
+    def _remember_folder(self, folder_link_id: int, filter_id: Optional[int]) -> None:
+        """
+        Track joined folder for incremental update polling (bot/folders.py).
+        """
+        if filter_id is None:
+            return
+        db.save_session_folder(self.session_id, folder_link_id, filter_id)
+
+    def _skip_covered_by_folder(self) -> None:
+        """
+        After a folder join: remaining links of chats it joined are done (bulk, no RPC).
+        """
+        rest = self.pending[self.i:]
+        rest, covered = _skip_already_joined(
+            self.session_id, rest, self.snapshot, note="covered_by_folder",
+            peer_ids=db.get_link_peer_ids([lid for lid, _ in rest]),
+        )
+        if not covered:
+            return
+
+        self.pending = self.pending[:self.i] + rest
+        self.success += covered
+        self.saved_delay_slots += covered
+        logger.info(f"[Session {self.session_id}] Folder join covered {covered} more links")
+
+    def _check_released(self) -> bool:
+        """
+        True if the account was soft-deleted or flagged restricted since the
+        run started: its pending assignments are gone, drop the local queue.
+        """
+        if db.is_session_joinable(self.session_id):
+            return False
+
+        logger.warning(f"[Session {self.session_id}] Deleted or restricted by health check, stopping")
+        self.pending = self.pending[:self.i]
+        self.deferred = []
+        self._leave_queue = []
+        self.released = True
+        return True
+
+    def _release_full(self, reason: str) -> None:
+        """
+        Account can't join more channels: give its remaining links back to the pool.
+        """
+        released = db.mark_session_channels_full(self.session_id)
+        logger.warning(
+            f"[Session {self.session_id}] Channels limit reached ({reason}), "
+            f"released {released} pending links"
+        )
+        self.pending = self.pending[:self.i]
+        self.deferred = []
+        self.channels_full = True
+
+    def _on_channels_too_much(self, link_id: int, link: str) -> Optional[float]:
+        """
+        ChannelsTooMuch: queue chats to leave per AUTO_LEAVE_POLICY (picked from
+        the dialog snapshot, left one per step by _leave_step) and retry the link,
+        or (policy off / nothing to leave) flag the account full and stop it.
+        """
+        # one leave batch per link: still too much right after leaving => give up
+        if self._left_for_link != link_id:
+            self._left_for_link = link_id
+            self._leave_queue = leave_candidates(self.snapshot.leavable, keep_ids=self.snapshot.joined_ids)
+            self._leave_for = link
+            self._left_count = 0
+
+        if self._leave_queue:
+            return 0.0
+
+        self._give_up_full(link)
+        return None
 
-                logger.info(f"[Session {session_id}] Already participant: {link}")
-                await asyncio.sleep(JOIN_DELAY_SECONDS)
+    def _give_up_full(self, link: str) -> None:
+        db.log_join(self.session_id, link, "failed", "ChannelsTooMuchError")
+        self._release_full("ChannelsTooMuchError")
+
+    async def _leave_step(self) -> Optional[float]:
+        """
+        Leave one queued chat; LEAVE_DELAY_SECONDS between leaves, the link is
+        retried once the batch is done. Nothing left => account full, stop.
+        """
+        sid = self.session_id
+        peer_id, channel = self._leave_queue.pop(0)
+        try:
+            if await leave_channel(self.client, peer_id, channel):
+                self._left_count += 1
+                self.snapshot.remove_ids([peer_id])
+                db.set_session_joined_channels(sid, self.snapshot.channel_count)
+        except errors.FloodWaitError as e:
+            # retry the link after the wait with what was freed so far
+            self._leave_queue = []
+            wait_s = int(e.seconds) + 5
+            db.set_session_flood_until(sid, time.time() + wait_s)
+            logger.warning(f"[Session {sid}] FloodWait {e.seconds}s while leaving, stopping auto-leave")
+            if self._left_count:
+                return float(wait_s)
+
+        if self._leave_queue:
+            return float(LEAVE_DELAY_SECONDS)
+
+        if not self._left_count:
+            self._give_up_full(self._leave_for)
+            return None
+
+        db.log_join(sid, self._leave_for, "left", f"auto_leave {AUTO_LEAVE_POLICY}: {self._left_count} chats")
+        logger.info(f"[Session {sid}] Auto-left {self._left_count} chats ({AUTO_LEAVE_POLICY})")
+        # retry the same link in the freed slots
+        return float(JOIN_DELAY_SECONDS)
+
+    def _top_up(self) -> None:
+        """
+        Continuous distribution while the run is live: below TOPUP_LOW_WATER
+        remaining links, take a small batch from the pool (reserve target kept,
+        see db.top_up_session_links / bot/reserve.py) and append the new pending links to the queue.
+        Checked every TOPUP_INTERVAL_SECONDS, and always once the queue is empty.
+        """
+        if self.run_id is None or TOPUP_BATCH <= 0 or self.channels_full:
+            return
+
+        remaining = len(self.pending) - self.i
+        if remaining >= TOPUP_LOW_WATER:
+            return
+
+        now = time.time()
+        if remaining > 0 and now - self._last_topup < TOPUP_INTERVAL_SECONDS:
+            return
+        self._last_topup = now
+
+        sid = self.session_id
+        self._flush_joined_channels()
+        if db.top_up_session_links(sid, TOPUP_LOW_WATER, TOPUP_BATCH, reserve_target()) <= 0:
+            return
+
+        known = {lid for lid, _ in self.pending[self.i:]} | {lid for _, lid, _ in self.deferred}
+        fresh = [x for x in db.get_pending_links_for_session(sid, limit=self.limit) if x[0] not in known]
+        fresh.sort(key=lambda x: 0 if parse_link_type(x[1])[0] == "folder" else 1)
+
+        fresh, skipped = _skip_already_joined(sid, fresh, self.snapshot)
+        self.success += skipped
+        self.saved_delay_slots += skipped
+
+        self.pending.extend(fresh)
+        self.topped_up += len(fresh) + skipped
+        logger.info(f"[Session {sid}] Topped up {len(fresh) + skipped} links ({skipped} already joined)")
+
+    def _flush_joined_channels(self) -> None:
+        """
+        Joins only bump the in-memory count; sessions.joined_channels is written
+        before the capacity is read (top-up) and when the session closes.
+        """
+        if self._joined_dirty:
+            db.set_session_joined_channels(self.session_id, self.snapshot.channel_count)
+            self._joined_dirty = False
+
+    def _cap_for_lease(self, delay: float) -> float:
+        # long sleeps must not outlive the lease: wake up to heartbeat it
+        if self.lease_owner:
+            return min(delay, JOIN_LEASE_SECONDS / 3)
+        return delay
+
+    def _promote_due_retries(self) -> None:
+        """
+        Deferred links whose backoff has elapsed go back to the front of the queue.
+        """
+        now = time.time()
+        while self.deferred and self.deferred[0][0] <= now:
+            _, link_id, link = heapq.heappop(self.deferred)
+            self.pending.insert(self.i, (link_id, link))
+
+    def _defer_retry(self, link_id: int, link: str, err: str) -> float:
+        """
+        Transient error: retry this link later (jittered exponential backoff),
+        meanwhile continue with the next one. Failed after JOIN_RETRY_MAX_ATTEMPTS.
+        """
+        sid = self.session_id
+        retry = db.get_assignment_retries(sid, link_id) + 1
+
+        if retry > JOIN_RETRY_MAX_ATTEMPTS:
+            db.mark_join_failed(sid, link_id, f"retries_exhausted: {err}")
+            db.log_join(sid, link, "failed", f"retries_exhausted: {err}")
+            self.failed += 1
+            logger.error(f"[Session {sid}] Giving up after {retry - 1} retries: {link} | Error: {err}")
+            self._advance()
+            return 0.0
+
+        backoff = retry_backoff_seconds(retry)
+        next_attempt_at = time.time() + backoff
+        db.schedule_join_retry(sid, link_id, next_attempt_at, err)
+        db.log_join(sid, link, "retry", f"{err} (retry {retry} in {int(backoff)}s)")
+        self.retried += 1
+
+        logger.warning(f"[Session {sid}] Transient error on {link}: {err} -> retry {retry} in {int(backoff)}s")
+
+        # out of the queue without advancing the cursor; back via _promote_due_retries
+        self.pending.pop(self.i)
+        heapq.heappush(self.deferred, (next_attempt_at, link_id, link))
+        return 0.0
+
+    async def _ensure_connected(self) -> Optional[float]:
+        """
+        Reconnect a dropped client. None => connected, else delay before the next try.
+        """
+        if self.client.is_connected():
+            return None
+
+        try:
+            await self.client.connect()
+            self.reconnect_failures = 0
+            logger.info(f"[Session {self.session_id}] Reconnected")
+            return None
+        except RETRYABLE_EXCEPTIONS as e:
+            self.reconnect_failures += 1
+            if self.reconnect_failures > JOIN_RETRY_MAX_ATTEMPTS:
+                raise
+            delay = retry_backoff_seconds(self.reconnect_failures)
+            logger.warning(
+                f"[Session {self.session_id}] Reconnect failed ({e}), retry {self.reconnect_failures} in {int(delay)}s"
+            )
+            return self._cap_for_lease(delay)
+
+    async def _join(self, link: str):
+        """
+        join_one_link + join RPC metrics (latency / outcome by link kind)
+        and its diagnostics span.
+        """
+        kind = parse_link_type(link)[0]
+        t0 = time.perf_counter()
+        outcome = "success"
+        try:
+            result = await join_one_link(self.client, link, self.snapshot)
+            if isinstance(result, FolderAlreadyJoined):
+                outcome = "already_participant"
+            return result
+        except Exception as e:
+            outcome = join_outcome(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            metrics.observe_join(kind, outcome, elapsed)
+            diagnostics.record_span("join_one_link", elapsed)
+
+    async def step(self) -> Optional[float]:
+        # active (inside steps) vs sleep (between steps) time per session
+        t0 = time.monotonic()
+        if self._step_ended_at is not None:
+            metrics.SESSION_SLEEP_SECONDS.inc(t0 - self._step_ended_at, session=self.session_id)
+        try:
+            return await self._step()
+        finally:
+            self._step_ended_at = time.monotonic()
+            metrics.SESSION_ACTIVE_SECONDS.inc(self._step_ended_at - t0, session=self.session_id)
+
+    def _already_participant(self, link_id: int, link: str, filter_id: Optional[int]) -> float:
+        sid = self.session_id
+        if filter_id is not None:
+            self._remember_folder(link_id, filter_id)
+
+        db.mark_join_success(sid, link_id, link=link, note="already_participant")
+        self.success += 1
+        self.saved_delay_slots += 1
+
+        logger.info(f"[Session {sid}] Already participant: {link}")
+
+        # no delay: nothing was joined
+        self._advance()
+        return 0.0
+
+    async def _step(self) -> Optional[float]:
+        if not self.started:
+            await self._start()
+
+        if self.lease_lost or self.released or self._check_released():
+            return None
+
+        self._promote_due_retries()
+        self._top_up()
+
+        if self.i >= len(self.pending) and not self.deferred:
+            return None
+
+        # only while work remains: a heartbeat on a drained session leases 0 rows
+        if self.lease_owner and not self._renew_lease():
+            return None
+
+        if self.i >= len(self.pending):
+            # only deferred retries left: sleep until the earliest one
+            return self._cap_for_lease(max(0.0, self.deferred[0][0] - time.time()))
+
+        reconnect_delay = await self._ensure_connected()
+        if reconnect_delay is not None:
+            return reconnect_delay
+
+        if self._leave_queue:
+            return await self._leave_step()
+
+        sid = self.session_id
+        link_id, link = self.pending[self.i]
+
+        # joined earlier in this run via another link to the same chat
+        if self.snapshot.covers(link):
+            db.mark_join_success(sid, link_id, link=link, note="already_joined_snapshot")
+            self.success += 1
+            self.saved_delay_slots += 1
+            self._advance()
+            return 0.0
+
+        try:
+            result = await self._join(link)
+            if isinstance(result, FolderAlreadyJoined):
+                return self._already_participant(link_id, link, result.filter_id)
+
+            self.snapshot.add_join_result(result)
+            self._joined_dirty = self.snapshot_ok
+
+            is_folder = parse_link_type(link)[0] == "folder"
+            db.mark_join_success(sid, link_id, peer_id=None if is_folder else joined_peer_id(result), link=link)
+            self.success += 1
+
+            logger.info(f"[Session {sid}] Joined OK: {link}")
+            self._advance()
+
+            if is_folder:
+                self._remember_folder(link_id, folder_filter_id(result))
+                self._skip_covered_by_folder()
+
+            return float(JOIN_DELAY_SECONDS)
+
+        except errors.UserAlreadyParticipantError:
+            return self._already_participant(link_id, link, None)
+
+        except errors.InviteRequestSentError as e:
+            # ✅ Join request sent successfully, waiting for approval
+            note = str(e) or "invite_request_sent"
+            db.mark_join_requested(sid, link_id, note=note)
+            db.log_join(sid, link, "requested", note)
+            self.requested += 1
+
+            logger.info(f"[Session {sid}] Join request sent: {link}")
+
+            # no delay
+            self._advance()
+            return 0.0
+
+        except errors.ChannelsTooMuchError:
+            return self._on_channels_too_much(link_id, link)
 
-                i += 1
-                continue
+        except errors.FloodWaitError as e:
+            wait_s = int(e.seconds) + 5
+            metrics.FLOOD_WAIT_SECONDS.observe(e.seconds)
 
-            except errors.InviteRequestSentError as e:
-                # ✅ Join request sent successfully, waiting for approval
-                note = str(e) or "invite_request_sent"
-                db.mark_join_requested(session_id, link_id, note=note)
-                db.log_join(session_id, link, "requested", note)
-                requested += 1
+            db.bump_attempt(sid, link_id, f"FloodWaitError: {e.seconds}s")
+            db.log_join(sid, link, "failed", f"FloodWaitError wait {wait_s}s")
+            db.set_session_flood_until(sid, time.time() + wait_s)
 
-                logger.info(f"[Session {session_id}] Join request sent: {link}")
+            logger.warning(
+                f"[Session {sid}] FloodWait {e.seconds}s -> waiting {wait_s}s then retry"
+            )
 
-                # no sleep
-                i += 1
-                continue
+            # retry same link
+            return float(wait_s)
 
-            except errors.FloodWaitError as e:
-                wait_s = int(e.seconds) + 5
+        except Exception as e:
+            err = str(e) or type(e).__name__
+            kind = classify_error(e)
 
-                db.bump_attempt(session_id, link_id, f"FloodWaitError: {e.seconds}s")
-                db.log_join(session_id, link, "failed", f"FloodWaitError wait {wait_s}s")
+            if kind == "retryable":
+                return self._defer_retry(link_id, link, err)
 
-                logger.warning(
-                    f"[Session {session_id}] FloodWait {e.seconds}s -> sleeping {wait_s}s then retry"
+            if kind == "dead":
+                # the reserve pick checks the session's capacity
+                self._flush_joined_channels()
+                replacement = await _replace_dead_link_immediately(
+                    session_id=sid,
+                    dead_link_id=link_id,
+                    dead_link=link,
+                    reason=err,
                 )
-                await asyncio.sleep(wait_s)
 
-                # retry same link
-                continue
+                if not replacement:
+                    db.mark_join_failed(sid, link_id, f"dead_no_reserve: {err}")
+                    self.failed += 1
+                    self._advance()
+                    return 0.0
+
+                self.pending[self.i] = replacement
+                return 0.0
+
+            db.mark_join_failed(sid, link_id, err)
+            db.log_join(sid, link, "failed", err)
+            self.failed += 1
+
+            logger.error(f"[Session {sid}] Failed join: {link} | Error: {err}")
+            self._advance()
+            return 0.0
+
+    async def close(self, status: str = "done") -> None:
+        """
+        status: 'done' | 'stopped' | 'error' (persisted for the run).
+        A session given up to another worker is left as 'lease_lost'.
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.released and status == "done":
+            status = "stopped"
 
+        self._flush_joined_channels()
+
+        if self.lease_lost:
+            if self.run_id is not None and self.client is not None:
+                self._save_progress()
+            return
+
+        if self.run_id is not None:
+            if self.client is not None:
+                self._save_progress()
+            db.set_run_session_status(self.run_id, self.session_id, status)
+
+        if self.lease_owner:
+            get_lease_backend().release(self.lease_owner, self.session_id)
+
+        if self.client is not None:
+            try:
+                await self.client.disconnect()
             except Exception as e:
-                err = str(e)
-
-                if _is_dead_link_error(e):
-                    replacement = await _replace_dead_link_immediately(
-                        session_id=session_id,
-                        dead_link_id=link_id,
-                        dead_link=link,
-                        reason=err,
-                    )
-
-                    if not replacement:
-                        db.mark_join_failed(session_id, link_id, f"dead_no_reserve: {err}")
-                        failed += 1
-                        i += 1
-                        continue
-
-                    new_link_id, new_link = replacement
-                    pending[i] = (new_link_id, new_link)
-                    continue
-
-                db.mark_join_failed(session_id, link_id, err)
-                db.log_join(session_id, link, "failed", err)
-                failed += 1
-
-                logger.error(f"[Session {session_id}] Failed join: {link} | Error: {err}")
-                i += 1
-                continue
+                logger.warning(f"[Session {self.session_id}] disconnect failed: {e}")
 
+    def result(self) -> dict:
         return {
-            "session_id": session_id,
-            "success": success,
-            "failed": failed,
-            "requested": requested,
+            "session_id": self.session_id,
+            "success": self.success,
+            "failed": self.failed,
+            "requested": self.requested,
+            "saved_delay_slots": self.saved_delay_slots,
+            "retried": self.retried,
+            "topped_up": self.topped_up,
+            "lease_lost": self.lease_lost,
         }
 
+
+async def run_session_joiner(
+    session_id: int,
+    session_string: str,
+    limit: int = 1000,
+    stop_flag=None,
+    run_id: Optional[int] = None,
+    lease_owner: Optional[str] = None,
+):
+    """
+    Standalone driver for one session (own sleep loop).
+    Runs driven by orchestrate_join use JoinScheduler instead.
+    """
+    joiner = SessionJoiner(session_id, session_string, limit=limit, run_id=run_id, lease_owner=lease_owner)
+
+    # account still flood-limited from an earlier run => wait it out first
+    flood_wait = joiner.initial_delay()
+    if flood_wait > 0:
+        logger.info(f"[Session {session_id}] Flood-limited for {int(flood_wait)}s more, waiting")
+        if run_id is not None:
+            db.set_run_session_status(run_id, session_id, "flood_wait")
+        await sleep_or_stop(flood_wait, stop_flag)
+
+    status = "done"
+    try:
+        while True:
+            if _should_stop(stop_flag, run_id):
+                logger.info(f"[Session {session_id}] Stop flag set. Exiting.")
+                status = "stopped"
+                break
+
+            delay = await joiner.step()
+            if delay is None:
+                break
+
+            await sleep_or_stop(delay, stop_flag)
+
+    except Exception:
+        status = "error"
+        raise
+
     finally:
-        await client.disconnect()
+        await joiner.close(status)
+
+    return joiner.result()
@@ -0,0 +1,83 @@
+# bot/leases.py
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from bot.config import LEASE_BACKEND
+from bot import db
+
+
+class LeaseBackend(ABC):
+    """
+    Work-lease storage used by SessionJoiner and headless workers.
+
+    A worker owns one session's pending join work while its lease is live.
+    Any shared store that can do an atomic claim (SQLite BEGIN IMMEDIATE,
+    SELECT ... FOR UPDATE SKIP LOCKED on a server DB, ...) can implement this.
+    """
+
+    @abstractmethod
+    def claim_session(self, worker_id: str, session_id: int, lease_seconds: float) -> bool:
+        ...
+
+    @abstractmethod
+    def claim_next_session(
+        self,
+        worker_id: str,
+        lease_seconds: float,
+        exclude_session_ids: Optional[List[int]] = None,
+    ) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    def heartbeat(self, worker_id: str, session_id: int, lease_seconds: float) -> int:
+        ...
+
+    @abstractmethod
+    def release(self, worker_id: str, session_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def reclaim_expired(self) -> int:
+        ...
+
+    @abstractmethod
+    def count_live(self, exclude_worker_id: str = "") -> int:
+        ...
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """
+    Leases stored on assignments rows of the bot's SQLite DB (see bot/db.py).
+    """
+
+    def claim_session(self, worker_id, session_id, lease_seconds):
+        return db.claim_session_lease(worker_id, session_id, lease_seconds)
+
+    def claim_next_session(self, worker_id, lease_seconds, exclude_session_ids=None):
+        return db.claim_next_session_lease(worker_id, lease_seconds, exclude_session_ids)
+
+    def heartbeat(self, worker_id, session_id, lease_seconds):
+        return db.heartbeat_session_lease(worker_id, session_id, lease_seconds)
+
+    def release(self, worker_id, session_id):
+        db.release_session_lease(worker_id, session_id)
+
+    def reclaim_expired(self):
+        return db.reclaim_expired_leases()
+
+    def count_live(self, exclude_worker_id=""):
+        return db.count_live_leases(exclude_worker_id)
+
+
+_BACKENDS = {
+    "sqlite": SQLiteLeaseBackend,
+}
+
+_backend: Optional[LeaseBackend] = None
+
+
+def get_lease_backend() -> LeaseBackend:
+    global _backend
+    if _backend is None:
+        _backend = _BACKENDS[LEASE_BACKEND]()
+    return _backend
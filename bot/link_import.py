@@ -0,0 +1,111 @@
+# bot/link_import.py
+"""
+Bulk link import from uploaded link dumps (txt / csv, millions of lines).
+
+The file is streamed line by line: every line goes through the same
+scanner as channel messages (extract_telegram_links + normalize_tme_link)
+and links are inserted LINK_IMPORT_BATCH at a time (db.add_links_bulk).
+Memory stays bounded by one batch and one line (long lines are cut at
+MAX_LINE_BYTES). Synchronous: the bot runs it in a thread.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from bot.config import LINK_IMPORT_BATCH
+from bot.utils import extract_telegram_links, normalize_tme_link, parse_link_type
+from bot import db
+
+logger = logging.getLogger(__name__)
+
+# progress callback interval (lines read)
+PROGRESS_EVERY_LINES = 20_000
+
+# a "line" longer than this is read in pieces (file without newlines)
+MAX_LINE_BYTES = 64 * 1024
+
+# invalid lines quoted in the report
+INVALID_SAMPLES = 5
+
+
+def scan_line(line: str) -> List[str]:
+    """
+    Normalized Telegram links found in one line (csv columns, notes and
+    other text around them are ignored).
+    """
+    links = []
+    for raw in extract_telegram_links(line):
+        link = normalize_tme_link(raw)
+        if link and parse_link_type(link)[1]:
+            links.append(link)
+    return links
+
+
+def import_links_file(
+    path: str,
+    source_channel: str,
+    progress: Optional[Callable[[Dict], None]] = None,
+    stop: Optional[threading.Event] = None,
+) -> Dict:
+    """
+    Stream `path` into the links table.
+
+    Report: lines, links (found, repeats included), new, duplicate (already
+    in the DB, any status, or repeated in the file), invalid (non-empty lines
+    without a Telegram link), invalid_samples, bytes / total_bytes, seconds,
+    cancelled. progress(report) is called every PROGRESS_EVERY_LINES lines and
+    after every batch; stop (set by the caller) ends the import after the
+    current batch.
+    """
+    report: Dict = {
+        "lines": 0, "links": 0, "new": 0, "duplicate": 0, "invalid": 0,
+        "invalid_samples": [], "bytes": 0, "total_bytes": os.path.getsize(path),
+        "seconds": 0.0, "cancelled": False,
+    }
+    t0 = time.monotonic()
+    quality = db.get_source_quality(source_channel)
+    # unique links of the current batch (dict: keeps file order)
+    batch: Dict[str, None] = {}
+
+    def flush() -> None:
+        report["new"] += db.add_links_bulk(list(batch), source_channel, quality=quality)
+        batch.clear()
+
+    with open(path, "rb") as f:
+        for raw in iter(lambda: f.readline(MAX_LINE_BYTES), b""):
+            report["lines"] += 1
+            report["bytes"] += len(raw)
+
+            line = raw.decode("utf-8", errors="ignore").strip()
+            if line:
+                links = scan_line(line)
+                if links:
+                    report["links"] += len(links)
+                    for link in links:
+                        batch[link] = None
+                else:
+                    report["invalid"] += 1
+                    if len(report["invalid_samples"]) < INVALID_SAMPLES:
+                        report["invalid_samples"].append(f"{report['lines']}: {line[:80]}")
+
+            flushed = len(batch) >= LINK_IMPORT_BATCH
+            if flushed:
+                flush()
+            if flushed or report["lines"] % PROGRESS_EVERY_LINES == 0:
+                report["duplicate"] = report["links"] - report["new"] - len(batch)
+                if progress is not None:
+                    progress(report)
+                if stop is not None and stop.is_set():
+                    report["cancelled"] = True
+                    break
+
+    flush()
+    report["duplicate"] = report["links"] - report["new"]
+    report["seconds"] = round(time.monotonic() - t0, 1)
+    logger.info(
+        f"[link_import] {path}: {report['lines']} lines, {report['new']} new, "
+        f"{report['duplicate']} duplicate, {report['invalid']} invalid in {report['seconds']}s"
+    )
+    return report
@@ -1,18 +1,37 @@
 # bot/main.py
 import asyncio
+import itertools
 import logging
 import os
 import re
-from typing import Dict
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 
-from bot.config import API_ID, API_HASH, BOT_TOKEN, OWNER_ID
+from bot.config import (
+    API_ID, API_HASH, BOT_TOKEN, OWNER_ID, JOIN_WORKER_PROCESSES, WORKER_ID,
+    JOB_CONCURRENCY, JOB_HISTORY, LEASES_ENABLED,
+)
 from bot import db
 from bot.extractor import extract_links_from_channel
-from bot.distributor import distribute_links_to_sessions, estimate_needed_sessions
-from bot.joiner import run_session_joiner
+from bot.folders import expand_folder_links, folder_updates_loop
+from bot import diagnostics
+from bot.dead_links import dead_links_loop
+from bot.distributor import distribute_links_to_sessions, estimate_needed_sessions, forecast_completion
+from bot.health import check_all_sessions, health_check_loop
+from bot.leases import get_lease_backend
+from bot.link_import import import_links_file
+from bot.metrics import start_metrics_server
+from bot.notifier import Outbox, RunDashboard, StatusMessage
+from bot.scheduler import JoinScheduler, add_run_sessions
+from bot.session_import import import_sessions
+from bot.sharding import run_sharded
+from bot.join_requests import requests_poll_loop
 from bot.utils import normalize_tme_link
 
 logging.basicConfig(level=logging.INFO)
@@ -22,11 +41,15 @@ logger = logging.getLogger("bot")
 USER_STATE: Dict[int, str] = {}
 STATE_WAIT_SESSION = "wait_session"
 STATE_WAIT_CHANNELS = "wait_channels"
+STATE_WAIT_SESSIONS_FILE = "wait_sessions_file"
+STATE_WAIT_LINKS_FILE = "wait_links_file"
 
 # ---------------- Join control ----------------
-JOIN_RUNNING = False
+# Run state itself is persisted in DB (join_runs / join_run_sessions).
+# STOP_EVENT only wakes up sleeping coroutines of this process immediately.
 STOP_EVENT = asyncio.Event()
 JOIN_LOCK = asyncio.Lock()
+ACTIVE_SCHEDULER: Optional[JoinScheduler] = None
 
 
 def main_keyboard():
@@ -34,15 +57,20 @@ def main_keyboard():
         [InlineKeyboardButton("➕ إضافة جلسة", callback_data="add_session"),
          InlineKeyboardButton("👁️ عرض الجلسات", callback_data="view_sessions")],
 
-        [InlineKeyboardButton("🗑️ حذف جلسة", callback_data="delete_session")],
+        [InlineKeyboardButton("📂 استيراد جلسات (ملف)", callback_data="import_sessions"),
+         InlineKeyboardButton("🗑️ حذف جلسة", callback_data="delete_session")],
+
+        [InlineKeyboardButton("🩺 فحص الجلسات", callback_data="health_check")],
 
-        [InlineKeyboardButton("📥 طلب قنوات الروابط", callback_data="request_channels")],
+        [InlineKeyboardButton("📥 طلب قنوات الروابط", callback_data="request_channels"),
+         InlineKeyboardButton("📄 استيراد روابط (ملف)", callback_data="import_links")],
 
         [InlineKeyboardButton("🚀 توزيع + انضمام", callback_data="start_join")],
 
         [InlineKeyboardButton("📤 تصدير الروابط", callback_data="export_links")],
 
-        [InlineKeyboardButton("📊 الإحصائيات", callback_data="stats")],
+        [InlineKeyboardButton("📊 الإحصائيات", callback_data="stats"),
+         InlineKeyboardButton("🧰 المهام", callback_data="jobs")],
 
         [InlineKeyboardButton("🛑 إيقاف الانضمام", callback_data="stop_join")],
     ])
@@ -55,6 +83,216 @@ bot = Client(
     bot_token=BOT_TOKEN,
 )
 
+# all long-running flows send through the outbox (rate-limited, coalescing)
+OUTBOX = Outbox(bot)
+
+
+# session health (bot/health.py) in the sessions view
+HEALTH_ICONS = {"ok": "🟢", "restricted": "⛔", "error": "🟠", "unknown": "⚪"}
+
+
+# ---------------- Background jobs ----------------
+JOB_ICONS = {"queued": "⏳", "running": "🔄", "done": "✅", "failed": "❌", "cancelled": "🚫"}
+
+
+def _fmt_elapsed(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class Job:
+    """
+    One tracked background operation. Its status message (progress while
+    running, result when finished) is updated in place through the outbox.
+    """
+
+    def __init__(self, job_id: int, kind: str, title: str, chat_id: int):
+        self.id = job_id
+        self.kind = kind
+        self.title = title
+        self.chat_id = chat_id
+
+        self.status = "queued"
+        self.progress = ""
+        self.result = ""
+        # structured result for callers awaiting the job (e.g. distribution report)
+        self.value: Any = None
+
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+        self.status_msg = StatusMessage(OUTBOX, chat_id)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def elapsed(self) -> float:
+        start = self.started_at or self.created_at
+        return (self.finished_at or time.time()) - start
+
+    def render(self) -> str:
+        txt = (
+            f"{JOB_ICONS[self.status]} **Job #{self.id}** ({self.kind}): {self.title}\n"
+            f"Status: {self.status} | ⏱️ {_fmt_elapsed(self.elapsed())}\n"
+        )
+        body = self.result if self.finished else self.progress
+        if body:
+            txt += "\n" + body
+        return txt
+
+    def set_progress(self, text: str) -> None:
+        self.progress = text
+        self.status_msg.update(self.render())
+
+    async def wait(self) -> "Job":
+        if self.task is not None:
+            await asyncio.shield(self.task)
+        return self
+
+
+class JobManager:
+    """
+    Runs bot operations (extract / export / distribute / validate) as
+    background tasks so handlers return immediately:
+    - per type concurrency (JOB_CONCURRENCY), extra jobs of a type wait queued
+    - cancel() cancels the task (queued or running)
+    - unfinished jobs + the last JOB_HISTORY finished ones stay listed
+    """
+
+    def __init__(self, limits: Dict[str, int], history: int = JOB_HISTORY):
+        self.limits = dict(limits)
+        self.history = history
+        self.jobs: "OrderedDict[int, Job]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+
+    def _sem(self, kind: str) -> asyncio.Semaphore:
+        if kind not in self._sems:
+            self._sems[kind] = asyncio.Semaphore(self.limits.get(kind, 1))
+        return self._sems[kind]
+
+    def submit(self, kind: str, title: str, chat_id: int, fn: Callable[[Job], Awaitable[str]]) -> Job:
+        """
+        fn(job) does the work, reports through job.set_progress() and
+        returns the result text shown in the job message.
+        """
+        job = Job(next(self._ids), kind, title, chat_id)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, fn))
+        self._prune()
+        return job
+
+    async def _run(self, job: Job, fn: Callable[[Job], Awaitable[str]]) -> None:
+        sem = self._sem(job.kind)
+        try:
+            if sem.locked():
+                job.set_progress(f"⏳ بانتظار انتهاء مهام {job.kind} أخرى...")
+
+            async with sem:
+                job.status = "running"
+                job.started_at = time.time()
+                job.set_progress("🔄 جاري التنفيذ...")
+
+                job.result = await fn(job) or ""
+                job.status = "done"
+
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            job.result = job.progress
+        except Exception as e:
+            logger.exception(f"[job {job.id}] {job.kind} failed: {e}")
+            job.status = "failed"
+            job.result = f"{job.progress}\n\n❌ {e}".strip()
+        finally:
+            job.finished_at = time.time()
+            job.status_msg.update(job.render(), reply_markup=main_keyboard())
+            self._prune()
+
+    def cancel(self, job_id: int) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job.finished or job.task is None:
+            return False
+        job.task.cancel()
+        return True
+
+    def active(self) -> List[Job]:
+        return [j for j in self.jobs.values() if not j.finished]
+
+    def _prune(self) -> None:
+        finished = [j.id for j in self.jobs.values() if j.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            self.jobs.pop(job_id, None)
+
+    def render_list(self) -> str:
+        if not self.jobs:
+            return "🧰 **المهام**\n\nلا توجد مهام."
+
+        txt = "🧰 **المهام**\n\n"
+        for job in reversed(self.jobs.values()):
+            txt += (
+                f"{JOB_ICONS[job.status]} #{job.id} {job.kind}: {job.title} "
+                f"[{job.status}] {_fmt_elapsed(job.elapsed())}\n"
+            )
+            if not job.finished and job.progress:
+                txt += f"   {job.progress.splitlines()[-1]}\n"
+        return txt
+
+
+JOBS = JobManager(JOB_CONCURRENCY)
+
+
+def jobs_keyboard():
+    kb = [
+        [InlineKeyboardButton(f"✖️ إلغاء #{job.id} ({job.kind})", callback_data=f"cancel_job_{job.id}")]
+        for job in JOBS.active()
+    ]
+    kb.append([InlineKeyboardButton("🔄 تحديث", callback_data="jobs"),
+               InlineKeyboardButton("رجوع", callback_data="back")])
+    return InlineKeyboardMarkup(kb)
+
+
+def _stats_text() -> str:
+    """
+    Stats, needed sessions and forecast sections of the stats screen (blocking DB reads).
+    """
+    st = db.get_stats()
+    needed = estimate_needed_sessions()
+    # auto-sized reserve (bot/reserve.py), the same value the estimate used
+    st["reserve_target"] = needed["reserve_target"]
+
+    txt = _fmt_stats_text(st)
+    txt += (
+        "\n\n🧮 **تقدير Sessions إضافية مطلوبة**\n"
+        f"- Unassigned Active: {needed.get('unassigned_active')}\n"
+        f"- Reserve Target: {needed.get('reserve_target')}\n"
+        f"- Distributable: {needed.get('distributable')}\n"
+        f"- Needed Sessions: {needed.get('needed_sessions')}\n"
+    )
+
+    fc = forecast_completion()
+    eta_at = (
+        time.strftime("%Y-%m-%d %H:%M", time.localtime(fc["eta_at"])) if fc["eta_at"] else "-"
+    )
+    txt += (
+        "\n🔮 **Forecast**\n"
+        f"- Backlog: {fc['backlog']} (pending {fc['pending']} + distributable {fc['distributable']})\n"
+        f"- Fleet speed: {fc['fleet_rate_per_hour']} links/h "
+        f"({fc['measured_sessions']}/{fc['sessions']} sessions measured)\n"
+        f"- Flood / dead rate: {fc['mean_flood_rate']} / {fc['mean_dead_rate']}\n"
+        f"- ETA: {fc['eta_hours']}h ({eta_at})\n"
+        f"- Sessions for {fc['target_hours']:g}h: {fc['sessions_needed']} "
+        f"(+{fc['additional_sessions_needed']})\n"
+    )
+    if fc["unplaceable"]:
+        txt += f"- ⛔ Over channel capacity: {fc['unplaceable']} links\n"
+
+    return txt
+
 
 def _fmt_stats_text(st: dict) -> str:
     sessions = st.get("sessions", 0)
@@ -116,6 +354,219 @@ def _safe_write_txt_file(filepath: str, lines: list[str]) -> None:
             f.write("\n".join(lines))
 
 
+# ---------------- Job bodies ----------------
+async def _extract_job(job: Job, session_string: str, channel_links: List[str]) -> str:
+    lines: List[str] = []
+    total_added = 0
+
+    for i, ch in enumerate(channel_links, 1):
+        head = f"⏳ [{i}/{len(channel_links)}] استخراج الروابط من: {ch}"
+        job.set_progress("\n".join(lines + [head]))
+
+        def on_progress(scanned: int, found: int, head: str = head) -> None:
+            job.set_progress("\n".join(lines + [f"{head}\n📨 {scanned} رسالة | 🔗 {found} رابط"]))
+
+        try:
+            links = await extract_links_from_channel(session_string, ch, progress=on_progress)
+            added = db.add_links(links, source_channel=ch)
+            total_added += added
+            lines.append(f"✅ {ch}: تم استخراج {len(links)} رابط / تم إضافة الجديد منها: {added}")
+        except Exception as e:
+            lines.append(f"❌ فشل استخراج {ch}\nالسبب: {e}")
+
+    # chat folder links are validated by their own job (no join)
+    if db.get_unexpanded_folder_links(1):
+        v = JOBS.submit(
+            "validate", "فحص روابط المجلدات", job.chat_id,
+            lambda j: _validate_job(j, session_string),
+        )
+        lines.append(f"📁 فحص المجلدات: Job #{v.id}")
+
+    lines.append(f"\n🏁 انتهى الاستخراج. إجمالي الروابط الجديدة: {total_added}")
+    return "\n".join(lines)
+
+
+async def _validate_job(job: Job, session_string: str) -> str:
+    job.set_progress("📁 CheckChatlistInvite لروابط المجلدات...")
+    fr = await expand_folder_links(session_string)
+    return (
+        f"📁 Folders: {fr['folders']} | expanded: {fr['expanded']} | ☠️ dead: {fr['dead']}\n"
+        f"chats: {fr['peers']} | covered links: {fr['covered_links']}"
+    )
+
+
+async def _import_sessions_job(job: Job, text: str) -> str:
+    def on_progress(done: int, total: int) -> None:
+        # every validation would be an edit: the outbox merges them anyway
+        job.set_progress(f"🔍 فحص الجلسات: {done}/{total}")
+
+    report = await import_sessions(text, progress=on_progress)
+
+    report_file = f"/tmp/session_import_{job.id}.txt"
+    _safe_write_txt_file(report_file, report["lines"])
+    summary = (
+        f"✅ added: {report['added']} | ⚠️ duplicate: {report['duplicate']}\n"
+        f"☠️ revoked: {report['revoked']} | ❌ invalid: {report['invalid']} | ❗ error: {report['error']}"
+    )
+    await OUTBOX.send_document(job.chat_id, report_file, caption=f"📂 تقرير الاستيراد (Job #{job.id})\n{summary}")
+    return summary
+
+
+async def _import_links_job(job: Job, message: Optional[Message], text: str, source: str) -> str:
+    """
+    message: uploaded document (downloaded here), else the pasted text is imported.
+    The temp file only exists while the job runs (a job cancelled in the queue leaves nothing).
+    """
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+
+    def on_download(current: int, total: int) -> None:
+        job.set_progress(f"⬇️ تحميل الملف: {current // 1024 // 1024}/{total // 1024 // 1024} MB")
+
+    def on_progress(r: dict) -> None:
+        # import thread -> event loop
+        pct = r["bytes"] * 100 // max(1, r["total_bytes"])
+        text = (
+            f"📄 {pct}% | {r['lines']} سطر\n"
+            f"🆕 new: {r['new']} | ⚠️ duplicate: {r['duplicate']} | ❌ invalid: {r['invalid']}"
+        )
+        loop.call_soon_threadsafe(job.set_progress, text)
+
+    fd, path = tempfile.mkstemp(prefix="link_import_", suffix=".txt")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        if message is not None:
+            await message.download(file_name=path, progress=on_download)
+        report = await asyncio.to_thread(import_links_file, path, source, on_progress, stop)
+    except asyncio.CancelledError:
+        # the thread finishes its current batch and returns
+        stop.set()
+        raise
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    lines = [
+        f"📄 {source}: {report['lines']} سطر | 🔗 {report['links']} رابط | ⏱️ {report['seconds']}s",
+        f"🆕 new: {report['new']} | ⚠️ duplicate: {report['duplicate']} | ❌ invalid: {report['invalid']}",
+    ]
+    if report["invalid_samples"]:
+        lines.append("أمثلة أسطر بدون روابط:\n" + "\n".join(report["invalid_samples"]))
+
+    sessions = db.list_sessions()
+    if sessions and db.get_unexpanded_folder_links(1):
+        v = JOBS.submit(
+            "validate", "فحص روابط المجلدات", job.chat_id,
+            lambda j: _validate_job(j, sessions[0][1]),
+        )
+        lines.append(f"📁 فحص المجلدات: Job #{v.id}")
+    return "\n".join(lines)
+
+
+async def _health_job(job: Job) -> str:
+    def on_progress(done: int, total: int) -> None:
+        job.set_progress(f"🩺 فحص الجلسات: {done}/{total}")
+
+    r = await check_all_sessions(progress=on_progress)
+    return (
+        f"🩺 Checked: {r['checked']} | ✅ ok: {r['ok']} | ⛔ restricted: {r['restricted']}\n"
+        f"☠️ dead (soft-deleted): {r['dead']} | ❗ error: {r['error']}\n"
+        f"🔁 Links returned to pool: {r['released']} | ⏭ skipped (joining): {r['busy']}"
+    )
+
+
+async def _profile_job(job: Job, seconds: float) -> str:
+    job.set_progress(f"🩻 أخذ عينات لمدة {seconds:g}s...")
+    path = await diagnostics.dump_profile(seconds)
+    await OUTBOX.send_document(job.chat_id, path, caption=f"🩻 Sampling profile ({seconds:g}s)")
+    return f"🩻 {os.path.basename(path)}"
+
+
+async def _export_job(job: Job, sessions: list) -> str:
+    uploads = []
+
+    # Export per session
+    for i, (sid, _, phone, _) in enumerate(sessions, 1):
+        job.set_progress(f"📤 تجهيز الملفات: {i}/{len(sessions)} Sessions")
+        links = db.get_links_for_session_export(sid, limit=1000)
+
+        filename = f"/tmp/session_{sid}_links.txt"
+        _safe_write_txt_file(filename, links)
+
+        caption = (
+            f"📌 Session {sid}\n"
+            f"📱 Phone: {phone or '-'}\n"
+            f"🔗 Links: {len(links)}"
+        )
+        uploads.append(OUTBOX.send_document(job.chat_id, filename, caption=caption))
+
+    # Export reserve
+    reserve_links = db.get_reserve_links_export(limit=500)
+    reserve_file = "/tmp/reserve_links_500.txt"
+    _safe_write_txt_file(reserve_file, reserve_links)
+
+    uploads.append(OUTBOX.send_document(
+        job.chat_id,
+        reserve_file,
+        caption=f"📦 Reserve Links (احتياطي)\n🔗 Links: {len(reserve_links)}"
+    ))
+
+    # files are rewritten by the next export: finish only once uploaded
+    job.set_progress(f"📤 رفع {len(uploads)} ملف...")
+    results = await asyncio.gather(*uploads)
+    failed = sum(1 for r in results if r is None)
+
+    txt = f"✅ تم التصدير بنجاح: {len(results) - failed} ملف"
+    if failed:
+        txt += f"\n❌ فشل رفع {failed} ملف"
+    return txt
+
+
+async def _distribute_job(job: Job) -> str:
+    job.set_progress("📌 توزيع الروابط على الجلسات...")
+
+    # DB-heavy and synchronous: keep the event loop (bot, joiners) responsive
+    stop = threading.Event()
+    thread = asyncio.ensure_future(asyncio.to_thread(distribute_links_to_sessions, stop))
+    try:
+        report = await asyncio.shield(thread)
+    except asyncio.CancelledError:
+        # the thread can't be interrupted: stop it between sessions and only
+        # end the job (and the run waiting on it) once it has returned
+        stop.set()
+        await thread
+        raise
+    job.value = report
+    if not report.get("ok"):
+        raise RuntimeError(f"فشل التوزيع: {report.get('error')}")
+
+    txt = (
+        "📌 **تقرير التوزيع**\n"
+        f"- Sessions: {report['sessions']}\n"
+        f"- Unassigned Active Before: {report.get('unassigned_active_before')}\n"
+        f"- Reserve Target: {report.get('reserve_target')}\n"
+        f"- Distributable Before: {report.get('distributable_before')}\n"
+        f"- Assigned Total: {report['assigned_total']}\n"
+        f"- Unassigned Active After: {report.get('unassigned_active_after')}\n"
+        f"- Reserve After: {report.get('reserve_after')}\n"
+        f"- ⏱️ Predicted makespan: {report.get('predicted_makespan_hours')}h "
+        f"(flat: {report.get('flat_makespan_hours')}h)\n\n"
+    )
+    if report.get("full_sessions"):
+        txt += f"⛔ Full sessions (channels limit): {report['full_sessions']}\n\n"
+
+    for row in report["per_session"]:
+        txt += (
+            f"Session {row['session_id']}: assigned {row['assigned']} | "
+            f"{row.get('rate_per_hour')}/h | flood {row.get('flood_rate')} | "
+            f"~{row.get('predicted_hours')}h"
+        )
+        txt += " ⛔ full\n" if row.get("full") else "\n"
+
+    return txt
+
+
 @bot.on_message(filters.command("start") & filters.private)
 async def start_handler(client: Client, message: Message):
     if message.from_user.id != OWNER_ID:
@@ -135,10 +586,26 @@ async def start_handler(client: Client, message: Message):
     )
 
 
+@bot.on_message(filters.command("profile") & filters.private)
+async def profile_handler(client: Client, message: Message):
+    """
+    /profile [seconds]: sampling profile of all threads, sent as a file.
+    """
+    if message.from_user.id != OWNER_ID:
+        return
+
+    try:
+        seconds = float(message.command[1]) if len(message.command) > 1 else 30
+    except ValueError:
+        await message.reply_text("❌ الاستخدام: /profile [seconds]")
+        return
+
+    job = JOBS.submit("profile", "Sampling profile", message.chat.id, lambda j: _profile_job(j, seconds))
+    await message.reply_text(f"🧰 Job #{job.id}: 🩻 profiling...")
+
+
 @bot.on_callback_query()
 async def callbacks(client: Client, cq: CallbackQuery):
-    global JOIN_RUNNING
-
     if cq.from_user.id != OWNER_ID:
         await cq.answer("Not allowed", show_alert=True)
         return
@@ -157,16 +624,64 @@ async def callbacks(client: Client, cq: CallbackQuery):
         await cq.answer()
         return
 
+    # ---------------- import_sessions ----------------
+    if data == "import_sessions":
+        USER_STATE[cq.from_user.id] = STATE_WAIT_SESSIONS_FILE
+        await cq.message.edit_text(
+            "📂 **استيراد جلسات**\n\n"
+            "أرسل ملف .txt فيه StringSession واحدة في كل سطر (أو الصقها في رسالة).\n"
+            "سيتم فحص كل جلسة (اتصال + get_me) قبل إضافتها، مع تقرير لكل سطر.",
+            reply_markup=main_keyboard()
+        )
+        await cq.answer()
+        return
+
+    # ---------------- import_links ----------------
+    if data == "import_links":
+        USER_STATE[cq.from_user.id] = STATE_WAIT_LINKS_FILE
+        await cq.message.edit_text(
+            "📄 **استيراد روابط**\n\n"
+            "أرسل ملف .txt أو .csv فيه روابط t.me (أي عدد من الأسطر)، أو الصقها في رسالة.\n"
+            "تتم قراءة الملف سطراً بسطر وإضافة الروابط الجديدة على دفعات، مع ملخص new / duplicate / invalid.",
+            reply_markup=main_keyboard()
+        )
+        await cq.answer()
+        return
+
+    # ---------------- health_check ----------------
+    if data == "health_check":
+        job = JOBS.submit("health", "فحص صحة الجلسات", cq.message.chat.id, _health_job)
+        await cq.message.edit_text(
+            f"🩺 Job #{job.id}: جاري فحص كل الجلسات (اتصال + get_me)...\n"
+            "- الجلسات المحظورة/الملغاة: حذف (Soft Delete) وإرجاع روابطها\n"
+            "- الجلسات المقيدة: لا توزيع روابط عليها",
+            reply_markup=main_keyboard()
+        )
+        await cq.answer()
+        return
+
     # ---------------- view_sessions ----------------
     if data == "view_sessions":
         sessions = db.list_sessions()
         if not sessions:
             await cq.message.edit_text("لا توجد جلسات.", reply_markup=main_keyboard())
         else:
+            health = db.get_sessions_health()
             txt = "👥 **الجلسات:**\n\n"
             for s in sessions:
                 sid, _, phone, created = s
-                txt += f"- ID: `{sid}` | 📱 {phone or '-'} | 📅 {created}\n"
+                h = health.get(sid, {})
+                txt += (
+                    f"- ID: `{sid}` | 📱 {phone or '-'} | 📅 {created}\n"
+                    f"  {HEALTH_ICONS.get(h.get('health'), '❔')} {h.get('health') or 'unknown'}"
+                )
+                if h.get("health_latency_ms") is not None:
+                    txt += f" | {h['health_latency_ms']}ms"
+                if h.get("dc_id"):
+                    txt += f" | DC {h['dc_id']}"
+                if h.get("health_error"):
+                    txt += f" | {h['health_error']}"
+                txt += "\n"
             await cq.message.edit_text(txt, reply_markup=main_keyboard())
         await cq.answer()
         return
@@ -219,54 +734,49 @@ async def callbacks(client: Client, cq: CallbackQuery):
             await cq.answer("لا توجد Sessions.", show_alert=True)
             return
 
+        job = JOBS.submit("export", "تصدير الروابط", cq.message.chat.id, lambda j: _export_job(j, sessions))
         await cq.message.edit_text(
             "📤 **تصدير الروابط**\n\n"
-            "جاري تجهيز الملفات...\n"
+            f"🧰 Job #{job.id}: جاري تجهيز الملفات في الخلفية...\n"
             "- سيتم إرسال ملف لكل Session (حتى 1000 رابط)\n"
             "- وسيتم إرسال ملف Reserve (500 رابط احتياطي)\n",
             reply_markup=main_keyboard()
         )
         await cq.answer()
+        return
 
-        # Export per session
-        for sid, _, phone, _ in sessions:
-            links = db.get_links_for_session_export(sid, limit=1000)
-
-            filename = f"/tmp/session_{sid}_links.txt"
-            _safe_write_txt_file(filename, links)
-
-            caption = (
-                f"📌 Session {sid}\n"
-                f"📱 Phone: {phone or '-'}\n"
-                f"🔗 Links: {len(links)}"
-            )
-            await cq.message.reply_document(filename, caption=caption)
-
-        # Export reserve
-        reserve_links = db.get_reserve_links_export(limit=500)
-        reserve_file = "/tmp/reserve_links_500.txt"
-        _safe_write_txt_file(reserve_file, reserve_links)
-
-        await cq.message.reply_document(
-            reserve_file,
-            caption=f"📦 Reserve Links (احتياطي)\n🔗 Links: {len(reserve_links)}"
-        )
+    # ---------------- jobs ----------------
+    if data == "jobs":
+        await cq.message.edit_text(JOBS.render_list(), reply_markup=jobs_keyboard())
+        await cq.answer()
+        return
 
-        await cq.message.reply_text("✅ تم التصدير بنجاح.", reply_markup=main_keyboard())
+    if data.startswith("cancel_job_"):
+        job_id = int(data.split("_")[-1])
+        if JOBS.cancel(job_id):
+            await cq.answer(f"🚫 تم إلغاء Job #{job_id}")
+        else:
+            await cq.answer("المهمة انتهت بالفعل.", show_alert=True)
+        await cq.message.edit_text(JOBS.render_list(), reply_markup=jobs_keyboard())
         return
 
     # ---------------- start_join ----------------
     if data == "start_join":
-        if JOIN_RUNNING:
+        if db.get_active_join_run():
             await cq.answer("عملية الانضمام تعمل بالفعل!", show_alert=True)
             return
 
         async with JOIN_LOCK:
-            if JOIN_RUNNING:
+            if db.get_active_join_run():
                 await cq.answer("عملية الانضمام تعمل بالفعل!", show_alert=True)
                 return
 
-            JOIN_RUNNING = True
+            sessions = db.list_assignable_sessions()
+            if not sessions:
+                await cq.answer("لا توجد Sessions.", show_alert=True)
+                return
+
+            run_id = db.create_join_run(cq.message.chat.id, [s[0] for s in sessions])
             STOP_EVENT.clear()
 
             await cq.message.edit_text(
@@ -278,22 +788,27 @@ async def callbacks(client: Client, cq: CallbackQuery):
             )
             await cq.answer()
 
-            asyncio.create_task(orchestrate_join(cq.message))
+            asyncio.create_task(orchestrate_join(cq.message.chat.id, run_id))
         return
 
     # ---------------- stats ----------------
     if data == "stats":
-        st = db.get_stats()
-        needed = estimate_needed_sessions()
+        # DB-heavy (counts over links/assignments/join_log): off the event loop
+        txt = await asyncio.to_thread(_stats_text)
 
-        txt = _fmt_stats_text(st)
-        txt += (
-            "\n\n🧮 **تقدير Sessions إضافية مطلوبة**\n"
-            f"- Unassigned Active: {needed.get('unassigned_active')}\n"
-            f"- Reserve Target: {needed.get('reserve_target')}\n"
-            f"- Distributable: {needed.get('distributable')}\n"
-            f"- Needed Sessions: {needed.get('needed_sessions')}\n"
-        )
+        lag = diagnostics.loop_lag_stats()
+        if lag:
+            txt += f"\n🩻 Loop lag avg/max: {lag['avg_ms']}ms / {lag['max_ms']}ms\n"
+
+        if ACTIVE_SCHEDULER is not None:
+            sch = ACTIVE_SCHEDULER.stats()
+            txt += (
+                "\n⏱️ **Scheduler**\n"
+                f"- Sessions: {sch['sessions']} (waiting {sch['waiting']})\n"
+                f"- Queue depth (due now): {sch['queue_depth']}\n"
+                f"- In flight: {sch['in_flight']}/{sch['max_workers']}\n"
+                f"- Lag avg/max: {sch['lag_avg']}s / {sch['lag_max']}s\n"
+            )
 
         await cq.message.edit_text(txt, reply_markup=main_keyboard())
         await cq.answer()
@@ -301,9 +816,11 @@ async def callbacks(client: Client, cq: CallbackQuery):
 
     # ---------------- stop_join ----------------
     if data == "stop_join":
-        if not JOIN_RUNNING:
+        run = db.get_active_join_run()
+        if not run:
             await cq.answer("لا توجد عملية انضمام شغالة.", show_alert=True)
             return
+        db.request_stop_join_run(run["id"])
         STOP_EVENT.set()
         await cq.message.edit_text("🛑 تم طلب الإيقاف... سيتم الإيقاف بأقرب فرصة.", reply_markup=main_keyboard())
         await cq.answer()
@@ -316,7 +833,7 @@ async def callbacks(client: Client, cq: CallbackQuery):
         return
 
 
-@bot.on_message(filters.private & ~filters.command("start"))
+@bot.on_message(filters.private & ~filters.command(["start", "profile"]))
 async def private_text_handler(client: Client, message: Message):
     if message.from_user.id != OWNER_ID:
         return
@@ -339,6 +856,55 @@ async def private_text_handler(client: Client, message: Message):
         USER_STATE.pop(message.from_user.id, None)
         return
 
+    # ---------------- bulk session import flow ----------------
+    if state == STATE_WAIT_SESSIONS_FILE:
+        if message.document:
+            data = await message.download(in_memory=True)
+            text = bytes(data.getbuffer()).decode("utf-8", errors="ignore")
+        else:
+            text = message.text or ""
+
+        if not text.strip():
+            await message.reply_text("❌ أرسل ملف نصي أو رسالة فيها الجلسات.")
+            return
+
+        USER_STATE.pop(message.from_user.id, None)
+        job = JOBS.submit(
+            "import", "استيراد جلسات", message.chat.id,
+            lambda j: _import_sessions_job(j, text),
+        )
+        await message.reply_text(
+            f"🧰 Job #{job.id}: جاري فحص واستيراد الجلسات في الخلفية.",
+            reply_markup=main_keyboard()
+        )
+        return
+
+    # ---------------- bulk link import flow ----------------
+    if state == STATE_WAIT_LINKS_FILE:
+        text = ""
+        if message.document:
+            # downloaded by the job itself (files can be large)
+            source = f"file:{message.document.file_name or message.document.file_unique_id}"
+            doc_message: Optional[Message] = message
+        else:
+            text = message.text or ""
+            source, doc_message = "file:message", None
+
+        if doc_message is None and not text.strip():
+            await message.reply_text("❌ أرسل ملف txt/csv أو رسالة فيها الروابط.")
+            return
+
+        USER_STATE.pop(message.from_user.id, None)
+        job = JOBS.submit(
+            "import_links", "استيراد روابط", message.chat.id,
+            lambda j: _import_links_job(j, doc_message, text, source),
+        )
+        await message.reply_text(
+            f"🧰 Job #{job.id}: جاري استيراد الروابط في الخلفية.",
+            reply_markup=main_keyboard()
+        )
+        return
+
     # ---------------- channels extraction flow ----------------
     if state == STATE_WAIT_CHANNELS:
         text = message.text or ""
@@ -357,86 +923,157 @@ async def private_text_handler(client: Client, message: Message):
         # use first session for extraction
         session_string = sessions[0][1]
 
-        total_added = 0
-        for ch in channel_links:
-            await message.reply_text(f"⏳ استخراج الروابط من: {ch}")
-            try:
-                links = await extract_links_from_channel(session_string, ch)
-                added = db.add_links(links, source_channel=ch)
-                total_added += added
-                await message.reply_text(f"✅ تم استخراج {len(links)} رابط / تم إضافة الجديد منها: {added}")
-            except Exception as e:
-                await message.reply_text(f"❌ فشل استخراج {ch}\nالسبب: {e}")
-
         USER_STATE.pop(message.from_user.id, None)
+        job = JOBS.submit(
+            "extract", f"استخراج من {len(channel_links)} قناة", message.chat.id,
+            lambda j: _extract_job(j, session_string, channel_links),
+        )
         await message.reply_text(
-            f"🏁 انتهى الاستخراج. إجمالي الروابط الجديدة: {total_added}",
+            f"🧰 Job #{job.id}: بدأ الاستخراج في الخلفية.\n"
+            "تابع التقدم أو ألغِ المهمة من زر 🧰 المهام.",
             reply_markup=main_keyboard()
         )
         return
 
 
-async def orchestrate_join(message: Message):
+async def orchestrate_join(chat_id: int, run_id: int, resume: bool = False):
     """
-    1) distribute (respect reserve)
-    2) join concurrently for all active sessions
+    1) distribute (respect reserve) - skipped when resuming
+    2) join concurrently for all sessions of the run that are not finished yet
+
+    Progress is persisted per session, so an interrupted run can be resumed.
     """
-    global JOIN_RUNNING
+    global ACTIVE_SCHEDULER
 
+    dashboard: Optional[RunDashboard] = None
     try:
-        sessions = db.list_sessions()
-        if not sessions:
-            await message.reply_text("❌ لا توجد Sessions.")
-            return
+        if not resume:
+            job = await JOBS.submit("distribute", f"توزيع الروابط (run {run_id})", chat_id, _distribute_job).wait()
+            if job.status != "done":
+                OUTBOX.send(chat_id, f"❌ فشل التوزيع (Job #{job.id}: {job.status})")
+                db.finish_join_run(run_id, "stopped")
+                return
+
+        # 2) join concurrently (sessions not finished in this run, still active)
+        active = {sid: session_string for sid, session_string, _, _ in db.list_sessions()}
+        run_sessions = [
+            r for r in db.get_run_sessions(run_id)
+            if r["status"] != "done" and r["session_id"] in active
+        ]
 
-        # 1) distribute
-        report = distribute_links_to_sessions()
-        if not report.get("ok"):
-            await message.reply_text(f"❌ فشل التوزيع: {report.get('error')}")
+        if not run_sessions:
+            OUTBOX.send(chat_id, "❌ لا توجد Sessions.")
+            db.finish_join_run(run_id, "done")
             return
 
-        txt = (
-            "📌 **تقرير التوزيع**\n"
-            f"- Sessions: {report['sessions']}\n"
-            f"- Unassigned Active Before: {report.get('unassigned_active_before')}\n"
-            f"- Reserve Target: {report.get('reserve_target')}\n"
-            f"- Distributable Before: {report.get('distributable_before')}\n"
-            f"- Assigned Total: {report['assigned_total']}\n"
-            f"- Unassigned Active After: {report.get('unassigned_active_after')}\n"
-            f"- Reserve After: {report.get('reserve_after')}\n\n"
+        run_pairs = [(r["session_id"], active[r["session_id"]]) for r in run_sessions]
+        head = "♻️ استئناف الانضمام بعد إعادة التشغيل..." if resume else "🚀 بدء الانضمام بالتوازي لكل الجلسات..."
+
+        # pinned live progress (aggregate + per session, rate, ETA)
+        dashboard = RunDashboard(
+            OUTBOX, chat_id, run_id,
+            scheduler_stats=lambda: ACTIVE_SCHEDULER.stats() if ACTIVE_SCHEDULER is not None else None,
         )
-        for row in report["per_session"]:
-            txt += f"Session {row['session_id']}: assigned {row['assigned']}\n"
 
-        await message.reply_text(txt)
+        if JOIN_WORKER_PROCESSES > 1:
+            # sharded: each worker process runs its own scheduler + Telethon clients
+            head += f"\n🧩 Worker processes: {min(JOIN_WORKER_PROCESSES, len(run_pairs))}"
+            OUTBOX.send(chat_id, head)
+            dashboard.start()
+            results = await run_sharded(run_id, run_pairs, JOIN_WORKER_PROCESSES, STOP_EVENT)
 
-        # 2) join concurrently
-        await message.reply_text("🚀 بدء الانضمام بالتوازي لكل الجلسات...")
+        else:
+            scheduler = JoinScheduler(STOP_EVENT, run_id=run_id)
+            # leases only when headless workers may hold some of these sessions
+            flood_limited = add_run_sessions(
+                scheduler, run_id, run_pairs, lease_owner=WORKER_ID if LEASES_ENABLED else None,
+            )
 
-        tasks = []
-        for sid, session_string, _, _ in sessions:
-            tasks.append(run_session_joiner(sid, session_string, limit=1000, stop_flag=STOP_EVENT))
+            if flood_limited:
+                head += "\n⏸️ FloodWait (will start after it expires): " + ", ".join(str(x) for x in flood_limited)
+            OUTBOX.send(chat_id, head)
+            dashboard.start()
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+            ACTIVE_SCHEDULER = scheduler
+            try:
+                results = await scheduler.run()
+            finally:
+                ACTIVE_SCHEDULER = None
+
+        # sessions leased by headless workers (python -m bot.worker): wait for them
+        if any(res.get("lease_lost") for res in results):
+            OUTBOX.send(chat_id, "🧩 بعض الجلسات تعمل على Workers أخرى... بانتظار انتهائها.")
+            while get_lease_backend().count_live(WORKER_ID) > 0 and not STOP_EVENT.is_set():
+                await asyncio.sleep(30)
+
+            # counters of those sessions come from the persisted run rows
+            persisted = {r["session_id"]: r for r in db.get_run_sessions(run_id)}
+            for res in results:
+                if res.get("lease_lost") and res["session_id"] in persisted:
+                    res.update(persisted[res["session_id"]])
+
+        await dashboard.stop()
 
         final_txt = "🏁 **نتيجة الانضمام**\n\n"
-        for res in results:
-            if isinstance(res, Exception):
-                final_txt += f"❌ خطأ: {res}\n"
+        saved_total = 0
+        for res in sorted(results, key=lambda x: x["session_id"]):
+            if res.get("error"):
+                final_txt += f"❌ Session {res['session_id']} خطأ: {res['error']}\n"
             else:
                 final_txt += (
                     f"- Session {res.get('session_id')}: "
                     f"✅ {res.get('success', 0)} | "
                     f"🕒 {res.get('requested', 0)} | "
-                    f"❌ {res.get('failed', 0)}\n"
+                    f"❌ {res.get('failed', 0)} | "
+                    f"🔁 {res.get('retried', 0)} | "
+                    f"⏭️ {res.get('saved_delay_slots', 0)}\n"
                 )
+                saved_total += res.get("saved_delay_slots", 0)
 
-        await message.reply_text(final_txt)
+        final_txt += f"\n⏭️ Delay slots saved (already joined): {saved_total}\n"
 
-    finally:
-        JOIN_RUNNING = False
+        OUTBOX.send(chat_id, final_txt)
+
+        db.finish_join_run(run_id, "stopped" if db.is_join_run_stopping(run_id) else "done")
+
+    except Exception as e:
+        # process restarts never reach here (those runs stay 'running' and get resumed)
+        logger.exception(f"[run {run_id}] orchestrate_join crashed: {e}")
+        db.finish_join_run(run_id, "error")
+        if dashboard is not None:
+            await dashboard.stop("⚠️ **توقف الانضمام بسبب خطأ**")
+
+
+async def resume_interrupted_runs() -> None:
+    """
+    On startup:
+    - runs left 'stopping' => finalize as 'stopped'
+    - runs left 'running'  => resume (no re-distribution)
+    """
+    for run in db.list_join_runs_by_status("stopping"):
+        db.finish_join_run(run["id"], "stopped")
+
+    for run in db.list_join_runs_by_status("running"):
+        logger.info(f"[run {run['id']}] Resuming interrupted join run")
+        chat_id = run.get("chat_id") or OWNER_ID
+        asyncio.create_task(orchestrate_join(chat_id, run["id"], resume=True))
+
+
+async def _run_bot():
+    await bot.start()
+    OUTBOX.start()
+    diagnostics.start()
+    await start_metrics_server()
+    await resume_interrupted_runs()
+    asyncio.create_task(requests_poll_loop())
+    asyncio.create_task(folder_updates_loop())
+    asyncio.create_task(health_check_loop())
+    asyncio.create_task(dead_links_loop())
+    await idle()
+    await OUTBOX.close()
+    await bot.stop()
 
 
 if __name__ == "__main__":
     db.init_db()
-    bot.run()
+    bot.run(_run_bot())
@@ -0,0 +1,263 @@
+# bot/metrics.py
+"""
+In-process metrics + optional local HTTP endpoint (Prometheus text format).
+
+Instrumented code only updates counters / histogram buckets in dicts
+(no locks, no I/O); the text is rendered when someone scrapes. With
+METRICS_PORT=0 (default) every update returns immediately and bot/db.py
+functions are not wrapped at all.
+
+    curl http://127.0.0.1:$METRICS_PORT/metrics
+"""
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from bot.config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+ENABLED = METRICS_PORT > 0
+
+# seconds; join RPCs and DB calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# FloodWait durations (seconds)
+FLOOD_BUCKETS = (5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 21600, 86400)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        super().__init__(name, doc, labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labels, k)} {_fmt_value(v)}" for k, v in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        if not ENABLED:
+            return
+        self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key => [count per bucket (+Inf last), sum]
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        row[0][bisect.bisect_left(self.buckets, value)] += 1
+        row[1] += value
+
+    def _samples(self) -> List[str]:
+        out = []
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else _fmt_value(bound)
+                labels = _fmt_labels(self.labels, key, f'le="{le}"')
+                out.append(f"{self.name}_bucket{labels} {cumulative}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {cumulative}")
+        return out
+
+
+# ---------------- metrics ----------------
+JOIN_RPC_SECONDS = Histogram(
+    "joiner_join_rpc_seconds", "Join RPC latency by link kind and outcome", ("kind", "outcome"),
+)
+JOIN_OUTCOMES = Counter(
+    "joiner_join_outcomes_total", "Join attempts by link kind and outcome", ("kind", "outcome"),
+)
+FLOOD_WAIT_SECONDS = Histogram(
+    "joiner_flood_wait_seconds", "FloodWait durations requested by Telegram on joins", buckets=FLOOD_BUCKETS,
+)
+SESSION_ACTIVE_SECONDS = Counter(
+    "joiner_session_active_seconds_total", "Time spent inside joiner steps per session", ("session",),
+)
+SESSION_SLEEP_SECONDS = Counter(
+    "joiner_session_sleep_seconds_total", "Time between joiner steps per session (delays, FloodWait)", ("session",),
+)
+EXTRACT_MESSAGES = Counter(
+    "extractor_messages_total", "Channel messages scanned by the extractor",
+)
+EXTRACT_SECONDS = Counter(
+    "extractor_seconds_total", "Time spent iterating channel messages",
+)
+EXTRACT_RATE = Gauge(
+    "extractor_messages_per_second", "Scan speed of the last finished channel extraction",
+)
+DEAD_RECHECKS = Counter(
+    "dead_link_rechecks_total", "Dead link rechecks by link kind and outcome (alive / dead / error)", ("kind", "outcome"),
+)
+DB_CALL_SECONDS = Histogram(
+    "db_call_seconds", "bot/db.py call latency per function", ("function",),
+)
+
+
+def observe_join(kind: str, outcome: str, seconds: float) -> None:
+    JOIN_RPC_SECONDS.observe(seconds, kind=kind, outcome=outcome)
+    JOIN_OUTCOMES.inc(kind=kind, outcome=outcome)
+
+
+def observe_extraction(messages: int, seconds: float) -> None:
+    EXTRACT_MESSAGES.inc(messages)
+    EXTRACT_SECONDS.inc(seconds)
+    if seconds > 0:
+        EXTRACT_RATE.set(round(messages / seconds, 2))
+
+
+def observe_dead_recheck(kind: str, outcome: str) -> None:
+    DEAD_RECHECKS.inc(kind=kind, outcome=outcome)
+
+
+def instrument_functions(
+    namespace: Dict, observe: Callable[[str, float], None], exclude: Iterable[str] = (),
+) -> int:
+    """
+    Replace the public plain functions defined in a module namespace
+    (pass globals()) by wrappers calling observe(function name, seconds)
+    after every call. Callers only do this when someone consumes the
+    numbers (metrics / diagnostics enabled).
+    Returns number of wrapped functions.
+    """
+    skip = set(exclude)
+    module = namespace.get("__name__")
+    wrapped = 0
+    for name, fn in list(namespace.items()):
+        if (
+            name.startswith("_") or name in skip or not inspect.isfunction(fn)
+            or fn.__module__ != module or inspect.iscoroutinefunction(fn)
+        ):
+            continue
+        namespace[name] = _timed(fn, observe)
+        wrapped += 1
+    return wrapped
+
+
+def _timed(fn: Callable, observe: Callable[[str, float], None]) -> Callable:
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            observe(name, time.perf_counter() - t0)
+
+    return wrapper
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------- HTTP endpoint ----------------
+# path => handler returning (content type, body); other modules may add routes
+ROUTES: Dict[str, Callable[[], Tuple[str, str]]] = {
+    "/metrics": lambda: ("text/plain; version=0.0.4; charset=utf-8", render()),
+}
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+        # drain headers
+        while (await asyncio.wait_for(reader.readline(), timeout=10)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+        handler = ROUTES.get(path)
+
+        if handler is None:
+            status, ctype, body = "404 Not Found", "text/plain", "not found\n"
+        else:
+            status = "200 OK"
+            ctype, body = handler()
+
+        data = body.encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"[metrics] request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[asyncio.AbstractServer]:
+    """
+    Serve ROUTES on host:port (METRICS_PORT=0 => disabled, returns None).
+    """
+    if port <= 0:
+        return None
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info(f"[metrics] serving on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,342 @@
+# bot/notifier.py
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from bot.config import OUTBOX_MIN_INTERVAL_SECONDS, PROGRESS_EDIT_INTERVAL_SECONDS
+from bot import db
+
+logger = logging.getLogger(__name__)
+
+# Telegram message text limit (keep a margin for entities)
+MAX_TEXT_LEN = 4000
+
+# per-session lines in the progress message (the rest is summarized)
+PROGRESS_MAX_SESSION_LINES = 25
+
+
+class _Item:
+    __slots__ = ("kind", "chat_id", "message_id", "text", "kwargs", "future")
+
+    def __init__(self, kind, chat_id, message_id, text, kwargs, future):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+
+
+class Outbox:
+    """
+    Single rate-limited queue for all bot output.
+
+    - send()/edit()/send_document() only enqueue and return a Future (never block the caller)
+    - items with the same key that are still queued are merged: the newest
+      text replaces the old one in place (progress edits, status lines)
+    - one worker sends at most one request per OUTBOX_MIN_INTERVAL_SECONDS
+      and sleeps through Bot API FloodWait instead of dropping messages
+    """
+
+    def __init__(self, client, min_interval: float = OUTBOX_MIN_INTERVAL_SECONDS):
+        self.client = client
+        self.min_interval = min_interval
+
+        self._items: "OrderedDict[Hashable, _Item]" = OrderedDict()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.merged = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 10) -> None:
+        await self.flush(timeout)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def flush(self, timeout: float = 10) -> None:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[outbox] flush timed out with {len(self._items)} queued")
+
+    def _enqueue(self, key, kind, chat_id, message_id, text, kwargs) -> asyncio.Future:
+        if key is None:
+            key = ("_", next(self._seq))
+
+        if kind != "document" and len(text) > MAX_TEXT_LEN:
+            text = text[:MAX_TEXT_LEN - 1] + "…"
+
+        queued = self._items.get(key)
+        if queued is not None:
+            # merge: newest content wins, same position, same future
+            queued.text = text
+            queued.kwargs = kwargs
+            if message_id is not None:
+                queued.message_id = message_id
+            self.merged += 1
+            return queued.future
+
+        future = asyncio.get_running_loop().create_future()
+        self._items[key] = _Item(kind, chat_id, message_id, text, kwargs, future)
+        self._idle.clear()
+        self._wakeup.set()
+        return future
+
+    def send(self, chat_id: int, text: str, key: Hashable = None, **kwargs) -> asyncio.Future:
+        """
+        Queue a new message. Future resolves to the sent Message (or None on error).
+        """
+        return self._enqueue(key, "send", chat_id, None, text, kwargs)
+
+    def edit(self, chat_id: int, message_id: int, text: str, key: Hashable = None, **kwargs) -> asyncio.Future:
+        """
+        Queue an edit; queued edits of the same message are merged by default.
+        """
+        if key is None:
+            key = ("edit", chat_id, message_id)
+        return self._enqueue(key, "edit", chat_id, message_id, text, kwargs)
+
+    def send_document(self, chat_id: int, document: str, key: Hashable = None, **kwargs) -> asyncio.Future:
+        """
+        Queue a file upload (path in `document`, caption etc. in kwargs).
+        """
+        return self._enqueue(key, "document", chat_id, None, document, kwargs)
+
+    async def _call(self, item: _Item):
+        if item.kind == "send":
+            return await self.client.send_message(item.chat_id, item.text, **item.kwargs)
+        if item.kind == "document":
+            return await self.client.send_document(item.chat_id, item.text, **item.kwargs)
+        try:
+            return await self.client.edit_message_text(item.chat_id, item.message_id, item.text, **item.kwargs)
+        except MessageNotModified:
+            return None
+
+    async def _run(self) -> None:
+        while True:
+            if not self._items:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # taken out of the queue while in flight: new content for the
+            # same key queues a fresh item instead of merging into a sent one
+            key, item = self._items.popitem(last=False)
+            try:
+                result = await self._call(item)
+            except FloodWait as e:
+                wait_s = float(getattr(e, "value", 5) or 5)
+                logger.warning(f"[outbox] Bot API FloodWait {wait_s}s ({len(self._items) + 1} queued)")
+
+                newer = self._items.get(key)
+                if newer is not None:
+                    # superseded while in flight: the newer item answers both
+                    newer.future.add_done_callback(
+                        lambda f, old=item.future: old.done() or old.set_result(f.result())
+                    )
+                else:
+                    self._items[key] = item
+                    self._items.move_to_end(key, last=False)
+
+                await asyncio.sleep(wait_s)
+                continue
+            except Exception as e:
+                logger.warning(f"[outbox] {item.kind} to {item.chat_id} failed: {e}")
+                result = None
+
+            if not item.future.done():
+                item.future.set_result(result)
+
+            self.sent += 1
+            await asyncio.sleep(self.min_interval)
+
+
+class StatusMessage:
+    """
+    One message that is updated in place (extraction progress, job status):
+    the first update sends it, later ones edit it; updates made before the
+    send completes are merged into the queued send.
+    """
+
+    def __init__(self, outbox: Outbox, chat_id: int, **kwargs):
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.key = ("status", next(outbox._seq))
+
+        self.message_id: Optional[int] = None
+        self._sent: Optional[asyncio.Future] = None
+        self._text = ""
+
+    def update(self, text: str, **kwargs) -> None:
+        self._text = text
+        kwargs = {**self.kwargs, **kwargs}
+
+        if self.message_id is not None:
+            self.outbox.edit(self.chat_id, self.message_id, text, **kwargs)
+            return
+
+        first = self._sent is None
+        self._sent = self.outbox.send(self.chat_id, text, key=self.key, **kwargs)
+        if first:
+            self._sent.add_done_callback(lambda f: self._on_sent(f, kwargs))
+
+    def _on_sent(self, future: asyncio.Future, kwargs) -> None:
+        msg = None if future.cancelled() else future.result()
+        if msg is None:
+            # send failed: next update tries a new message
+            self._sent = None
+            return
+
+        self.message_id = msg.id
+        # text changed after the send left the queue (markdown-formatted texts
+        # may cost one redundant edit; MessageNotModified is ignored)
+        if msg.text != self._text:
+            self.outbox.edit(self.chat_id, self.message_id, self._text, **kwargs)
+
+
+def _fmt_duration(hours: Optional[float]) -> str:
+    if hours is None:
+        return "-"
+    minutes = int(hours * 60)
+    return f"{minutes // 60}h{minutes % 60:02d}m"
+
+
+class RunDashboard:
+    """
+    One pinned progress message per join run, edited every
+    PROGRESS_EDIT_INTERVAL_SECONDS through the Outbox (edits coalesce).
+
+    Counters come from the persisted run rows (join_run_sessions), so
+    sessions driven by worker processes / headless workers show up too.
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        chat_id: int,
+        run_id: int,
+        scheduler_stats: Optional[Callable[[], Dict[str, Any]]] = None,
+        interval: float = PROGRESS_EDIT_INTERVAL_SECONDS,
+    ):
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.run_id = run_id
+        self.scheduler_stats = scheduler_stats
+        self.interval = interval
+
+        self.message_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._t0 = time.time()
+        self._processed0: Optional[int] = None
+
+    def render(self, title: str = "📡 **تقدم الانضمام**") -> str:
+        rows = db.get_run_sessions(self.run_id)
+        pending = db.count_pending_per_session()
+
+        success = sum(r["success"] for r in rows)
+        failed = sum(r["failed"] for r in rows)
+        requested = sum(r["requested"] for r in rows)
+        saved = sum(r["saved_delay_slots"] for r in rows)
+        remaining = sum(pending.get(r["session_id"], 0) for r in rows)
+
+        processed = success + failed + requested
+        if self._processed0 is None:
+            self._processed0 = processed
+
+        elapsed_h = max(1e-6, (time.time() - self._t0) / 3600)
+        rate = (processed - self._processed0) / elapsed_h
+        eta_h = remaining / rate if rate > 0 else None
+
+        by_status: Dict[str, int] = {}
+        for r in rows:
+            by_status[r["status"]] = by_status.get(r["status"], 0) + 1
+
+        txt = (
+            f"{title} (run {self.run_id})\n\n"
+            f"✅ {success} | 🕒 {requested} | ❌ {failed} | ⏭️ {saved}\n"
+            f"⏳ Remaining: {remaining}\n"
+            f"⚡ Rate: {rate:.1f} links/h | ETA: {_fmt_duration(eta_h)}\n"
+            f"👥 Sessions: " + ", ".join(f"{k} {v}" for k, v in sorted(by_status.items())) + "\n"
+        )
+
+        if self.scheduler_stats is not None:
+            try:
+                sch = self.scheduler_stats()
+            except Exception:
+                sch = None
+            if sch:
+                txt += (
+                    f"⏱️ In flight {sch['in_flight']}/{sch['max_workers']} | "
+                    f"due {sch['queue_depth']} | lag {sch['lag_avg']}s\n"
+                )
+
+        txt += "\n"
+        for r in rows[:PROGRESS_MAX_SESSION_LINES]:
+            txt += (
+                f"- {r['session_id']} [{r['status']}]: ✅ {r['success']} ❌ {r['failed']} "
+                f"🕒 {r['requested']} ⏳ {pending.get(r['session_id'], 0)}\n"
+            )
+        if len(rows) > PROGRESS_MAX_SESSION_LINES:
+            txt += f"… +{len(rows) - PROGRESS_MAX_SESSION_LINES} sessions\n"
+
+        txt += f"\n🕐 {time.strftime('%H:%M:%S')}"
+        return txt
+
+    def start(self) -> None:
+        """
+        Queue the progress message; pinning and periodic edits follow in the
+        background once it is sent (the join pipeline never waits on it).
+        """
+        self._task = asyncio.create_task(self._run(self.outbox.send(self.chat_id, self.render())))
+
+    async def _run(self, sent: asyncio.Future) -> None:
+        msg = await sent
+        if msg is None:
+            return
+        self.message_id = msg.id
+
+        try:
+            await self.outbox.client.pin_chat_message(self.chat_id, self.message_id, disable_notification=True)
+        except Exception as e:
+            logger.warning(f"[dashboard] pin failed: {e}")
+
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"[dashboard] refresh failed: {e}")
+
+    def refresh(self) -> None:
+        if self.message_id is not None:
+            self.outbox.edit(self.chat_id, self.message_id, self.render())
+
+    async def stop(self, title: str = "🏁 **انتهى الانضمام**") -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self.message_id is None:
+            return
+
+        self.outbox.edit(self.chat_id, self.message_id, self.render(title))
+        try:
+            await self.outbox.client.unpin_chat_message(self.chat_id, self.message_id)
+        except Exception as e:
+            logger.warning(f"[dashboard] unpin failed: {e}")
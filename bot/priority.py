@@ -0,0 +1,76 @@
+# bot/priority.py
+import time
+from typing import Optional, Tuple
+
+from bot.config import (
+    PRIORITY_FRESHNESS_WEIGHT,
+    PRIORITY_FRESHNESS_HALF_LIFE_DAYS,
+    PRIORITY_SOURCE_WEIGHT,
+    PRIORITY_ATTEMPT_PENALTY,
+    PRIORITY_KIND_WEIGHTS,
+)
+
+# source channel with no finished joins yet: neutral success rate
+SOURCE_PRIOR_OK = 1
+SOURCE_PRIOR_TOTAL = 2
+
+
+def freshness(msg_date: Optional[float], now: Optional[float] = None) -> float:
+    """
+    1.0 for a link posted just now, halves every PRIORITY_FRESHNESS_HALF_LIFE_DAYS.
+    Unknown source message date (older imports) => 0.
+    """
+    if not msg_date:
+        return 0.0
+    age_days = max(0.0, ((now or time.time()) - msg_date) / 86400)
+    return 0.5 ** (age_days / PRIORITY_FRESHNESS_HALF_LIFE_DAYS)
+
+
+def source_quality(ok: int, bad: int) -> float:
+    """
+    Smoothed success rate of links from one source channel (0..1).
+    ok: success/requested, bad: failed or dead.
+    """
+    return (ok + SOURCE_PRIOR_OK) / (ok + bad + SOURCE_PRIOR_TOTAL)
+
+
+def link_priority(
+    kind: str,
+    msg_date: Optional[float],
+    quality: float,
+    attempts: int = 0,
+    now: Optional[float] = None,
+) -> float:
+    """
+    Score used to order pending / reserve links (higher is served first).
+    """
+    return round(
+        PRIORITY_FRESHNESS_WEIGHT * freshness(msg_date, now)
+        + PRIORITY_KIND_WEIGHTS.get(kind, 0.0)
+        + PRIORITY_SOURCE_WEIGHT * quality
+        - PRIORITY_ATTEMPT_PENALTY * (attempts or 0),
+        4,
+    )
+
+
+def link_priority_sql(now: Optional[float] = None) -> Tuple[str, tuple]:
+    """
+    link_priority() as an SQL expression over the columns kind, msg_date,
+    quality and attempts, with its parameters: rescores many links inside
+    SQLite. Needs pow() (bot.db registers it on builds without math functions).
+    """
+    kinds = " ".join("WHEN ? THEN ?" for _ in PRIORITY_KIND_WEIGHTS)
+    kind_weight = f"CASE kind {kinds} ELSE 0.0 END" if kinds else "0.0"
+    sql = f"""round(
+        ? * (CASE WHEN COALESCE(msg_date, 0) = 0 THEN 0.0
+                  ELSE pow(0.5, max(0.0, (? - msg_date) / 86400.0) / ?) END)
+        + ({kind_weight})
+        + ? * quality
+        - ? * COALESCE(attempts, 0),
+        4)"""
+    params = (
+        PRIORITY_FRESHNESS_WEIGHT, now or time.time(), PRIORITY_FRESHNESS_HALF_LIFE_DAYS,
+        *(x for item in PRIORITY_KIND_WEIGHTS.items() for x in item),
+        PRIORITY_SOURCE_WEIGHT, PRIORITY_ATTEMPT_PENALTY,
+    )
+    return sql, params
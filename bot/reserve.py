@@ -0,0 +1,101 @@
+# bot/reserve.py
+import math
+import time
+from typing import Any, Dict, Optional
+
+from bot.config import (
+    RESERVE_LINKS,
+    RESERVE_LINKS_MAX,
+    RESERVE_RECALC_SECONDS,
+    RESERVE_SAFETY_FACTOR,
+    RESERVE_WINDOW_HOURS,
+)
+from bot import db
+
+# dead rate assumed without history, and how many observations it weighs
+PRIOR_DEAD_RATE = 0.1
+PRIOR_WEIGHT = 10
+
+_cached: Optional[Dict[str, Any]] = None
+_cached_at = 0.0
+
+
+def _dead_rate(dead: int, total: int) -> float:
+    return (dead + PRIOR_DEAD_RATE * PRIOR_WEIGHT) / (total + PRIOR_WEIGHT)
+
+
+def compute_reserve_target() -> Dict[str, Any]:
+    """
+    Reserve needed to replace the links expected to turn out dead.
+
+    Dead probability of a link = mean of the rolling dead rate of its source
+    channel and of the session it is assigned to (join_log 'dead_link').
+    Unassigned links use their source rate blended with the mean session rate.
+
+    The reserve is what stays unassigned, so distributing more links
+    shrinks it while raising expected dead links. With f = safety factor,
+    D = expected dead among pending, p = mean dead rate of unassigned links
+    and U = unassigned links, the target T solves T = f * (D + p * (U - T)):
+        T = f * (D + p * U) / (1 + f * p)
+    clamped to [RESERVE_LINKS, RESERVE_LINKS_MAX].
+    """
+    source_stats = db.get_source_dead_stats(RESERVE_WINDOW_HOURS)
+    session_stats = db.get_session_join_stats(RESERVE_WINDOW_HOURS)
+    pending, unassigned = db.count_open_links_by_source()
+
+    def source_rate(src: str) -> float:
+        st = source_stats.get(src, {"dead": 0, "ok": 0})
+        return _dead_rate(st["dead"], st["dead"] + st["ok"])
+
+    session_rates = {
+        sid: _dead_rate(st.get("dead", 0), st.get("rpcs", 0))
+        for sid, st in session_stats.items()
+    }
+    mean_session_rate = (
+        sum(session_rates.values()) / len(session_rates) if session_rates else PRIOR_DEAD_RATE
+    )
+
+    expected_dead_pending = sum(
+        n * (source_rate(src) + session_rates.get(sid, mean_session_rate)) / 2
+        for sid, src, n in pending
+    )
+
+    unassigned_total = sum(unassigned.values())
+    unassigned_dead = sum(
+        n * (source_rate(src) + mean_session_rate) / 2 for src, n in unassigned.items()
+    )
+    p = unassigned_dead / unassigned_total if unassigned_total else 0.0
+
+    f = RESERVE_SAFETY_FACTOR
+    raw = f * (expected_dead_pending + p * unassigned_total) / (1 + f * p)
+    target = min(RESERVE_LINKS_MAX, max(RESERVE_LINKS, math.ceil(raw)))
+
+    return {
+        "target": target,
+        "raw_target": round(raw, 1),
+        "expected_dead_pending": round(expected_dead_pending, 1),
+        "pending": sum(n for _, _, n in pending),
+        "unassigned_dead_rate": round(p, 4),
+        "floor": RESERVE_LINKS,
+        "ceiling": RESERVE_LINKS_MAX,
+    }
+
+
+def reserve_info(force: bool = False) -> Dict[str, Any]:
+    """
+    compute_reserve_target(), cached for RESERVE_RECALC_SECONDS
+    (top-ups of every session ask for it during a run).
+    """
+    global _cached, _cached_at
+
+    now = time.time()
+    if force or _cached is None or now - _cached_at >= RESERVE_RECALC_SECONDS:
+        _cached = compute_reserve_target()
+        _cached_at = now
+    return _cached
+
+
+def reserve_target(force: bool = False) -> int:
+    if RESERVE_LINKS_MAX == RESERVE_LINKS:
+        return RESERVE_LINKS
+    return reserve_info(force)["target"]
@@ -0,0 +1,205 @@
+# bot/scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from bot.config import JOIN_MAX_WORKERS
+from bot.joiner import SessionJoiner
+from bot import db
+
+logger = logging.getLogger(__name__)
+
+# how often the persisted run stop flag is polled (other processes / restarts)
+STOP_POLL_SECONDS = 5
+
+
+class JoinScheduler:
+    """
+    Single scheduler for all sessions of a join run.
+
+    - min-heap of (next_eligible_time, seq, SessionJoiner)
+    - due sessions are dispatched to at most `max_workers` concurrent steps
+    - one timer for the earliest deadline => idle sessions cost nothing
+    - STOP_EVENT (or persisted stop of run_id) wakes the loop immediately;
+      no session is left sleeping through a 90s delay or a FloodWait
+    """
+
+    def __init__(
+        self,
+        stop_event: asyncio.Event,
+        run_id: Optional[int] = None,
+        max_workers: int = JOIN_MAX_WORKERS,
+    ):
+        self.stop_event = stop_event
+        self.run_id = run_id
+        self.max_workers = max(1, max_workers)
+
+        self._heap: List[Tuple[float, int, SessionJoiner]] = []
+        self._seq = itertools.count()
+        self._in_flight: set = set()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._results: List[Dict[str, Any]] = []
+
+        self.dispatched = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_avg = 0.0
+
+    # ---------------- queue ----------------
+    def add(self, joiner: SessionJoiner, delay: float = 0.0) -> None:
+        loop = asyncio.get_running_loop()
+        heapq.heappush(self._heap, (loop.time() + max(0.0, delay), next(self._seq), joiner))
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        queue_depth: sessions due now but not yet dispatched (worker limit / lag)
+        waiting: sessions sleeping until their next eligible time
+        """
+        now = asyncio.get_running_loop().time()
+        due = sum(1 for t, _, _ in self._heap if t <= now)
+        return {
+            "sessions": len(self._heap) + len(self._in_flight),
+            "queue_depth": due,
+            "waiting": len(self._heap) - due,
+            "in_flight": len(self._in_flight),
+            "max_workers": self.max_workers,
+            "dispatched": self.dispatched,
+            "lag_last": round(self.lag_last, 3),
+            "lag_avg": round(self.lag_avg, 3),
+            "lag_max": round(self.lag_max, 3),
+            "stopping": self._stopping,
+        }
+
+    def _record_lag(self, lag: float) -> None:
+        lag = max(0.0, lag)
+        self.lag_last = lag
+        self.lag_max = max(self.lag_max, lag)
+        # EMA over recent dispatches
+        self.lag_avg = lag if self.dispatched == 0 else (0.9 * self.lag_avg + 0.1 * lag)
+        self.dispatched += 1
+
+    # ---------------- run ----------------
+    async def run(self) -> List[Dict[str, Any]]:
+        """
+        Drive all sessions until every queue is finished or stop is requested.
+        Returns one result dict per session ("error" key on failure).
+        """
+        loop = asyncio.get_running_loop()
+        watcher = asyncio.create_task(self._watch_stop())
+
+        try:
+            while not self._stopping:
+                if not self._heap and not self._in_flight:
+                    break
+
+                now = loop.time()
+                has_slot = len(self._in_flight) < self.max_workers
+
+                if self._heap and has_slot and self._heap[0][0] <= now:
+                    due, _, joiner = heapq.heappop(self._heap)
+                    self._record_lag(now - due)
+
+                    task = asyncio.create_task(self._dispatch(joiner))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._on_done)
+                    continue
+
+                # the earliest deadline is a plain timer setting the wakeup event
+                # (wait_for would wrap every wait in a task + a cancellation)
+                timer = None
+                if self._heap and has_slot:
+                    timer = loop.call_at(self._heap[0][0], self._wakeup.set)
+
+                self._wakeup.clear()
+                try:
+                    await self._wakeup.wait()
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+
+        finally:
+            watcher.cancel()
+
+            # in-flight steps are single RPCs; let them finish and persist
+            if self._in_flight:
+                await asyncio.gather(*list(self._in_flight), return_exceptions=True)
+
+            leftovers = [joiner for _, _, joiner in self._heap]
+            self._heap.clear()
+            for joiner in leftovers:
+                await joiner.close("stopped")
+                self._results.append(joiner.result())
+
+        return self._results
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._in_flight.discard(task)
+        self._wakeup.set()
+
+    async def _dispatch(self, joiner: SessionJoiner) -> None:
+        try:
+            delay = await joiner.step()
+        except Exception as e:
+            logger.error(f"[scheduler] Session {joiner.session_id} crashed: {e}")
+            await joiner.close("error")
+            res = joiner.result()
+            res["error"] = str(e)
+            self._results.append(res)
+            return
+
+        if delay is None:
+            await joiner.close("done")
+            self._results.append(joiner.result())
+            return
+
+        if self._stopping:
+            await joiner.close("stopped")
+            self._results.append(joiner.result())
+            return
+
+        loop = asyncio.get_running_loop()
+        heapq.heappush(self._heap, (loop.time() + delay, next(self._seq), joiner))
+
+    async def _watch_stop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), timeout=STOP_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                if self.run_id is None or not db.is_join_run_stopping(self.run_id):
+                    continue
+
+            logger.info("[scheduler] Stop requested, waking up")
+            self._stopping = True
+            self._wakeup.set()
+            return
+
+
+def add_run_sessions(
+    scheduler: JoinScheduler,
+    run_id: Optional[int],
+    sessions: List[Tuple[int, str]],
+    limit: int = 1000,
+    lease_owner: Optional[str] = None,
+) -> List[int]:
+    """
+    Create a SessionJoiner per (session_id, session_string) and queue it,
+    delayed until its persisted FloodWait window expires.
+    Returns ids of sessions that start flood-limited.
+    """
+    flood_limited = []
+    for sid, session_string in sessions:
+        joiner = SessionJoiner(sid, session_string, limit=limit, run_id=run_id, lease_owner=lease_owner)
+
+        delay = joiner.initial_delay()
+        if delay > 0:
+            flood_limited.append(sid)
+            if run_id is not None:
+                db.set_run_session_status(run_id, sid, "flood_wait")
+
+        scheduler.add(joiner, delay=delay)
+
+    return flood_limited
@@ -0,0 +1,158 @@
+# bot/session_import.py
+import asyncio
+import logging
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telethon import errors
+
+from bot.clients import new_client
+from bot.config import SESSION_IMPORT_CONCURRENCY, SESSION_VALIDATE_TIMEOUT_SECONDS
+from bot import db
+
+logger = logging.getLogger(__name__)
+
+# same rule as the single paste flow
+MIN_SESSION_LEN = 100
+
+# the account behind the session is gone: importing it would only fail later
+# (AuthKeyDuplicatedError is not here: it also fires when the same session is
+# connected elsewhere at the same time, e.g. by a running joiner => 'error')
+REVOKED_EXCEPTIONS = (
+    errors.AuthKeyUnregisteredError,
+    errors.SessionRevokedError,
+    errors.SessionExpiredError,
+    errors.UserDeactivatedError,
+    errors.UserDeactivatedBanError,
+)
+
+STATUS_ICONS = {"added": "✅", "duplicate": "⚠️", "invalid": "❌", "revoked": "☠️", "error": "❗"}
+
+
+def parse_session_lines(text: str) -> List[Tuple[int, str]]:
+    """
+    (line number, session string) for every non-empty line.
+    Lines may carry extra fields ("phone session", "session,note"...):
+    the longest token is taken as the session string. '#' lines are comments.
+    """
+    entries = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        tokens = [t for t in re.split(r"[\s,;|]+", line) if t]
+        entries.append((line_no, max(tokens, key=len)))
+    return entries
+
+
+def mask_session(session_string: str) -> str:
+    return f"{session_string[:6]}…{session_string[-4:]}"
+
+
+async def validate_session(session_string: str, timeout: float = SESSION_VALIDATE_TIMEOUT_SECONDS) -> Dict:
+    """
+    connect + get_me. Returns {"status": ok|invalid|revoked|error, "phone", "dc_id", "error"};
+    ok results also carry "latency_ms" (get_me round trip) and "restricted" /
+    "restriction" (account restriction flags set by Telegram).
+    """
+    try:
+        client = new_client(session_string)
+    except ValueError:
+        return {"status": "invalid", "error": "not a valid StringSession"}
+
+    async def _check() -> Dict:
+        await client.connect()
+        if not await client.is_user_authorized():
+            return {"status": "revoked", "error": "not authorized"}
+        t0 = time.monotonic()
+        me = await client.get_me()
+        reasons = getattr(me, "restriction_reason", None) or []
+        return {
+            "status": "ok",
+            "phone": me.phone or "",
+            "dc_id": client.session.dc_id,
+            "latency_ms": int((time.monotonic() - t0) * 1000),
+            "restricted": bool(getattr(me, "restricted", False)),
+            "restriction": ", ".join(f"{r.platform}:{r.reason}" for r in reasons),
+        }
+
+    try:
+        return await asyncio.wait_for(_check(), timeout=timeout)
+    except REVOKED_EXCEPTIONS as e:
+        return {"status": "revoked", "error": type(e).__name__}
+    except asyncio.TimeoutError:
+        return {"status": "error", "error": f"timeout ({timeout}s)"}
+    except Exception as e:
+        return {"status": "error", "error": f"{type(e).__name__}: {e}"}
+    finally:
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
+
+async def import_sessions(
+    text: str,
+    concurrency: int = SESSION_IMPORT_CONCURRENCY,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict:
+    """
+    Bulk import of session strings (one per line):
+    - known sessions (DB or earlier line) are reported as duplicates without connecting
+    - the rest is validated by a pool of `concurrency` clients
+    - valid ones are inserted in one transaction with phone + DC
+
+    progress(validated, to_validate) is called after every validation.
+    Returns counts per status and one report line per input line.
+    """
+    entries = parse_session_lines(text)
+    existing = db.get_existing_session_strings([s for _, s in entries])
+
+    results: Dict[int, Dict] = {}
+    to_validate: List[Tuple[int, str]] = []
+    seen = set()
+    for line_no, s in entries:
+        if len(s) < MIN_SESSION_LEN:
+            results[line_no] = {"status": "invalid", "error": "too short"}
+        elif s in existing or s in seen:
+            results[line_no] = {"status": "duplicate"}
+        else:
+            to_validate.append((line_no, s))
+        seen.add(s)
+
+    sem = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def _one(line_no: int, s: str) -> None:
+        nonlocal done
+        async with sem:
+            results[line_no] = await validate_session(s)
+        done += 1
+        if progress is not None:
+            progress(done, len(to_validate))
+
+    await asyncio.gather(*(_one(line_no, s) for line_no, s in to_validate))
+
+    valid = [(line_no, s) for line_no, s in to_validate if results[line_no]["status"] == "ok"]
+    ids = db.add_sessions_bulk([(s, results[n]["phone"], results[n]["dc_id"]) for n, s in valid])
+    for (line_no, _), session_id in zip(valid, ids):
+        res = results[line_no]
+        res["status"] = "added" if session_id is not None else "duplicate"
+        res["session_id"] = session_id
+
+    report = {k: 0 for k in STATUS_ICONS}
+    report["lines"] = []
+    for line_no, s in entries:
+        res = results[line_no]
+        report[res["status"]] += 1
+
+        line = f"L{line_no} {STATUS_ICONS[res['status']]} {res['status']} {mask_session(s)}"
+        if res["status"] == "added":
+            line += f" | id {res['session_id']} | 📱 {res['phone'] or '-'} | DC {res['dc_id']}"
+        elif res.get("error"):
+            line += f" | {res['error']}"
+        report["lines"].append(line)
+
+    logger.info(f"[import] {({k: report[k] for k in STATUS_ICONS})}")
+    return report
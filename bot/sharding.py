@@ -0,0 +1,158 @@
+# bot/sharding.py
+import asyncio
+import logging
+import multiprocessing as mp
+import queue
+from typing import Any, Dict, List, Tuple
+
+from bot.config import JOIN_MAX_WORKERS, WORKER_ID
+from bot.scheduler import JoinScheduler, add_run_sessions
+
+logger = logging.getLogger(__name__)
+
+# parent polls the result queue with this timeout to notice dead workers
+RESULT_POLL_SECONDS = 1.0
+
+# workers poll the cross-process stop event (never block on mp.Event.wait:
+# a waiter that dies while sleeping deadlocks the next set())
+STOP_POLL_SECONDS = 0.5
+
+
+def split_shards(sessions: List[Tuple[int, str]], processes: int) -> List[List[Tuple[int, str]]]:
+    """
+    Round-robin split of (session_id, session_string) into at most `processes` shards.
+    """
+    n = max(1, min(processes, len(sessions)))
+    shards: List[List[Tuple[int, str]]] = [[] for _ in range(n)]
+    for i, s in enumerate(sessions):
+        shards[i % n].append(s)
+    return shards
+
+
+# ---------------- worker process ----------------
+async def _worker_main(
+    shard_index: int,
+    run_id: int,
+    sessions: List[Tuple[int, str]],
+    max_workers: int,
+    mp_stop,
+) -> List[Dict[str, Any]]:
+    stop_event = asyncio.Event()
+
+    # bridge the cross-process stop event into this loop
+    async def _poll_stop():
+        while not mp_stop.is_set():
+            await asyncio.sleep(STOP_POLL_SECONDS)
+        stop_event.set()
+
+    poller = asyncio.create_task(_poll_stop())
+
+    scheduler = JoinScheduler(stop_event, run_id=run_id, max_workers=max_workers)
+    add_run_sessions(scheduler, run_id, sessions, lease_owner=f"{WORKER_ID}/shard{shard_index}")
+
+    logger.info(f"[shard {shard_index}] running {len(sessions)} sessions")
+    try:
+        return await scheduler.run()
+    finally:
+        poller.cancel()
+
+
+def _worker_entry(shard_index, run_id, sessions, max_workers, mp_stop, result_queue) -> None:
+    """
+    Process target: own event loop + own Telethon clients for one shard.
+    Posts ("result", shard_index, results) or ("error", shard_index, message).
+    """
+    logging.basicConfig(level=logging.INFO)
+    try:
+        results = asyncio.run(_worker_main(shard_index, run_id, sessions, max_workers, mp_stop))
+        result_queue.put(("result", shard_index, results))
+    except BaseException as e:
+        result_queue.put(("error", shard_index, f"{type(e).__name__}: {e}"))
+
+
+# ---------------- parent ----------------
+async def run_sharded(
+    run_id: int,
+    sessions: List[Tuple[int, str]],
+    processes: int,
+    stop_event: asyncio.Event,
+) -> List[Dict[str, Any]]:
+    """
+    Run a join run across N worker processes and aggregate their results.
+
+    - sessions are split round-robin; JOIN_MAX_WORKERS is split between shards
+    - stop_event is forwarded to every worker (workers also poll the
+      persisted run stop flag themselves)
+    - a worker that dies reports its sessions as errors
+
+    Returns result dicts in the same format as JoinScheduler.run().
+    """
+    shards = split_shards(sessions, processes)
+    if not sessions:
+        return []
+
+    ctx = mp.get_context("spawn")
+    result_queue = ctx.Queue()
+    mp_stop = ctx.Event()
+    per_shard_workers = max(1, JOIN_MAX_WORKERS // len(shards))
+
+    procs = []
+    for idx, shard in enumerate(shards):
+        p = ctx.Process(
+            target=_worker_entry,
+            args=(idx, run_id, shard, per_shard_workers, mp_stop, result_queue),
+            name=f"join-shard-{idx}",
+            daemon=True,
+        )
+        p.start()
+        procs.append(p)
+
+    async def _forward_stop():
+        await stop_event.wait()
+        mp_stop.set()
+
+    forwarder = asyncio.create_task(_forward_stop())
+    loop = asyncio.get_running_loop()
+
+    results: List[Dict[str, Any]] = []
+    pending = set(range(len(shards)))
+
+    try:
+        while pending:
+            try:
+                kind, idx, payload = await loop.run_in_executor(
+                    None, result_queue.get, True, RESULT_POLL_SECONDS
+                )
+            except queue.Empty:
+                # worker died without reporting
+                for idx in list(pending):
+                    if not procs[idx].is_alive():
+                        pending.discard(idx)
+                        for sid, _ in shards[idx]:
+                            results.append({
+                                "session_id": sid, "success": 0, "failed": 0, "requested": 0,
+                                "saved_delay_slots": 0,
+                                "error": f"worker process exited ({procs[idx].exitcode})",
+                            })
+                continue
+
+            pending.discard(idx)
+            if kind == "result":
+                results.extend(payload)
+            else:
+                logger.error(f"[shard {idx}] crashed: {payload}")
+                for sid, _ in shards[idx]:
+                    results.append({
+                        "session_id": sid, "success": 0, "failed": 0, "requested": 0,
+                        "saved_delay_slots": 0, "error": payload,
+                    })
+
+    finally:
+        forwarder.cancel()
+        mp_stop.set()
+        for p in procs:
+            await loop.run_in_executor(None, p.join, 10)
+            if p.is_alive():
+                p.terminate()
+
+    return results
@@ -45,6 +45,11 @@ def extract_telegram_links(text: str) -> list[str]:
     return cleaned
 
 
+_NORMALIZED_PREFIX = "https://t.me/"
+# anything urlparse / the slash cleanup below would change in the path
+_NOT_NORMALIZED_RE = re.compile(r"[?#;\\\s]|//|^/|/$")
+
+
 def normalize_tme_link(link: str) -> str:
     """
     Normalize Telegram links:
@@ -57,6 +62,12 @@ def normalize_tme_link(link: str) -> str:
     if not link:
         return ""
 
+    # already normalized (every stored link): skip urlparse
+    if link.startswith(_NORMALIZED_PREFIX):
+        path = link[len(_NORMALIZED_PREFIX):]
+        if not _NOT_NORMALIZED_RE.search(path):
+            return link
+
     # Add scheme if missing
     if link.startswith("t.me/") or link.startswith("telegram.me/"):
         link = "https://" + link
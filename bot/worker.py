@@ -0,0 +1,136 @@
+# bot/worker.py
+"""
+Headless join worker (no bot UI).
+
+Claims sessions with pending work through leases on the shared DB and
+joins for them while a join run is active (started from the bot).
+Several workers (processes or hosts) can share one DB; sessions of a
+crashed worker become claimable again when its leases expire.
+
+    python -m bot.worker [--id NAME] [--sessions K] [--processes N]
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing as mp
+import signal
+from typing import Dict
+
+from bot.config import HEADLESS_WORKERS, JOIN_LEASE_SECONDS, WORKER_ID
+from bot.joiner import run_session_joiner, sleep_or_stop
+from bot.leases import get_lease_backend
+from bot import db
+
+logger = logging.getLogger("worker")
+
+# how often an idle worker looks for an active run / claimable sessions
+IDLE_POLL_SECONDS = 15
+
+
+async def worker_loop(worker_id: str, max_sessions: int, stop_event: asyncio.Event) -> None:
+    backend = get_lease_backend()
+    running: Dict[int, asyncio.Task] = {}
+
+    logger.info(f"[worker {worker_id}] started (max sessions: {max_sessions})")
+
+    while not stop_event.is_set():
+        run = db.get_active_join_run()
+
+        if run and run["status"] == "running":
+            reclaimed = backend.reclaim_expired()
+            if reclaimed:
+                logger.info(f"[worker {worker_id}] reclaimed {reclaimed} expired lease rows")
+
+            while len(running) < max_sessions:
+                sid = backend.claim_next_session(worker_id, JOIN_LEASE_SECONDS, list(running))
+                if sid is None:
+                    break
+
+                row = db.get_session_by_id(sid)
+                if row is None:
+                    # deleted since the claim: hand the lease back
+                    backend.release(worker_id, sid)
+                    continue
+                logger.info(f"[worker {worker_id}] claimed session {sid} (run {run['id']})")
+                running[sid] = asyncio.create_task(run_session_joiner(
+                    sid, row[1], limit=1000, stop_flag=stop_event,
+                    run_id=run["id"], lease_owner=worker_id,
+                ))
+
+        if not running:
+            await sleep_or_stop(IDLE_POLL_SECONDS, stop_event)
+            continue
+
+        done, _ = await asyncio.wait(
+            running.values(), timeout=IDLE_POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED
+        )
+        for sid, task in list(running.items()):
+            if task not in done:
+                continue
+            running.pop(sid)
+            if task.exception():
+                logger.error(f"[worker {worker_id}] session {sid} crashed: {task.exception()}")
+            else:
+                logger.info(f"[worker {worker_id}] session {sid} finished: {task.result()}")
+
+    if running:
+        await asyncio.gather(*running.values(), return_exceptions=True)
+
+    logger.info(f"[worker {worker_id}] stopped")
+
+
+async def _worker_main(worker_id: str, max_sessions: int) -> None:
+    stop_event = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    await worker_loop(worker_id, max_sessions, stop_event)
+
+
+def _process_entry(worker_id: str, max_sessions: int) -> None:
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_worker_main(worker_id, max_sessions))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Headless lease-based join worker")
+    parser.add_argument("--id", default=WORKER_ID, help="worker id used in leases")
+    parser.add_argument("--sessions", type=int, default=50, help="max sessions driven concurrently")
+    parser.add_argument("--processes", type=int, default=1, help="local worker processes to start")
+    args = parser.parse_args()
+
+    # without it the bot joins for every session itself, ignoring worker leases
+    if not HEADLESS_WORKERS:
+        raise RuntimeError("HEADLESS_WORKERS=1 must be set (bot and workers) to run bot.worker")
+
+    db.init_db()
+
+    if args.processes <= 1:
+        _process_entry(args.id, args.sessions)
+        return
+
+    ctx = mp.get_context("spawn")
+    procs = [
+        ctx.Process(target=_process_entry, args=(f"{args.id}-{i}", args.sessions), name=f"worker-{i}")
+        for i in range(args.processes)
+    ]
+    for p in procs:
+        p.start()
+
+    # Ctrl+C reaches the children too; they stop gracefully, we just wait
+    for p in procs:
+        while True:
+            try:
+                p.join()
+                break
+            except KeyboardInterrupt:
+                continue
+
+
+if __name__ == "__main__":
+    main()